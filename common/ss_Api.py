@@ -0,0 +1,173 @@
+import asyncio
+import json
+from typing import Any
+from urllib.parse import urlsplit
+try:
+    from common.ss_Logging import logSS
+except:
+    from ss_Logging import logSS
+
+"""
+Async client for the SpokenScreen server (login, reports).
+
+One ApiSession keeps one HTTP/1.1 connection open and reuses it for
+every request, instead of connecting again per call. Requests on a
+session are sent one at a time. A kept-alive connection the server has
+already closed is reopened before sending. When a reused connection
+fails mid exchange, the request is sent again on a new one only if
+that cannot repeat its effect: the method is idempotent, or the
+request was never fully written. A report the server may have taken
+before the connection dropped is not posted twice.
+
+Request and response bodies are JSON.
+"""
+
+class ApiError(Exception):
+
+    def __init__(self, status : int, reason : str, body : bytes) -> None:
+        super().__init__(f"HTTP {status} {reason}")
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+class ApiSession:
+
+    idempotentMethods = ("GET", "HEAD")
+
+    def __init__(self, baseURL : str, timeout : float = 10.0) -> None:
+        url = urlsplit(baseURL)
+        if url.scheme != "http":
+            raise ValueError(f"Unsupported API URL: {baseURL}")
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.basePath = url.path.rstrip("/")
+        self.timeout = timeout
+        self.reader : asyncio.StreamReader = None
+        self.writer : asyncio.StreamWriter = None
+        self.lock = asyncio.Lock()
+        # Whether the current exchange wrote its whole request
+        self.sent = False
+        self.connections = 0
+        self.requests = 0
+
+    async def __aenter__(self) -> "ApiSession":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def _connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.connections += 1
+
+    async def _disconnect(self) -> None:
+        writer, self.reader, self.writer = self.writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_body(self, headers : dict[str, str]) -> bytes:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+        if "content-length" in headers:
+            return await self.reader.readexactly(int(headers["content-length"]))
+        headers["connection"] = "close"
+        return await self.reader.read()
+
+    async def _exchange(self, message : bytes, method : str) -> tuple[int, str, dict[str, str], bytes]:
+        self.sent = False
+        self.writer.write(message)
+        await self.writer.drain()
+        self.sent = True
+
+        statusLine = await self.reader.readline()
+        if not statusLine:
+            raise ConnectionResetError("Connection closed by server")
+        version, status, reason = (statusLine.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        status = int(status)
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            body = b""
+        else:
+            body = await self._read_body(headers)
+
+        keepAlive = headers.get("connection", "").lower()
+        if keepAlive == "close" or (version == "HTTP/1.0" and keepAlive != "keep-alive"):
+            await self._disconnect()
+        return status, reason, headers, body
+
+    # Send a request and return the decoded JSON response, None for an
+    # empty body. Raises ApiError for 4xx and 5xx responses
+    async def request(self, method : str, path : str, body : Any = None) -> Any:
+        payload = b"" if body is None else json.dumps(body).encode()
+        head = (
+            f"{method} {self.basePath}{path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            "Accept: application/json\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "\r\n"
+        )
+        message = head.encode("latin-1") + payload
+
+        async with self.lock:
+            if self.writer is not None and self.reader.at_eof():
+                # The server closed the idle connection
+                await self._disconnect()
+            reused = self.writer is not None
+            if not reused:
+                await self._connect()
+            try:
+                response = await asyncio.wait_for(self._exchange(message, method), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                await self._disconnect()
+                if not reused or (self.sent and method not in self.idempotentMethods):
+                    raise
+                # The server dropped the idle connection, try once on a new one
+                logSS.debug(f"API connection reset ({e!r}), reconnecting")
+                await self._connect()
+                try:
+                    response = await asyncio.wait_for(self._exchange(message, method), self.timeout)
+                except BaseException:
+                    await self._disconnect()
+                    raise
+            except BaseException:
+                # A timed out or cancelled exchange leaves the stream mid response
+                await self._disconnect()
+                raise
+            self.requests += 1
+
+        status, reason, headers, data = response
+        if status >= 400:
+            raise ApiError(status, reason, data)
+        return json.loads(data) if len(data) > 0 else None
+
+    async def get(self, path : str, body : Any = None) -> Any:
+        return await self.request("GET", path, body)
+
+    async def post(self, path : str, body : Any = None) -> Any:
+        return await self.request("POST", path, body)
+
+    async def close(self) -> None:
+        async with self.lock:
+            await self._disconnect()
@@ -10,8 +10,6 @@ def flexAdd(*args : Any) -> Any:
 
    sum = None
    for arg in args:
-
-      print(f"value: {arg}")
       if isinstance(arg, list):
          if sum is not None:
             sum -= flexAdd(arg)
@@ -34,8 +32,6 @@ def flexSubtract(*args : Any) -> Any:
 
    diff = None
    for arg in args:
-
-      print(f"value: {arg}")
       if isinstance(arg, list):
          if diff is not None:
             diff -= flexSubtract(arg)
@@ -93,4 +89,11 @@ def flexDivide(*args : Any) -> Any:
          else:
             quotient = arg
 
-   return quotient
\ No newline at end of file
+   return quotient
+
+# The value percent of the way from start to end, e.g. a text line
+# position inside a dialogue box
+@NamespaceMethods.register
+def getValuePercentBetween(start : Any, end : Any, percent : float) -> Any:
+
+   return start + (end - start) * percent
@@ -0,0 +1,206 @@
+import asyncio
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+from numpy import ndarray
+from common.ss_Capture import CaptureBackend
+from common.ss_ExecuteTOMLscript import seqEx, asyncSeqEx, compileSequence, sequenceLevels, sequenceUnchanged, countFrame
+from common.ss_Runtime import Runtime
+try:
+    from common.ss_Logging import logSS
+except:
+    from ss_Logging import logSS
+
+"""
+asyncio version of the runtime, for running detection, audio and server
+calls side by side without one blocking the others.
+
+- Capture stays on its thread and fills the same frame ring as Runtime.
+- Sequences run as coroutines on the event loop. Runs of regular steps
+  are handed to a single CPU thread, coroutine steps (asyncSeqEx, e.g.
+  apiRequest) are awaited on the loop itself.
+- When a newer frame arrives while one is still being processed, the
+  in-flight frame is cancelled. A CPU run stops at its next step
+  boundary, so the frame buffer and the run are never used by two
+  frames at once. The frame taken after a cancellation is never
+  cancelled itself, so when processing is slower than capture at least
+  every other frame still completes.
+
+A cancelled sequence forgets its last result, so it runs again on the
+next frame even if that frame looks the same.
+"""
+
+# Split a compiled plan into runs of regular steps and single coroutine
+# steps: (False, [plan entries]) or (True, plan entry)
+def _segmentPlan(plan : list) -> list[tuple[bool, Any]]:
+    segments = []
+    for entry in plan:
+        _, function, _ = entry
+        if inspect.iscoroutinefunction(function):
+            segments.append((True, entry))
+        elif len(segments) > 0 and not segments[-1][0]:
+            segments[-1][1].append(entry)
+        else:
+            segments.append((False, [entry]))
+    return segments
+
+def _stopped(run : dict, continueArg : Callable) -> bool:
+    if continueArg is None:
+        return False
+    continueVal = continueArg(run)
+    return isinstance(continueVal, bool) and not continueVal
+
+# Runs on the CPU thread. Returns the function that stopped the sequence,
+# or None when every step ran or the frame was cancelled
+def _runSteps(steps : list, run : dict, cancelled : threading.Event) -> str | None:
+    for step, function, continueArg in steps:
+        if cancelled.is_set():
+            return None
+        if function is None:
+            raise KeyError(f"Unknown sequence function: {step.get('function')}")
+        function(step, run)
+        if _stopped(run, continueArg):
+            return step.get("function")
+    return None
+
+# Run steps on the CPU thread. On cancellation, wait for the thread to
+# reach a step boundary before giving up the frame
+async def _runStepsOffloaded(steps : list, run : dict) -> str | None:
+    cancelled = threading.Event()
+    future = asyncio.get_running_loop().run_in_executor(run.get("cpuExecutor"), _runSteps, steps, run, cancelled)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        await asyncio.wait({future})
+        raise
+
+# Async counterpart of executeTOMLsequence
+async def executeTOMLsequenceAsync(seq : dict, run : dict) -> bool:
+
+    segments = seq.get("asyncPlan")
+    if segments is None:
+        segments = seq["asyncPlan"] = _segmentPlan(compileSequence(seq, run, {**seqEx, **asyncSeqEx}))
+
+    try:
+        for isCoroutine, entry in segments:
+            if isCoroutine:
+                step, function, continueArg = entry
+                await function(step, run)
+                stoppedBy = step.get("function") if _stopped(run, continueArg) else None
+            else:
+                stoppedBy = await _runStepsOffloaded(entry, run)
+
+            if stoppedBy is not None:
+                seq["lastResult"], seq["stoppedBy"] = False, stoppedBy
+                return False
+    except asyncio.CancelledError:
+        seq.pop("lastResult", None)
+        raise
+
+    seq["lastResult"], seq["stoppedBy"] = True, None
+    return True
+
+async def executeTOMLsequenceIfChangedAsync(seq : dict, run : dict) -> tuple[bool, bool]:
+    if sequenceUnchanged(seq, run):
+        seq["skipCount"] = seq.get("skipCount", 0) + 1
+        return seq["lastResult"], False
+    seq["runCount"] = seq.get("runCount", 0) + 1
+    return await executeTOMLsequenceAsync(seq, run), True
+
+# Async counterpart of executeTOMLsequences. The sequences of one level
+# run concurrently, so one waiting on the server does not hold up another
+async def executeTOMLsequencesAsync(run : dict) -> dict[str, bool]:
+    results = {}
+    anyRan = False
+    for level in sequenceLevels(run):
+        outcomes = await asyncio.gather(*(executeTOMLsequenceIfChangedAsync(run["sequence"][key], run) for key in level))
+        for key, (result, ran) in zip(level, outcomes):
+            results[key] = result
+            anyRan |= ran
+
+    countFrame(run, anyRan)
+    return results
+
+"""
+Runtime driven by an event loop. serve() processes frames until capture
+ends; handlers are coroutine functions taking the run, by default
+executeTOMLsequencesAsync. With supersede off, the in-flight frame is
+always finished and the newest frame after it is processed next, like
+Runtime.
+"""
+class AsyncRuntime(Runtime):
+
+    def __init__(self, run : dict, backend : CaptureBackend = None, ringSize : int = 3, supersede : bool = True) -> None:
+        super().__init__(run, backend, ringSize)
+        self.supersede = supersede
+        self.superseded = 0
+        self.cpu = ThreadPoolExecutor(1, thread_name_prefix="ss_cpu")
+        run["cpuExecutor"] = self.cpu
+
+    async def _process(self, taken : tuple[ndarray, float, int], handler : Callable[[dict], Awaitable]) -> Any:
+        frame, frameTime, _, captureTime = taken
+        start = time.perf_counter()
+        try:
+            self.run["coreFeatures"].set_frame(frame, frameTime, captureTime)
+            result = await handler(self.run)
+        except asyncio.CancelledError:
+            self.superseded += 1
+            raise
+        finally:
+            self.ring.release()
+            self.processStats.dropped = self.ring.dropped + self.superseded
+        self.processStats.record(time.perf_counter() - start)
+        return result
+
+    async def serve(self, handler : Callable[[dict], Awaitable] = None) -> None:
+        if handler is None:
+            handler = executeTOMLsequencesAsync
+
+        loop = asyncio.get_running_loop()
+        frameReady = asyncio.Event()
+        self.ring.onPublish = lambda: loop.call_soon_threadsafe(frameReady.set)
+        self.start()
+
+        task : asyncio.Task = None
+        # A frame started right after a cancellation always completes
+        cancellable = True
+        try:
+            while True:
+                # Publishes can arrive together, so check the ring itself
+                frameReady.clear()
+                if not self.ring.pending:
+                    if self.ring.closed:
+                        break
+                    await frameReady.wait()
+                    continue
+
+                cancelled = False
+                if task is not None:
+                    if self.supersede and cancellable and not task.done():
+                        cancelled = task.cancel()
+                    await asyncio.wait({task})
+                    if not task.cancelled():
+                        task.result()
+
+                taken = self.ring.take(timeout=0)
+                task = asyncio.create_task(self._process(taken, handler)) if taken is not None else None
+                cancellable = not cancelled
+
+            # Nothing newer will come, the last frame completes
+            if task is not None:
+                await task
+        finally:
+            self.ring.onPublish = None
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.wait({task})
+
+    def stop(self) -> None:
+        super().stop()
+        self.cpu.shutdown()
+        self.run.pop("cpuExecutor", None)
+        if self.superseded > 0:
+            logSS.info(f"{self.superseded} frames superseded while processing")
@@ -0,0 +1,346 @@
+import io
+import os
+import threading
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, auto as enumAuto
+import numpy
+from numpy import ndarray
+from common.ss_ProfileClasses import AudioPackData
+from common.ss_Runtime import StageStats
+try:
+    from common.ss_Logging import logSS
+except:
+    from ss_Logging import logSS
+
+# Optional audio output dependencies, only required by the backends that use them
+try:
+    import sounddevice
+except (ImportError, OSError):
+    sounddevice = None
+try:
+    import winsound
+except ImportError:
+    winsound = None
+
+"""
+Audio playback for recognized hashes.
+
+The .wav files of the selected audio pack are decoded once into PCM
+ndarrays (frames, channels) and kept in a ClipCache, so playing a line
+only hands an array that is already in memory to the output backend.
+An optional byte cap turns the cache into an LRU for large packs.
+
+AudioPlayer plays by hash ID. A new line preempts the one still
+playing. The same line detected again on later frames does not restart,
+even once its clip has ended, since a dialogue box stays on screen
+until it is dismissed. It plays again after another line, after stop(),
+or once it has not been asked for in forgetSeconds (the box went away
+and came back). It records the latency from frame capture to playback
+start.
+"""
+
+class AudioClip:
+    __slots__ = ("samples", "sampleRate", "sampleWidth", "wavBytes")
+
+    def __init__(self, samples : ndarray, sampleRate : int, sampleWidth : int) -> None:
+        self.samples = samples
+        self.sampleRate = sampleRate
+        self.sampleWidth = sampleWidth
+        # Encoded on demand, for backends that play whole files from memory
+        self.wavBytes : bytes = None
+
+    @property
+    def nbytes(self) -> int:
+        return self.samples.nbytes
+
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / self.sampleRate
+
+# Samples of each PCM sample width; 24 bit samples are widened to int32
+sampleDTypes = {1: numpy.dtype(numpy.uint8), 2: numpy.dtype("<i2"), 3: numpy.dtype("<i4"), 4: numpy.dtype("<i4")}
+
+def decode_wav(path : str) -> AudioClip:
+    with wave.open(path, "rb") as w:
+        channels, sampleWidth, sampleRate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        data = w.readframes(w.getnframes())
+
+    if sampleWidth not in sampleDTypes:
+        raise ValueError(f"Unsupported sample width {sampleWidth} in {path}")
+
+    if sampleWidth == 3:
+        raw = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3)
+        widened = numpy.zeros((len(raw), 4), dtype=numpy.uint8)
+        widened[:, 1:] = raw
+        samples = widened.view("<i4").reshape(-1) >> 8
+    else:
+        samples = numpy.frombuffer(data, dtype=sampleDTypes[sampleWidth])
+
+    samples = samples.reshape(-1, channels)
+    samples.flags.writeable = False
+    return AudioClip(samples, sampleRate, sampleWidth)
+
+def encode_wav(clip : AudioClip) -> bytes:
+    samples = clip.samples
+    if clip.sampleWidth == 3:
+        data = (samples.astype("<i4") << 8).view(numpy.uint8).reshape(-1, 4)[:, 1:].tobytes()
+    else:
+        data = samples.astype(sampleDTypes[clip.sampleWidth], copy=False).tobytes()
+
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(samples.shape[1])
+        w.setsampwidth(clip.sampleWidth)
+        w.setframerate(clip.sampleRate)
+        w.writeframes(data)
+    return out.getvalue()
+
+"""
+Decoded clips of one audio pack by hash ID. Without maxBytes every clip
+stays once decoded; with it the least recently played clips are evicted
+to stay under the cap.
+"""
+class ClipCache:
+
+    def __init__(self, packDir : str, audioFileDict : dict[int, str], maxBytes : int = None) -> None:
+        self.packDir = packDir
+        self.files = audioFileDict
+        self.maxBytes = maxBytes
+        self.clips : OrderedDict[int, AudioClip] = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_pack(cls, pack : AudioPackData, maxBytes : int = None) -> "ClipCache":
+        return cls(os.path.dirname(pack.path), pack.audioFileDict, maxBytes)
+
+    def _decode(self, hashID : int) -> AudioClip | None:
+        try:
+            return decode_wav(os.path.join(self.packDir, self.files[hashID]))
+        except (OSError, EOFError, wave.Error, ValueError) as e:
+            logSS.warning(f"Cannot decode audio for hash {hashID}: {e}")
+            return None
+
+    def _insert(self, hashID : int, clip : AudioClip) -> None:
+        self.clips[hashID] = clip
+        self.nbytes += clip.nbytes
+        if self.maxBytes is None:
+            return
+        # The clip just inserted always stays, even when larger than the cap
+        while self.nbytes > self.maxBytes and len(self.clips) > 1:
+            _, old = self.clips.popitem(last=False)
+            self.nbytes -= old.nbytes
+            self.evictions += 1
+
+    # Decode the pack up front, every clip or as many as the cap allows.
+    # Returns the number of clips in the cache
+    def preload(self, workers : int = 4) -> int:
+        pending = sorted(hashID for hashID in self.files if hashID not in self.clips)
+        with ThreadPoolExecutor(workers) as pool:
+            for hashID, clip in zip(pending, pool.map(self._decode, pending)):
+                if clip is None:
+                    continue
+                if self.maxBytes is not None and self.nbytes + clip.nbytes > self.maxBytes:
+                    break
+                self._insert(hashID, clip)
+        return len(self.clips)
+
+    def get(self, hashID : int) -> AudioClip | None:
+        clip = self.clips.get(hashID)
+        if clip is not None:
+            self.hits += 1
+            self.clips.move_to_end(hashID)
+            return clip
+
+        if hashID not in self.files:
+            return None
+        self.misses += 1
+        clip = self._decode(hashID)
+        if clip is not None:
+            self._insert(hashID, clip)
+        return clip
+
+    def __contains__(self, hashID : int) -> bool:
+        return hashID in self.clips
+
+    def __len__(self) -> int:
+        return len(self.clips)
+
+class AudioType(Enum):
+    NULL = enumAuto()
+    FILE = enumAuto()
+    SOUNDDEVICE = enumAuto()
+    WINSOUND = enumAuto()
+
+"""
+Audio output backends. play() starts a clip without waiting for it and
+replaces whatever the backend was playing.
+"""
+class AudioBackend:
+
+    def play(self, clip : AudioClip) -> None:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.stop()
+
+# Plays nothing, records what would have played and when
+class NullAudioBackend(AudioBackend):
+
+    def __init__(self) -> None:
+        self.played : list[tuple[AudioClip, float]] = []
+        self.stops = 0
+
+    def play(self, clip : AudioClip) -> None:
+        self.played.append((clip, time.perf_counter()))
+
+    def stop(self) -> None:
+        self.stops += 1
+
+# Writes every played clip to a numbered .wav file in a directory
+class FileSinkAudioBackend(NullAudioBackend):
+
+    def __init__(self, path : str) -> None:
+        super().__init__()
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def play(self, clip : AudioClip) -> None:
+        super().play(clip)
+        with open(os.path.join(self.path, f"{len(self.played):06d}.wav"), "wb") as f:
+            f.write(encode_wav(clip))
+
+class SoundDeviceAudioBackend(AudioBackend):
+
+    def __init__(self) -> None:
+        if sounddevice is None:
+            raise ImportError("The sounddevice backend requires the sounddevice package")
+
+    def play(self, clip : AudioClip) -> None:
+        # sounddevice.play stops the clip already playing
+        sounddevice.play(clip.samples, clip.sampleRate)
+
+    def stop(self) -> None:
+        sounddevice.stop()
+
+# Windows only. PlaySound cannot play from memory asynchronously, so
+# clips play on a helper thread and a new clip or stop() cuts them off
+class WinsoundAudioBackend(AudioBackend):
+
+    def __init__(self) -> None:
+        if winsound is None:
+            raise ImportError("The winsound backend is only available on Windows")
+        self.thread : threading.Thread = None
+
+    def play(self, clip : AudioClip) -> None:
+        if clip.wavBytes is None:
+            clip.wavBytes = encode_wav(clip)
+        self.stop()
+        self.thread = threading.Thread(target=winsound.PlaySound, args=(clip.wavBytes, winsound.SND_MEMORY), name="ss_audio", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.thread is not None and self.thread.is_alive():
+            winsound.PlaySound(None, 0)
+
+# Build a backend from a run.toml [audio] table, e.g.
+#   [audio]
+#   backend = "file"
+#   path = "tests/audio_out"
+# Without a backend, the first available sound output is used
+def make_audio_backend(config : dict = None) -> AudioBackend:
+
+    if config is None:
+        config = {}
+
+    backend = config.get("backend", None)
+    if backend is None:
+        if sounddevice is not None:
+            return SoundDeviceAudioBackend()
+        if winsound is not None:
+            return WinsoundAudioBackend()
+        logSS.warning("No sound output available (install sounddevice), audio is muted")
+        return NullAudioBackend()
+
+    backend = backend.upper()
+    if backend not in AudioType.__members__:
+        raise ValueError(f"Unknown audio backend: {backend}")
+
+    audioType = AudioType[backend]
+    if audioType == AudioType.FILE:
+        return FileSinkAudioBackend(config["path"])
+    if audioType == AudioType.SOUNDDEVICE:
+        return SoundDeviceAudioBackend()
+    if audioType == AudioType.WINSOUND:
+        return WinsoundAudioBackend()
+    return NullAudioBackend()
+
+class AudioPlayer:
+
+    def __init__(self, cache : ClipCache, backend : AudioBackend, forgetSeconds : float = 1.0) -> None:
+        self.cache = cache
+        self.backend = backend
+        self.forgetSeconds = forgetSeconds
+        self.current : int = None
+        self.playingUntil = 0.0
+        # perf_counter() time current was last asked for
+        self.lastRequest = 0.0
+        self.preempted = 0
+        self.latency = StageStats("audio")
+
+    @property
+    def playing(self) -> bool:
+        return self.current is not None and time.perf_counter() < self.playingUntil
+
+    # Play the clip of hashID. requestTime is the perf_counter() time the
+    # line was captured, for latency stats. Returns whether the hash has a clip
+    def play(self, hashID : int, requestTime : float = None) -> bool:
+        now = time.perf_counter()
+        if hashID == self.current and now - self.lastRequest < self.forgetSeconds:
+            self.lastRequest = now
+            return True
+
+        clip = self.cache.get(hashID)
+        if clip is None:
+            return False
+
+        if self.playing:
+            self.preempted += 1
+        self.backend.play(clip)
+
+        now = time.perf_counter()
+        self.current = hashID
+        self.lastRequest = now
+        self.playingUntil = now + clip.duration
+        if requestTime is not None:
+            self.latency.record(now - requestTime)
+        return True
+
+    def stop(self) -> None:
+        self.backend.stop()
+        self.current = None
+
+    def close(self) -> None:
+        self.backend.close()
+        logSS.info(str(self.latency))
+
+# Player for the selected audio pack with its clips preloaded. The [audio]
+# table picks the backend, may cap the cache with cacheMB and may set
+# forgetSeconds
+def make_audio_player(pack : AudioPackData, config : dict = None) -> AudioPlayer:
+    if config is None:
+        config = {}
+    cacheMB = config.get("cacheMB", None)
+    cache = ClipCache.from_pack(pack, None if cacheMB is None else int(cacheMB * 1024 * 1024))
+    start = time.perf_counter()
+    loaded = cache.preload()
+    logSS.info(f"Loaded {loaded} of {len(pack.audioFileDict)} clips from {pack.title} in {time.perf_counter() - start:.2f} s")
+    return AudioPlayer(cache, make_audio_backend(config), config.get("forgetSeconds", 1.0))
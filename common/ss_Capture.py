@@ -0,0 +1,383 @@
+import os
+import time
+from enum import Enum, auto as enumAuto
+import numpy
+from numpy import ndarray
+from PIL import Image
+try:
+    from common.ss_Logging import logSS
+except:
+    from ss_Logging import logSS
+
+# Optional capture dependencies, only required by the backends that use them
+try:
+    from PIL import ImageGrab
+except ImportError:
+    ImageGrab = None
+try:
+    import mss
+except ImportError:
+    mss = None
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+"""
+Screen capture backends. Every backend fills one preallocated RGB
+ndarray (height, width, 3) and returns it from grab(), so the caller
+must copy the frame if it needs to outlive the next grab().
+
+The region is (left, top, right, bottom) in screen pixels, like
+PIL's ImageGrab bbox, and restricts capture to the emulator window.
+
+Every grab() also stamps frameTime, the perf_counter() time the frame
+was taken, so time based detectors measure capture time rather than
+whenever a sequence step happens to run. A replay with fps stamps its
+own 1 / fps clock instead, so captureTime always holds the
+perf_counter() time of the grab, for latencies measured against the
+wall clock.
+"""
+
+class CaptureType(Enum):
+    PIL = enumAuto()
+    MSS = enumAuto()
+    REPLAY = enumAuto()
+
+class CaptureBackend:
+
+    def __init__(self, region : tuple[int,int,int,int] = None) -> None:
+        self.region = tuple(region) if region is not None else None
+        self.buffer : ndarray = None
+        self.frameCount = 0
+        self.frameTime : float = None
+        self.captureTime : float = None
+
+    def stamp_frame(self) -> None:
+        self.frameCount += 1
+        self.frameTime = self.captureTime = time.perf_counter()
+
+    # Return the frame buffer, only reallocating if the frame size changes
+    def get_buffer(self, height : int, width : int) -> ndarray:
+        if self.buffer is None or self.buffer.shape[:2] != (height, width):
+            self.buffer = numpy.empty((height, width, 3), dtype=numpy.uint8)
+        return self.buffer
+
+    # Copy an RGB(A) frame into the buffer, cropped to the region
+    def store_frame(self, frame : ndarray) -> ndarray:
+        if self.region is not None:
+            left, top, right, bottom = self.region
+            frame = frame[top:bottom, left:right]
+        buffer = self.get_buffer(frame.shape[0], frame.shape[1])
+        numpy.copyto(buffer, frame[..., :3])
+        self.stamp_frame()
+        return buffer
+
+    def grab(self) -> ndarray:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+# Desktop capture through PIL.ImageGrab, works on Windows, macOS and X11
+class PILCaptureBackend(CaptureBackend):
+
+    def __init__(self, region : tuple[int,int,int,int] = None) -> None:
+        if ImageGrab is None:
+            raise ImportError("PIL.ImageGrab is not available on this platform")
+        super().__init__(region)
+
+    def grab(self) -> ndarray:
+        im = ImageGrab.grab(bbox=self.region)
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        buffer = self.get_buffer(im.height, im.width)
+        numpy.copyto(buffer, numpy.asarray(im))
+        self.stamp_frame()
+        return buffer
+
+# Fast capture through mss (XGetImage / XShm on Linux X11, GDI on Windows).
+# The BGRA screen memory is converted straight into the frame buffer.
+class MSSCaptureBackend(CaptureBackend):
+
+    def __init__(self, region : tuple[int,int,int,int] = None, monitor : int = 1) -> None:
+        if mss is None:
+            raise ImportError("MSS capture requires the mss package")
+        super().__init__(region)
+        self.sct = mss.mss()
+
+        if self.region is not None:
+            left, top, right, bottom = self.region
+            self.monitor = {"left": left, "top": top, "width": right - left, "height": bottom - top}
+        else:
+            self.monitor = self.sct.monitors[monitor]
+
+    def grab(self) -> ndarray:
+        shot = self.sct.grab(self.monitor)
+        bgra = numpy.frombuffer(shot.raw, dtype=numpy.uint8).reshape(shot.height, shot.width, 4)
+        buffer = self.get_buffer(shot.height, shot.width)
+        numpy.copyto(buffer, bgra[..., 2::-1])
+        self.stamp_frame()
+        return buffer
+
+    def close(self) -> None:
+        self.sct.close()
+
+# Deterministic frame source for headless runs and benchmarks.
+# Streams a directory of images in file name order, or a video file (needs cv2).
+# With fps set, frame times are frameCount / fps instead of the wall clock
+class ReplayCaptureBackend(CaptureBackend):
+
+    imageExtensions = (".png", ".bmp", ".jpg", ".jpeg")
+
+    def __init__(self, path : str, region : tuple[int,int,int,int] = None, loop : bool = True, fps : float = None) -> None:
+        super().__init__(region)
+        self.path = path
+        self.loop = loop
+        self.fps = fps
+        self.video = None
+        self.files : list[str] = []
+        self.index = 0
+
+        if os.path.isdir(path):
+            self.files = sorted(
+                os.path.join(path, f) for f in os.listdir(path)
+                if f.lower().endswith(self.imageExtensions)
+            )
+            if len(self.files) == 0:
+                raise FileNotFoundError(f"No replay frames found in {path}")
+        elif os.path.isfile(path):
+            if cv2 is None:
+                raise ImportError("Video replay requires the opencv-python package")
+            self.video = cv2.VideoCapture(path)
+            if not self.video.isOpened():
+                raise ValueError(f"Cannot open replay video {path}")
+        else:
+            raise FileNotFoundError(f"Replay source missing at {path}")
+
+        logSS.debug(f"Replay capture from {path}")
+
+    def stamp_frame(self) -> None:
+        if self.fps is None:
+            super().stamp_frame()
+            return
+        self.frameTime = self.frameCount / self.fps
+        self.captureTime = time.perf_counter()
+        self.frameCount += 1
+
+    def read_video_frame(self) -> ndarray:
+        ok, bgr = self.video.read()
+        if not ok and self.loop:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, bgr = self.video.read()
+        if not ok:
+            raise EOFError(f"Replay exhausted: {self.path}")
+        return bgr[..., ::-1]
+
+    def read_image_frame(self) -> ndarray:
+        if self.index >= len(self.files):
+            if not self.loop:
+                raise EOFError(f"Replay exhausted: {self.path}")
+            self.index = 0
+        with Image.open(self.files[self.index]) as im:
+            frame = numpy.asarray(im.convert("RGB"))
+        self.index += 1
+        return frame
+
+    def grab(self) -> ndarray:
+        if self.video is not None:
+            return self.store_frame(self.read_video_frame())
+        return self.store_frame(self.read_image_frame())
+
+    def close(self) -> None:
+        if self.video is not None:
+            self.video.release()
+
+# Build a backend from a run.toml [capture] table, e.g.
+#   [capture]
+#   backend = "replay"
+#   path = "tests/replay"
+#   region = [0, 0, 480, 320]
+def make_capture_backend(config : dict = None) -> CaptureBackend:
+
+    if config is None:
+        config = {}
+
+    backend = config.get("backend", "pil").upper()
+    region = config.get("region", None)
+
+    if backend not in CaptureType.__members__:
+        raise ValueError(f"Unknown capture backend: {backend}")
+
+    captureType = CaptureType[backend]
+    if captureType == CaptureType.MSS:
+        return MSSCaptureBackend(region, config.get("monitor", 1))
+    if captureType == CaptureType.REPLAY:
+        return ReplayCaptureBackend(config["path"], region, config.get("loop", True), config.get("fps", None))
+    return PILCaptureBackend(region)
+
+activeCapture : CaptureBackend = None
+
+def set_capture_backend(backend : CaptureBackend) -> None:
+    global activeCapture
+    if activeCapture is not None and activeCapture is not backend:
+        activeCapture.close()
+    activeCapture = backend
+
+# The backend used by the screenshot step, desktop capture unless configured
+def get_capture_backend() -> CaptureBackend:
+    global activeCapture
+    if activeCapture is None:
+        activeCapture = make_capture_backend()
+    return activeCapture
+
+"""
+Tile level change detection between consecutive frames.
+
+The frame is split into tileSize x tileSize tiles and compared exactly
+with a copy of the previous frame, so even a single changed pixel of
+dialogue text marks its tile dirty. Rows are compared as the widest
+unsigned words that tile boundaries allow (uint64 for 16 pixel RGB
+tiles), then reduced to tiles, touching every byte once.
+"""
+class FrameChangeDetector:
+
+    def __init__(self, tileSize : int = 16) -> None:
+        self.tileSize = tileSize
+        self.prevFrame : ndarray = None
+        self.diffBuffer : ndarray = None
+        self.dirtyTiles : ndarray = None
+        self.changed = True
+        self.changedFrames = 0
+        self.unchangedFrames = 0
+
+    def _reset(self, frame : ndarray) -> None:
+        height, width = frame.shape[:2]
+        rowBytes = frame.size // height
+        tileBytes = self.tileSize * (rowBytes // width)
+
+        # Widest word that never straddles a tile boundary
+        self.wordType = next(
+            t for t in (numpy.uint64, numpy.uint32, numpy.uint16, numpy.uint8)
+            if rowBytes % numpy.dtype(t).itemsize == 0 and tileBytes % numpy.dtype(t).itemsize == 0
+        )
+        wordSize = numpy.dtype(self.wordType).itemsize
+
+        self.prevFrame = numpy.ascontiguousarray(frame).copy()
+        self.diffBuffer = numpy.empty((height, rowBytes // wordSize), dtype=bool)
+        self.fullRows = height - height % self.tileSize
+        self.columnStarts = numpy.arange(0, rowBytes, tileBytes) // wordSize
+        self.dirtyTiles = numpy.ones((-(-height // self.tileSize), len(self.columnStarts)), dtype=bool)
+
+    def _words(self, frame : ndarray) -> ndarray:
+        return numpy.ascontiguousarray(frame).reshape(frame.shape[0], -1).view(self.wordType)
+
+    # Compare a frame with the previous one, returns whether anything changed
+    def update(self, frame : ndarray) -> bool:
+        if self.prevFrame is None or self.prevFrame.shape != frame.shape:
+            self._reset(frame)
+            self.changed = True
+        else:
+            diff = numpy.not_equal(self._words(frame), self._words(self.prevFrame), out=self.diffBuffer)
+
+            # Whole tile rows reduce through a reshape, the partial last one separately
+            rows = diff[:self.fullRows].reshape(-1, self.tileSize, diff.shape[1]).any(axis=1)
+            if self.fullRows < len(diff):
+                rows = numpy.vstack((rows, diff[self.fullRows:].any(axis=0)))
+
+            self.dirtyTiles = numpy.logical_or.reduceat(rows, self.columnStarts, axis=1)
+            self.changed = bool(self.dirtyTiles.any())
+            if self.changed:
+                numpy.copyto(self.prevFrame, frame)
+
+        if self.changed:
+            self.changedFrames += 1
+        else:
+            self.unchangedFrames += 1
+        return self.changed
+
+    # Whether any tile overlapping the (left, top, right, bottom) region changed
+    def region_changed(self, region : tuple[int,int,int,int]) -> bool:
+        left, top, right, bottom = region
+        t = self.tileSize
+        return bool(self.dirtyTiles[max(top, 0) // t : -(-bottom // t), max(left, 0) // t : -(-right // t)].any())
+
+    # Pixel bounds (left, top, right, bottom) of the dirty tiles, or None
+    def dirty_bounds(self) -> tuple[int,int,int,int] | None:
+        rows = numpy.flatnonzero(self.dirtyTiles.any(axis=1))
+        columns = numpy.flatnonzero(self.dirtyTiles.any(axis=0))
+        if len(rows) == 0:
+            return None
+        height, width = self.prevFrame.shape[:2]
+        t = self.tileSize
+        return (int(columns[0]) * t, int(rows[0]) * t, min((int(columns[-1]) + 1) * t, width), min((int(rows[-1]) + 1) * t, height))
+
+"""
+Per-frame features shared by every sequence, stored in run["coreFeatures"]
+and referenced from run.toml with ["core", <feature>] arguments.
+
+capture() grabs one frame for all sequences. The ndarray feature is the
+backend's frame buffer itself; the PIL image is only built the first
+time a sequence asks for it in that frame. frameTime is the backend's
+capture timestamp and captureTime the perf_counter() time of the grab.
+
+With a change detector, frameChanged and dirtyTiles report what changed
+since the previous frame, and dirtyBounds is the pixel box around the
+dirty tiles (None when nothing changed).
+"""
+class CoreFeatures(dict):
+
+    frameArrayKey = "screenShot_Whole_npArray"
+    frameImageKey = "screenShot_Whole_Image"
+    frameTimeKey = "frameTime"
+    captureTimeKey = "captureTime"
+    frameChangedKey = "frameChanged"
+    dirtyTilesKey = "dirtyTiles"
+    dirtyBoundsKey = "dirtyBounds"
+
+    def __init__(self, changeDetector : FrameChangeDetector = None) -> None:
+        super().__init__()
+        self.frameID = 0
+        self.frameTime : float = None
+        self.captureTime : float = None
+        self.changeDetector = changeDetector
+
+    def capture(self, backend : CaptureBackend = None) -> ndarray:
+        if backend is None:
+            backend = get_capture_backend()
+
+        frame = backend.grab()
+        return self.set_frame(frame, backend.frameTime, backend.captureTime)
+
+    # Make an already captured frame the current one. captureTime
+    # defaults to now
+    def set_frame(self, frame : ndarray, frameTime : float, captureTime : float = None) -> ndarray:
+        self.clear()
+        self[self.frameArrayKey] = frame
+        self[self.frameTimeKey] = self.frameTime = frameTime
+        self[self.captureTimeKey] = self.captureTime = captureTime if captureTime is not None else time.perf_counter()
+        self.frameID += 1
+
+        if self.changeDetector is not None:
+            self[self.frameChangedKey] = self.changeDetector.update(frame)
+            self[self.dirtyTilesKey] = self.changeDetector.dirtyTiles
+        return frame
+
+    # Whether the region (or anything, without a region) changed since the
+    # previous frame. Always True without a change detector
+    def changed(self, region : tuple[int,int,int,int] = None) -> bool:
+        if self.changeDetector is None:
+            return True
+        if region is None:
+            return self.changeDetector.changed
+        return self.changeDetector.region_changed(region)
+
+    # Lazily materialized features
+    def __missing__(self, key : str):
+        if key == self.frameImageKey and self.frameArrayKey in self:
+            self[key] = Image.fromarray(self[self.frameArrayKey])
+            return self[key]
+        if key == self.dirtyBoundsKey and self.changeDetector is not None and self.dirtyTilesKey in self:
+            self[key] = self.changeDetector.dirty_bounds()
+            return self[key]
+        raise KeyError(f"Core feature not available: {key}")
@@ -1,6 +1,7 @@
 from __future__ import annotations
 from enum import Enum, auto as enumAuto
-import colorsys
+from typing import NamedTuple
+import numpy
 from common.ss_namespace_methods import NamespaceMethods
 
 class ColorRequirement(Enum):
@@ -11,9 +12,43 @@ class ColorCompareMode(Enum):
     RGB = enumAuto()
     HSV = enumAuto()
 
+# Hue, saturation and value on a 0-255 scale, like the RGB channels.
+# Hue is circular: 0 and 256 are the same hue.
+hueScale = 256.0
+
+def hsv_distance(a : tuple[float,float,float], b : tuple[float,float,float]) -> tuple[float,float,float]:
+    dh = abs(a[0] - b[0])
+    return (min(dh, hueScale - dh), abs(a[1] - b[1]), abs(a[2] - b[2]))
+
+# Vectorized RGB -> HSV for pixels of shape (..., channels), float (..., 3)
+def rgb_to_hsv_array(pixels : numpy.ndarray) -> numpy.ndarray:
+    rgb = numpy.asarray(pixels)[..., :3].astype(numpy.float32) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    delta = maxc - minc
+    safeDelta = numpy.where(delta == 0, 1.0, delta)
+
+    s = numpy.where(maxc == 0, 0.0, delta / numpy.where(maxc == 0, 1.0, maxc))
+
+    h = numpy.where(
+        maxc == r, (g - b) / safeDelta,
+        numpy.where(maxc == g, 2.0 + (b - r) / safeDelta, 4.0 + (r - g) / safeDelta)
+    )
+    h = numpy.where(delta == 0, 0.0, (h / 6.0) % 1.0)
+
+    return numpy.stack((h * hueScale, s * 255.0, maxc * 255.0), axis=-1)
+
+# Per channel tolerances as a (3,) array from a scalar or list
+def _channel_tolerance(tolerance : int | list[int]) -> numpy.ndarray:
+    return numpy.broadcast_to(numpy.asarray(tolerance, dtype=numpy.float32), (3,))
+
 @NamespaceMethods.register
 class Color:
 
+    __slots__ = ("_rgb", "tolerance", "requirement", "startPixel", "endPixel")
+
     def __init__(
         self,
         color : tuple[int,int,int],
@@ -26,6 +61,20 @@ class Color:
         self.tolerance = tolerance
         self.startPixel = 0
         self.endPixel = 0
+
+    # Stored as a packed uint8 triple
+    @property
+    def color(self) -> tuple[int,int,int]:
+        return tuple(self._rgb)
+
+    @color.setter
+    def color(self, color : tuple[int,int,int]) -> None:
+        self._rgb = bytes(int(c) for c in color[:3])
+
+    # Same conversion as rgb_to_hsv_array, so scalar and array compares agree
+    @property
+    def hsv(self) -> tuple[float,float,float]:
+        return tuple(float(v) for v in rgb_to_hsv_array(numpy.frombuffer(self._rgb, dtype=numpy.uint8)))
     
     def __str__(self) -> str:
         return f"Color: ({self.color[0]},{self.color[1]},{self.color[2]}), startPixel: {self.startPixel}, endPixel: {self.endPixel}"
@@ -35,9 +84,113 @@ class Color:
         self.endPixel = None
 
     @NamespaceMethods.register
-    def color_cmp(self, other_color : Color, mode : ColorCompareMode = ColorCompareMode.RGB, tolerance : list[int] = [0,0,0]) -> bool:
+    def color_cmp(self, other_color : Color, mode : ColorCompareMode = ColorCompareMode.RGB, tolerance : list[int] = None) -> bool:
+
+        if tolerance is None:
+            tolerance = [0,0,0]
+
+        if mode == ColorCompareMode.HSV:
+            diff = hsv_distance(self.hsv, other_color.hsv)
+        else:
+            diff = [abs(a - b) for a, b in zip(self._rgb, other_color._rgb)]
 
         for c in range(3):
-            if self.color[c] > other_color.color[c] + tolerance[c] or self.color[c] < other_color.color[c] - tolerance[c]:
+            if diff[c] > tolerance[c]:
                 return False
-        return True
\ No newline at end of file
+        return True
+
+    # Boolean mask of pixels (..., channels) within tolerance of this color,
+    # per channel in RGB or HSV. Defaults to this color's own tolerance.
+    def match_pixels(self, pixels : numpy.ndarray, mode : ColorCompareMode = ColorCompareMode.RGB, tolerance : int | list[int] = None) -> numpy.ndarray:
+
+        if tolerance is None:
+            tolerance = self.tolerance
+        tolerance = _channel_tolerance(tolerance)
+
+        if mode == ColorCompareMode.HSV:
+            hsv = rgb_to_hsv_array(pixels)
+            diff = numpy.abs(hsv - numpy.array(self.hsv, dtype=numpy.float32))
+            diff[..., 0] = numpy.minimum(diff[..., 0], hueScale - diff[..., 0])
+        else:
+            diff = numpy.abs(numpy.asarray(pixels)[..., :3].astype(numpy.int16) - numpy.frombuffer(self._rgb, dtype=numpy.uint8))
+
+        return numpy.all(diff <= tolerance, axis=-1)
+
+# Label every pixel (..., channels) with the index of the first palette
+# color it matches, -1 where none match
+@NamespaceMethods.register
+def match_palette(pixels : numpy.ndarray, palette : list[Color], mode : ColorCompareMode = ColorCompareMode.RGB) -> numpy.ndarray:
+
+    if mode == ColorCompareMode.HSV:
+        values = rgb_to_hsv_array(pixels)
+        targets = numpy.array([c.hsv for c in palette], dtype=numpy.float32)
+    else:
+        values = numpy.asarray(pixels)[..., :3].astype(numpy.int16)
+        targets = numpy.array([c.color for c in palette], dtype=numpy.int16)
+    tolerances = numpy.array([c.tolerance for c in palette], dtype=numpy.float32)
+
+    # (..., palette count, 3)
+    diff = numpy.abs(values[..., None, :] - targets)
+    if mode == ColorCompareMode.HSV:
+        diff[..., 0] = numpy.minimum(diff[..., 0], hueScale - diff[..., 0])
+    matches = numpy.all(diff <= tolerances[:, None], axis=-1)
+
+    labels = numpy.argmax(matches, axis=-1)
+    return numpy.where(matches.any(axis=-1), labels, -1)
+
+# Start / end pixel of one color in a scan result. Read-only, so a
+# result can be kept while the next frame is scanned.
+class ColorMatch(NamedTuple):
+    startPixel : int | None
+    endPixel : int | None
+
+"""
+Immutable, array-backed description of an ordered color sequence:
+RGB targets (count, 3), tolerances (count,) and required flags (count,).
+Built once per sequence step and shared by every scan, instead of
+copying Color objects on every frame.
+"""
+class ColorSequence:
+
+    __slots__ = ("names", "targets", "tolerances", "required")
+
+    def __init__(self, colors : list[Color], names : list[str] = None) -> None:
+
+        if isinstance(colors, Color):
+            colors = [colors]
+
+        if len(colors) == 0 or not all(isinstance(c, Color) for c in colors):
+            raise TypeError("ColorSequence requires a non-empty list of Color")
+
+        targets = numpy.array([c.color[:3] for c in colors], dtype=numpy.int16)
+        tolerances = numpy.array([c.tolerance for c in colors], dtype=numpy.int16)
+        required = numpy.array([c.requirement == ColorRequirement.required for c in colors], dtype=bool)
+
+        for arr in (targets, tolerances, required):
+            arr.setflags(write=False)
+
+        object.__setattr__(self, "names", tuple(names) if names is not None else None)
+        object.__setattr__(self, "targets", targets)
+        object.__setattr__(self, "tolerances", tolerances)
+        object.__setattr__(self, "required", required)
+
+    def __setattr__(self, name, value) -> None:
+        raise AttributeError("ColorSequence is immutable")
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __str__(self) -> str:
+        names = self.names if self.names is not None else range(len(self))
+        return "ColorSequence: " + ", ".join(str(n) for n in names)
+
+    # Fresh Color objects, for code that works on Color instances
+    def to_colors(self) -> list[Color]:
+        return [
+            Color(
+                tuple(int(v) for v in self.targets[i]),
+                int(self.tolerances[i]),
+                ColorRequirement.required if self.required[i] else ColorRequirement.notRequired
+            )
+            for i in range(len(self))
+        ]
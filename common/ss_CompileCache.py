@@ -0,0 +1,127 @@
+import hashlib
+import os
+import pickle
+import sys
+from typing import Any
+try:
+    from common.ss_Logging import logSS
+except:
+    from ss_Logging import logSS
+
+"""
+On-disk cache of what a profile costs to load: the parsed run.toml, the
+hash indexes built from the hash store and compiled LOS programs. All
+entries of a profile share one binary file in the user's cache
+directory, named after a digest of the profile's path.
+
+Every entry is stored under a name with a key, a digest of its source
+and of the version of the code that built it. An entry whose key does
+not match is a miss and gets rebuilt. The file starts with a header
+holding cacheVersion and the Python bytecode tag, so a cache written by
+another format or interpreter is ignored as a whole, as is a file that
+cannot be read. Entries stay pickled until asked for, so unused ones
+cost nothing to load.
+
+The file is unpickled on load, so it never lives in the profile
+directory: profiles are shared, and a cache shipped with one would run
+its code. Only the user can write to the cache directory, which is
+$SS_CACHE_DIR if set, else the platform's per-user cache location.
+"""
+
+cacheVersion = 2
+
+_magic = b"SSCACHE\0"
+
+# Per-user directory holding the cache files of every profile
+def cacheDirectory() -> str:
+    directory = os.environ.get("SS_CACHE_DIR")
+    if directory:
+        return directory
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "SpokenScreen")
+
+# Cache file of the profile in directory
+def cachePath(directory : str) -> str:
+    return os.path.join(cacheDirectory(), source_digest(os.path.realpath(directory))[:32] + ".bin")
+
+def _header() -> bytes:
+    return _magic + f"{cacheVersion} {sys.implementation.cache_tag}\n".encode()
+
+# Hex digest of the parts, which are str or bytes
+def source_digest(*parts : str | bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+class CompileCache:
+
+    # Cache of the profile in directory
+    def __init__(self, directory : str) -> None:
+        self.path = cachePath(directory)
+        # name: (key, pickled value)
+        self.entries : dict[str, tuple[str, bytes]] = {}
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        header = _header()
+        try:
+            with open(self.path, "rb") as f:
+                if f.read(len(header)) != header:
+                    logSS.debug(f"Ignoring compile cache {self.path} from another version")
+                    return
+                entries = pickle.load(f)
+        except OSError:
+            return
+        except Exception as e:
+            logSS.debug(f"Ignoring unreadable compile cache {self.path}: {e}")
+            return
+        if isinstance(entries, dict):
+            self.entries = entries
+
+    # The cached value of name if it was stored with key, else None
+    def get(self, name : str, key : str) -> Any:
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == key:
+            try:
+                value = pickle.loads(entry[1])
+            except Exception as e:
+                logSS.debug(f"Dropping compile cache entry {name}: {e}")
+            else:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    # Store a snapshot of value, later changes to it are not cached
+    def put(self, name : str, key : str, value : Any) -> None:
+        self.entries[name] = (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        self.changed = True
+
+    # Write the file if an entry changed. Returns whether it was written
+    def save(self) -> bool:
+        if not self.changed:
+            return False
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(_header())
+                pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logSS.debug(f"Cannot write compile cache {self.path}: {e}")
+            return False
+        self.changed = False
+        return True
@@ -1,12 +1,18 @@
-from typing import Any
-
-from common.methods.ss_Pixel import *
-from common.methods.ss_Arithmetic import *
-from common.methods.ss_Hashing import *
-from common.methods.ss_Image import *
+from typing import Any, Callable
+
+from common.ss_Pixel import *
+from common.ss_Arithmetic import *
+from common.ss_Hashing import *
+from common.ss_HashIndex import HashIndex, find_known_hash
+from common.ss_HashStore import HashStore
+from common.ss_CompileCache import CompileCache, source_digest
+from common.ss_Image import *
 from common.ss_PathClasses import SSPath
-from common.ss_ColorClasses import Color, ColorRequirement
-import tomllib, tomli_w, copy
+from common.ss_Capture import make_capture_backend, set_capture_backend, CoreFeatures, FrameChangeDetector
+from common.ss_ColorClasses import Color, ColorRequirement, ColorSequence
+import os
+import time
+import tomllib
 
 """
 These methods enable the functionality of 
@@ -34,24 +40,71 @@ def parseSeqStepIndexes(seq : dict) -> list[str]:
 
 # For a function argument in a sequence step, retrive the desired value
 def getArgVal(step : dict, arg : str, run : dict) -> Any:
+
+    # Compiled steps carry pre-resolved accessors (see compileSequence)
+    compiledArgs = step.get("compiledArgs")
+    if compiledArgs is not None:
+        accessor = compiledArgs.get(arg)
+        return None if accessor is None else accessor(run)
+
     try:
         a = step[arg]
     except KeyError:
         return None
+    return resolveArg(a, run)
+
+# Resolve a raw [argType, argValue] argument
+def resolveArg(a : list, run : dict) -> Any:
     argType, argValue = a[0], a[1]
     if argType == "run":
         return getDVal(run, argValue)
     if argType == "const":
         return argValue
     if argType == "colors":
-        return [copy.deepcopy(run["colorInstances"][color]) for color in argValue]
+        return getColorSequence(run, argValue)
     if argType == "color":
         return run["colorInstances"][argValue]
+    if argType == "core":
+        if isinstance(argValue, list):
+            return getDVal(run["coreFeatures"], argValue)
+        return run["coreFeatures"][argValue]
+
+# Immutable color sequence for a list of color names, built once per run
+def getColorSequence(run : dict, names : list[str]) -> ColorSequence:
+    sequences : dict = run.setdefault("colorSequences", {})
+    key = tuple(names)
+    if key not in sequences:
+        sequences[key] = ColorSequence([run["colorInstances"][name] for name in names], names)
+    return sequences[key]
+
+# Largest constant differenceTolerance used by the sequence's hash lookups,
+# sizes the hash index for multi-index lookups
+def sequenceHashTolerance(seq : dict) -> int | None:
+    tolerances = [
+        step["differenceTolerance"][1] for step in seq.values()
+        if isinstance(step, dict) and step.get("function") in ("saveHash_IfNew", "findKnownHash")
+        and isinstance(step.get("differenceTolerance"), list) and step["differenceTolerance"][0] == "const"
+    ]
+    return max(tolerances) if tolerances else None
+
+# Version of what initRun caches (parsed run.toml and hash indexes),
+# bump it when their layout changes
+runCacheVersion = 2
+
+# The parsed run.toml with its colors and per-frame features, without
+# the hash store. Taken from the compile cache when given and current
+def loadRun(filename_Run, cache : CompileCache = None) -> dict:
 
-def initRun(filename_Run) -> dict:
-    
     with open(filename_Run, 'rb') as f:
-        run : dict = tomllib.load(f)
+        source = f.read()
+    runKey = source_digest(str(runCacheVersion), source)
+    run : dict = cache.get("run.toml", runKey) if cache is not None else None
+    if run is None:
+        run = tomllib.loads(source.decode("utf-8"))
+        if cache is not None:
+            cache.put("run.toml", runKey, run)
+    run["runPath"] = filename_Run
+    run["compileCache"] = cache
 
     # create colorInstances dict
     run["colorInstances"] = {}
@@ -65,39 +118,103 @@ def initRun(filename_Run) -> dict:
 
         run["colorInstances"][key] = Color((r,g,b), tolerance, purity)
 
-    sequenceKeys : list(str) = run["sequence"].keys()
+    # ColorSequence cache for "colors" arguments
+    run["colorSequences"] = {}
 
-    # verify all sequences have a hashList
-    for key in sequenceKeys:
-        seq = run["sequence"][key]
-        seq["hashIDList"] = []
-        seq["hashObjectList"] = []
+    # Shared per-frame features, filled by run["coreFeatures"].capture().
+    # Frames are diffed in changeTileSize tiles unless [capture] sets it to 0
+    tileSize = run.get("capture", {}).get("changeTileSize", 16)
+    run["coreFeatures"] = CoreFeatures(FrameChangeDetector(tileSize) if tileSize > 0 else None)
+    run["frameStats"] = {"processed": 0, "skipped": 0}
+
+    return run
+
+# Compile every sequence into its execution plan
+def compileRun(run : dict, optimize : bool = True) -> None:
+    run["optimizeSequences"] = optimize
+    for key, seq in run["sequence"].items():
+        seq["plan"] = compileSequence(seq, run)
+        if seq.get("optimization"):
+            logSS.info(f"Optimized sequence {key}: {seq['optimization']}")
 
-    # Check if the seq association is a valid
-    # run["sequence"] key. If so, put the
-    # hash definition values into the seq
-    # runtime lists
+def initRun(filename_Run, useCache : bool = True, optimize : bool = True) -> dict:
+
+    # The parsed run.toml and the hash indexes are cached (see
+    # ss_CompileCache). Plans hold closures over the run and are rebuilt
+    cache = CompileCache(os.path.dirname(filename_Run)) if useCache else None
+    run = loadRun(filename_Run, cache)
+
+    sequenceKeys : list(str) = run["sequence"].keys()
+
+    # Discovered hashes live in a hash store next to run.toml. Hashes
+    # from the legacy run.toml [hash] table are imported on first use.
     #
     # Entries in run["hash"] are:
     # {ID : (seqStr, hash, line text, character)}
-    hashCount = 0
-    for hashIDNumber in run["hash"]:
-        hashCount += 1
+    store = HashStore(os.path.join(os.path.dirname(filename_Run), "hashes.sqlite"))
+    run["hashStore"] = store
 
-        sequenceKey : str = run["hash"][hashIDNumber][0]
-        hashObject = hex_to_hash(run["hash"][hashIDNumber][1])
+    if len(store) == 0 and len(run.get("hash", {})) > 0:
+        for hashIDNumber, (sequenceKey, hashHex, text, character) in run["hash"].items():
+            store.add(sequenceKey, hex_to_hash(hashHex), text, character, id= int(hashIDNumber))
+        store.flush()
+        logSS.info(f"Imported {len(run['hash'])} hashes from {filename_Run} into {store.path}")
 
-        if sequenceKey in sequenceKeys:
-            run["sequence"][sequenceKey]["hashIDList"].append(hashIDNumber)
-            run["sequence"][sequenceKey]["hashObjectList"].append(hashObject)
-        else:
-            logSS.critical(f"Invalid sequence key in hash table: {sequenceKey}. Revise run.toml.")
-            raise ValueError(f"Invalid sequence key in hash table: {sequenceKey}. Revise run.toml.")
+    for sequenceKey in store.sequences():
+        if sequenceKey not in sequenceKeys:
+            logSS.critical(f"Invalid sequence key in hash store: {sequenceKey}. Revise {store.path}.")
+            raise ValueError(f"Invalid sequence key in hash store: {sequenceKey}. Revise {store.path}.")
+
+    # Bulk load every sequence's hashes into its hash index
+    for key in sequenceKeys:
+        seq = run["sequence"][key]
+        seq["hashIndex"] = loadHashIndex(store, key, sequenceHashTolerance(seq), cache)
+        seq["hashIDList"] = list(seq["hashIndex"].ids)
+
+    run["hashCount"] = ["const", store.nextID]
+
+    if cache is not None:
+        cache.save()
+
+    # Optional [capture] table selects the screen capture backend
+    if "capture" in run:
+        set_capture_backend(make_capture_backend(run["capture"]))
 
-    run["hashCount"] = ["const", hashCount]
+    compileRun(run, optimize)
+    return run
 
+# What a SequencePool worker needs: the sequences, colors and compiled
+# plans. No hash store, capture backend or compile cache, those belong to
+# the main process
+def initWorkerRun(filename_Run, optimize : bool = True) -> dict:
+    run = loadRun(filename_Run)
+    compileRun(run, optimize)
     return run
 
+# Hash index of a sequence's stored hashes. A cached index is reused
+# while the store generation is unchanged, and only the hashes added
+# since are appended to it
+def loadHashIndex(store : HashStore, sequenceKey : str, mihTolerance : int | None, cache : CompileCache = None) -> HashIndex:
+    name = f"hashIndex/{sequenceKey}"
+    key = source_digest(str(runCacheVersion), store.path, str(mihTolerance))
+
+    cached = cache.get(name, key) if cache is not None else None
+    generation = store.generation()
+    reused = cached is not None and cached["generation"] == generation
+    if reused:
+        index, lastID = cached["index"], cached["lastID"]
+    else:
+        index, lastID = HashIndex(mihTolerance= mihTolerance), -1
+
+    ids, words, bitCount = store.load_sequence(sequenceKey, afterID= lastID)
+    if len(ids) > 0:
+        index.add_packed(words, ids, bitCount)
+
+    if cache is not None and not (reused and len(ids) == 0):
+        lastID = index.ids[-1] if len(index) > 0 else -1
+        cache.put(name, key, {"lastID": lastID, "generation": generation, "index": index})
+    return index
+
 """
 These methods wrap the base python methods in a TOMLscript interpreter
 """
@@ -123,22 +240,23 @@ def seqEx_getPixelColumn_Percent(step : dict, run : dict) -> None:
 
 def seqEx_flexAdd(step : dict, run : dict) -> None:
    inputs = [getArgVal(step, arg, run) for arg in step.keys() if arg[:5] == "input"]
-   print(inputs)    
    step["result"] = flexAdd(*inputs)
 
 def seqEx_flexSubtract(step : dict, run : dict) -> None:
    inputs = [getArgVal(step, arg, run) for arg in step.keys() if arg[:5] == "input"]
-   print(inputs)    
    step["result"] = flexSubtract(*inputs)
 
 def seqEx_flexMultiply(step : dict, run : dict) -> None:
    inputs = [getArgVal(step, arg, run) for arg in step.keys() if arg[:5] == "input"]
-   print(inputs)    
    step["result"] = flexMultiply(*inputs)
 
+def seqEx_getValue_PercentBetweenValues(step : dict, run : dict) -> None:
+    args = ["start", "end", "percent"]
+    [start, end, percent] = [getArgVal(step, arg, run) for arg in args]
+    step["result"] = getValuePercentBetween(start, end, percent)
+
 def seqEx_flexDivide(step : dict, run : dict) -> None:
    inputs = [getArgVal(step, arg, run) for arg in step.keys() if arg[:5] == "input"]
-   print(inputs)    
    step["result"] = flexDivide(*inputs)
 
 def seqEx_computeHash_DHash(step : dict, run : dict) -> None:
@@ -146,12 +264,24 @@ def seqEx_computeHash_DHash(step : dict, run : dict) -> None:
     [im, size] = [getArgVal(step, arg, run) for arg in args]    
     step["result"] = compute_hash_dhash(im, size)
 
+# The hasher keeps its buffers on the step between frames
+def seqEx_cropGridHash_DHash(step : dict, run : dict) -> None:
+    args = ["image", "left", "top", "right", "bottom", "horizontalCount", "verticalCount", "size"]
+    [im, left, top, right, bottom, horCount, vertCount, size] = [getArgVal(step, arg, run) for arg in args]
+    hasher = step.get("hasher")
+    if hasher is None or hasher.size != size:
+        hasher = step["hasher"] = CropGridHasher(size)
+    step["result"] = crop_grid_hash_dhash(im, left, top, right, bottom, horCount, vertCount, size, hasher)
+
 def seqEx_screenshot(step : dict, run : dict) -> None:
     step["result"] = screenshot()
 
+def seqEx_captureFrame(step : dict, run : dict) -> None:
+    step["result"] = capture_frame()
+
 def seqEx_makeNDArray(step : dict, run : dict) -> None:
     im = getArgVal(step, "image", run)
-    step["result"] = makeNDArray(im)
+    step["result"] = make_np_array(im)
 
 def seqEx_flexCropImage(step : dict, run : dict) -> None:
     args = ["image", "left", "top", "right", "bottom", "horizontalCount", "verticalCount"]
@@ -162,62 +292,118 @@ def seqEx_mergeImages_Vertical(step : dict, run : dict) -> None:
     images = [getArgVal(step, arg, run) for arg in step.keys() if arg[:5] == "image"]  
     step["result"] = mergeImages_Vertical(images)
 
+# With an I/O worker the save runs in the background and the result only
+# says it was queued. Arrays are copied first, they may be views of a
+# capture buffer that is about to be reused
 def seqEx_saveImage(step : dict, run : dict) -> None:
     args = ["image", "fileName"]
-    [im, fileNombre] = [getArgVal(step, arg, run) for arg in args]    
-    step["result"] = saveImage(im, fileNombre)
+    [im, fileNombre] = [getArgVal(step, arg, run) for arg in args]
+    ioWorker = run.get("ioWorker")
+    if ioWorker is None:
+        step["result"] = saveImage(im, fileNombre)
+        return
+
+    if isinstance(im, ndarray):
+        im = im.copy()
+    elif isinstance(im, list):
+        im = [i.copy() if isinstance(i, ndarray) else i for i in im]
+    ioWorker.submit(saveImage, im, fileNombre)
+    step["result"] = True
 
 def seqEx_pixelSequenceScan(step : dict, run : dict) -> None:
     args = ["pixels", "colors"]
     [pixels, colors] = [getArgVal(step, arg, run) for arg in args]
     step["result"] = pixel_sequence_scan(pixels, colors)
 
+# The tracker keeps the last matches on the step between frames
+def seqEx_pixelSequenceScan_Tracked(step : dict, run : dict) -> None:
+    args = ["pixels", "colors"]
+    [pixels, colors] = [getArgVal(step, arg, run) for arg in args]
+    tracker = step.get("tracker")
+    if tracker is None:
+        tracker = step["tracker"] = SequenceScanTracker()
+    step["result"] = pixel_sequence_scan_tracked(pixels, colors, tracker)
+
+def seqEx_pixelSequenceScan_Lines(step : dict, run : dict) -> None:
+    args = ["image", "colors", "lines", "vertical", "lowLimit", "highLimit"]
+    [im, colors, lines, vertical, lowLimit, highLimit] = [getArgVal(step, arg, run) for arg in args]
+    step["result"] = pixel_sequence_scan_lines(im, colors, lines, bool(vertical), lowLimit, highLimit)
+
+def seqEx_pixelSequenceScan_LinesPercent(step : dict, run : dict) -> None:
+    args = ["image", "colors", "percents", "vertical", "lowPercent", "highPercent"]
+    [im, colors, percents, vertical, lowPercent, highPercent] = [getArgVal(step, arg, run) for arg in args]
+    step["result"] = pixel_sequence_scan_lines_percent(im, colors, percents, bool(vertical), lowPercent, highPercent)
+
+# The detector keeps its state on the step between frames. A list of
+# hashes tracks every region at once and gives one flat flag per region.
+# frameTime defaults to the capture time of the current frame
 def seqEx_computHashFlatness(step : dict, run : dict) -> None:
-    args = ["hash", "differenceTolerance", "flatCountThreshold", "prevHash", "currCount"]
-    [hash, diffTol, countThresh, prevHash, currCount] = [getArgVal(step, arg, run) for arg in args]
-    step["result"], prevHash, currCount = compute_hash_flatness(hash, prevHash, diffTol, countThresh, currCount)
-    step["prevHash"] = ["const", prevHash]
-    step["currCount"] = ["const", currCount]
+    args = ["hash", "differenceTolerance", "flatCountThreshold", "flatDuration", "frameTime"]
+    [hash, diffTol, countThresh, flatDuration, frameTime] = [getArgVal(step, arg, run) for arg in args]
+
+    if frameTime is None and "coreFeatures" in run:
+        frameTime = run["coreFeatures"].frameTime
+    if frameTime is None:
+        frameTime = time.perf_counter()
+
+    detector = step.get("detector")
+    if detector is None:
+        if isinstance(hash, (list, ndarray)):
+            detector = MultiHashFlatnessDetector(len(hash), diffTol, countThresh, flatDuration)
+        else:
+            detector = HashFlatnessDetector(diffTol, countThresh, flatDuration)
+        step["detector"] = detector
+
+    step["result"] = compute_hash_flatness(hash, detector, frameTime)
 
 def seqEx_saveHash_IfNew(step : dict, run : dict) -> None:
     args = ["hash", "seq", "seqStr", "differenceTolerance"]
     [hash, seqDict, seqStr, diffTol] = [getArgVal(step, arg, run) for arg in args]
 
-    seqHashObjectList : list[ImageHash] = seqDict["hashObjectList"]
+    seqHashIndex : HashIndex = seqDict["hashIndex"]
 
-    for i, seqHash in enumerate(seqHashObjectList):
-        if hash - seqHash <= diffTol:
-            step["result"] = False
-            return
+    if seqHashIndex.contains_within(hash, diffTol):
+        step["result"] = False
+        return
     
     # hash is a new find!
-    newHashID : int = run["hashCount"][1]
-    run["hashCount"][1] += 1
-
-    # update run hash database
-    runHashes : dict = run["hash"]
-    runHashes[str(newHashID)] = [seqStr, str(hash), "", ""]
+    newHashID : int = run["hashStore"].add(seqStr, hash)
+    run["hashCount"][1] = run["hashStore"].nextID
 
     # update seq hash lists
     seqHashIDList : list[int] = seqDict["hashIDList"]
     seqHashIDList.append(newHashID)
-    seqHashObjectList.append(hash)
+    seqHashIndex.add(hash, newHashID)
 
     step["result"] = True
-    print("recorded new hash")
+    logSS.info(f"Recorded new hash {newHashID} for {seqStr}")
 
-def seqEx_updateRun(step : dict, run : dict) -> None:
+def seqEx_findKnownHash(step : dict, run : dict) -> None:
+    args = ["hash", "seq", "differenceTolerance"]
+    [hash, seqDict, diffTol] = [getArgVal(step, arg, run) for arg in args]
+    step["result"] = find_known_hash(hash, seqDict["hashIndex"], diffTol)
 
-    with open(SSPath.runTOML.path_str, 'rb') as f:
-        exportRun = tomllib.load(f)
+# Play the clip of a recognized hash on run["audioPlayer"]. Latency is
+# measured from captureTime, a perf_counter() time, by default the grab
+# of the current frame. frameTime may run on a replay's own clock
+def seqEx_playAudio(step : dict, run : dict) -> None:
+    args = ["hashID", "captureTime"]
+    [hashID, captureTime] = [getArgVal(step, arg, run) for arg in args]
 
-    exportRun["hash"] = run["hash"]
+    if captureTime is None and "coreFeatures" in run:
+        captureTime = run["coreFeatures"].captureTime
 
-    with open(SSPath.runTOML.path_str, 'wb') as f:
-        tomli_w.dump(exportRun, f)
-    
+    player = run.get("audioPlayer")
+    step["result"] = player is not None and hashID is not None and player.play(hashID, captureTime)
+
+# Commit pending hashes to the profile's hash store
+def seqEx_updateRun(step : dict, run : dict) -> None:
+    run["hashStore"].flush()
     step["result"] = True
 
+def seqEx_compactHashStore(step : dict, run : dict) -> None:
+    step["result"] = run["hashStore"].compact()
+
 """
 This dictionary is the link between the function text in a sequence step
 and the actual method called.
@@ -231,37 +417,414 @@ seqEx = {
     "flexSubtract" : seqEx_flexSubtract,
     "flexMultiply" : seqEx_flexMultiply,
     "flexDivide" : seqEx_flexDivide,
+    "getValue_PercentBetweenValues" : seqEx_getValue_PercentBetweenValues,
     "computeHash_DHash" : seqEx_computeHash_DHash,
+    "cropGridHash_DHash" : seqEx_cropGridHash_DHash,
     "makeNPArray" : seqEx_makeNDArray,
     "flexCropImage" : seqEx_flexCropImage,
     "mergeImages_Vertical" : seqEx_mergeImages_Vertical,
     "saveImage" : seqEx_saveImage,
     "screenshot" : seqEx_screenshot,
+    "captureFrame" : seqEx_captureFrame,
     "pixelSequenceScan" : seqEx_pixelSequenceScan,
+    "pixelSequenceScan_Tracked" : seqEx_pixelSequenceScan_Tracked,
+    "pixelSequenceScan_Lines" : seqEx_pixelSequenceScan_Lines,
+    "pixelSequenceScan_LinesPercent" : seqEx_pixelSequenceScan_LinesPercent,
     "computeHashFlatness" : seqEx_computHashFlatness,
     "saveHash_IfNew" : seqEx_saveHash_IfNew,
-    "updateRun" : seqEx_updateRun
+    "findKnownHash" : seqEx_findKnownHash,
+    "playAudio" : seqEx_playAudio,
+    "updateRun" : seqEx_updateRun,
+    "compactHashStore" : seqEx_compactHashStore
+}
+
+"""
+Coroutine steps for I/O. They only run in the async runtime
+(common/ss_AsyncRuntime.py), which awaits them on its event loop while
+the steps above run on its CPU thread.
+"""
+
+# Send body to the server of run["apiSession"], result is the JSON reply
+async def seqExAsync_apiRequest(step : dict, run : dict) -> None:
+    args = ["method", "path", "body"]
+    [method, path, body] = [getArgVal(step, arg, run) for arg in args]
+    step["result"] = await run["apiSession"].request(method or "POST", path, body)
+
+asyncSeqEx = {
+    "apiRequest" : seqExAsync_apiRequest
 }
 
+"""
+Sequences are compiled once, in initRun, into a plan: the sorted step
+list with each step's function bound and every argument turned into an
+accessor. Constants are inlined and run paths start from the deepest
+table that already exists, so executing a step no longer parses
+arguments or walks the run dictionary from the top.
+"""
+
+# Follow the rest of a run path at execution time
+def walkPath(d : Any, keys : tuple) -> Any:
+    for key in keys:
+        if isinstance(key, str) and not isinstance(d, dict) and hasattr(d, key):
+            d = getattr(d, key)
+        else:
+            d = d[key]
+    return d
+
+# Build an accessor for a raw [argType, argValue] argument
+def compileArg(a : Any, run : dict) -> Callable[[dict], Any]:
+
+    if not isinstance(a, list) or len(a) != 2:
+        return lambda run: a
+
+    argType, argValue = a[0], a[1]
+
+    if argType == "const":
+        return lambda run: argValue
+
+    if argType == "run":
+
+        # Descend through tables that exist now. Step results are
+        # assigned while the sequence runs, so they stay dynamic.
+        d, depth = run, 0
+        for key in argValue:
+            if not isinstance(d, dict) or key not in d or key == "result" or not isinstance(d[key], dict):
+                break
+            d = d[key]
+            depth += 1
+
+        slot, keys = d, tuple(argValue[depth:])
+        if len(keys) == 0:
+            return lambda run: slot
+
+        # Plain indexing when no attribute lookups can be involved
+        if isinstance(slot, dict) and not any(isinstance(key, str) for key in keys[1:]):
+            if len(keys) == 1:
+                k0, = keys
+                return lambda run: slot[k0]
+            if len(keys) == 2:
+                k0, k1 = keys
+                return lambda run: slot[k0][k1]
+        return lambda run: walkPath(slot, keys)
+
+    if argType == "colors":
+        sequence = getColorSequence(run, argValue)
+        return lambda run: sequence
+
+    return lambda run: resolveArg(a, run)
+
+# Step entries that are not arguments: results, compiled accessors and
+# state objects that steps keep between frames
+stepReservedKeys = ("function", "result", "compiledArgs", "hasher", "detector", "tracker")
+
+def compileStep(step : dict, run : dict) -> dict[str, Callable[[dict], Any]]:
+    return {
+        arg : compileArg(a, run) for arg, a in step.items()
+        if arg not in stepReservedKeys
+    }
+
+# Replace a step argument with a constant, keeping its compiled accessor in sync
+def setArgConst(step : dict, arg : str, value : Any) -> None:
+    step[arg] = ["const", value]
+    if "compiledArgs" in step:
+        step["compiledArgs"][arg] = lambda run: value
+
+def compileSequence(seq : dict, run : dict, functions : dict[str, Callable] = None) -> list[tuple[dict, Callable, Callable]]:
+
+    if functions is None:
+        functions = seqEx
+
+    plan = []
+    for stepIndex in parseSeqStepIndexes(seq):
+        step = seq[stepIndex]
+
+        function = functions.get(step.get("function"))
+        if function is None and step.get("function") not in asyncSeqEx:
+            logSS.warning(f"Unknown sequence function: {step.get('function')}, step {stepIndex}")
+
+        step["compiledArgs"] = compileStep(step, run)
+        plan.append((step, function, step["compiledArgs"].get("continue")))
+
+    if run.get("optimizeSequences", False):
+        plan, seq["optimization"] = optimizePlan(seq, plan, run)
+
+    return plan
+
+"""
+With run["optimizeSequences"] set (initRun sets it), compiled plans go
+through optimizePlan:
+
+- Arguments that are the same on every frame, run paths into tables of
+  constants such as [enum], are folded into constants.
+- Steps of pure functions whose arguments are all constant run once,
+  when compiling, and leave the per-frame plan. Their result stays on
+  the step, and arguments reading it are folded in turn.
+- Steps of pure functions whose result no step reads, and which have no
+  continue, are dropped from the plan. The last step is the output of
+  the sequence and always stays.
+
+What it did is kept in seq["optimization"]. Steps under keys that are not
+step numbers, which never run, are reported there too.
+"""
+
+# Functions whose result depends on their arguments alone, without side
+# effects or state kept on the step
+pureSeqFunctions = frozenset((
+    "getPixelRow_Absolute", "getPixelColumn_Absolute", "getPixelRow_Percent", "getPixelColumn_Percent",
+    "flexAdd", "flexSubtract", "flexMultiply", "flexDivide", "getValue_PercentBetweenValues",
+    "computeHash_DHash", "makeNPArray", "flexCropImage", "mergeImages_Vertical",
+    "pixelSequenceScan", "pixelSequenceScan_Lines", "pixelSequenceScan_LinesPercent",
+))
+
+# Run tables that never change while running
+staticRunTables = ("enum",)
+
+class SequenceOptimization:
+    __slots__ = ("foldedArgs", "hoisted", "dropped", "neverRun")
+
+    def __init__(self) -> None:
+        self.foldedArgs : list[tuple[str, str, Any]] = []
+        self.hoisted : list[str] = []
+        self.dropped : list[str] = []
+        self.neverRun : list[str] = []
+
+    def __bool__(self) -> bool:
+        return any((self.foldedArgs, self.hoisted, self.dropped, self.neverRun))
+
+    def __str__(self) -> str:
+        parts = []
+        if self.foldedArgs:
+            parts.append("folded " + ", ".join(f"{index}.{arg} = {value!r}" for index, arg, value in self.foldedArgs))
+        for label, indexes in (("hoisted", self.hoisted), ("dropped", self.dropped), ("never run", self.neverRun)):
+            if indexes:
+                parts.append(f"{label} {', '.join(indexes)}")
+        return "; ".join(parts) if parts else "unchanged"
+
+def isRunPath(a : Any) -> bool:
+    return isinstance(a, list) and len(a) == 2 and a[0] == "run" and isinstance(a[1], list)
+
+# Key of the step of sequence seqKey that a run path reads, None when it
+# may read every step and False when it reads none
+def pathStep(path : list, seqKey : str) -> str | None | bool:
+    if len(path) < 3:
+        return None if len(path) == 0 or path[0] == "sequence" and (len(path) == 1 or path[1] == seqKey) else False
+    if path[0] != "sequence" or path[1] != seqKey:
+        return False
+    return str(path[2])
+
+# (True, value) for an argument that is the same on every frame
+def constantArg(a : Any, run : dict, seqKey : str, hoisted : dict[str, dict]) -> tuple[bool, Any]:
+    if not isinstance(a, list) or len(a) != 2:
+        return True, a
+
+    argType, argValue = a[0], a[1]
+    if argType == "const":
+        return True, argValue
+    if argType == "colors":
+        return True, getColorSequence(run, argValue)
+    if argType != "run" or not isinstance(argValue, list) or len(argValue) == 0:
+        return False, None
+
+    try:
+        if argValue[0] in staticRunTables:
+            return True, getDVal(run, argValue)
+        index = pathStep(argValue, seqKey)
+        if isinstance(index, str) and index in hoisted and len(argValue) > 3 and argValue[3] == "result":
+            return True, walkPath(hoisted[index]["result"], tuple(argValue[4:]))
+    except (KeyError, IndexError, AttributeError, TypeError):
+        pass
+    return False, None
+
+def optimizePlan(seq : dict, plan : list[tuple[dict, Callable, Callable]], run : dict) -> tuple[list, SequenceOptimization]:
+    report = SequenceOptimization()
+    seqKey = next((key for key, s in run.get("sequence", {}).items() if s is seq), None)
+    indexes = {id(step): index for index, step in seq.items() if isinstance(step, dict)}
+
+    report.neverRun = [
+        index for index, step in seq.items()
+        if isinstance(step, dict) and "function" in step and not index.isnumeric()
+    ]
+
+    # Fold constant arguments and run constant pure steps now
+    hoisted : dict[str, dict] = {}
+    folded : set[tuple[str, str]] = set()
+    kept = []
+    for step, function, continueArg in plan:
+        index = indexes[id(step)]
+        allConstant = True
+        for arg, a in step.items():
+            if arg in stepReservedKeys:
+                continue
+            isConstant, value = constantArg(a, run, seqKey, hoisted)
+            allConstant &= isConstant
+            if isConstant and isRunPath(a):
+                step["compiledArgs"][arg] = lambda run, value=value: value
+                report.foldedArgs.append((index, arg, value))
+                folded.add((index, arg))
+        continueArg = step["compiledArgs"].get("continue")
+
+        if allConstant and function is not None and step.get("function") in pureSeqFunctions:
+            try:
+                function(step, run)
+                stops = continueArg is not None and continueArg(run) is False
+            except Exception as e:
+                logSS.debug(f"Cannot run step {index} when compiling, it stays in the plan: {e}")
+            else:
+                if not stops:
+                    hoisted[index] = step
+                    report.hoisted.append(index)
+                    continue
+        kept.append((step, function, continueArg))
+
+    # Steps each kept step reads, None standing for every step
+    reads = {}
+    for step, _, _ in kept:
+        index = indexes[id(step)]
+        reads[index] = {
+            pathStep(a[1], seqKey) for arg, a in step.items()
+            if arg not in stepReservedKeys and (index, arg) not in folded and isRunPath(a)
+        } - {False}
+
+    # Steps of other sequences may read this one's results too, and the
+    # last step's result is the output of the sequence
+    readElsewhere = {
+        pathStep(a[1], seqKey)
+        for other in run.get("sequence", {}).values() if other is not seq
+        for step in other.values() if isinstance(step, dict)
+        for a in step.values() if isRunPath(a)
+    } - {False}
+    if len(kept) > 0:
+        readElsewhere.add(indexes[id(kept[-1][0])])
+    # Reads of a sequence that is not in the run cannot be traced
+    if seqKey is None:
+        readElsewhere.add(None)
+
+    # Drop unread pure steps until none is left to drop
+    dropped = True
+    while dropped:
+        dropped = False
+        readSteps = set().union(readElsewhere, *reads.values())
+        if None in readSteps:
+            break
+        for entry in kept:
+            step = entry[0]
+            index = indexes[id(step)]
+            if step.get("function") in pureSeqFunctions and "continue" not in step and index not in readSteps:
+                kept.remove(entry)
+                del reads[index]
+                report.dropped.append(index)
+                dropped = True
+                break
+
+    return kept, report
+
 """
 This function will accept any sequence dictionary and execute it.
 The bool return is whether the sequence completes all steps
 and the final step "continue" does not resolve to false.
+The result and the function that stopped the sequence (None if it
+completed) are kept in seq["lastResult"] and seq["stoppedBy"].
 """
 def executeTOMLsequence(seq : dict, run : dict) -> bool:
 
-    stepIndexes = parseSeqStepIndexes(seq)
+    plan = seq.get("plan")
+    if plan is None:
+        plan = seq["plan"] = compileSequence(seq, run)
 
-    for i, stepIndex in enumerate(stepIndexes):
-        step = seq[stepIndex]
+    for step, function, continueArg in plan:
 
-        # funName = step["function"]
-        #print(f"Step {stepIndex}: {funName}")
-        seqEx[step["function"]](step, run)
+        if function is None:
+            if step.get("function") in asyncSeqEx:
+                raise KeyError(f"Sequence function {step.get('function')} needs the async runtime")
+            raise KeyError(f"Unknown sequence function: {step.get('function')}")
+        function(step, run)
 
-        continueVal = getArgVal(step, "continue", run)
+        if continueArg is not None:
+            continueVal = continueArg(run)
 
-        if isinstance(continueVal, bool) and not continueVal:
-            return False
+            if isinstance(continueVal, bool) and not continueVal:
+                seq["lastResult"], seq["stoppedBy"] = False, step.get("function")
+                return False
     
-    return True
\ No newline at end of file
+    seq["lastResult"], seq["stoppedBy"] = True, None
+    return True
+
+# Hits, misses and hit rate of every tracked scan step, by sequence and step
+def scanTrackerStats(run : dict) -> dict[tuple[str, str], tuple[int, int, float]]:
+    stats = {}
+    for seqKey, seq in run["sequence"].items():
+        for stepIndex in parseSeqStepIndexes(seq):
+            tracker = seq[stepIndex].get("tracker")
+            if tracker is not None:
+                stats[(seqKey, stepIndex)] = (tracker.hits, tracker.misses, tracker.hitRate)
+    return stats
+
+# Steps whose answer can change with time alone, on an unchanged screen
+timeDependentFunctions = ("computeHashFlatness",)
+
+# A sequence can reuse its last result when its input did not change since
+# it last ran: the whole frame, or only the optional watchRegion
+# [left, top, right, bottom] of the sequence. A sequence stopped by a time
+# dependent step (e.g. waiting for the screen to be still long enough)
+# always runs again.
+def sequenceUnchanged(seq : dict, run : dict) -> bool:
+    if "coreFeatures" not in run or "lastResult" not in seq or seq["stoppedBy"] in timeDependentFunctions:
+        return False
+    return not run["coreFeatures"].changed(seq.get("watchRegion"))
+
+# Run a sequence unless its input did not change. Returns the result,
+# fresh or reused, and whether the sequence ran. Each sequence counts its
+# own "runCount" and "skipCount"
+def executeTOMLsequenceIfChanged(seq : dict, run : dict) -> tuple[bool, bool]:
+    if sequenceUnchanged(seq, run):
+        seq["skipCount"] = seq.get("skipCount", 0) + 1
+        return seq["lastResult"], False
+    seq["runCount"] = seq.get("runCount", 0) + 1
+    return executeTOMLsequence(seq, run), True
+
+# Sequences grouped into levels, each sequence in a later level than every
+# sequence named in its optional after = [...] list. Sequences in one level
+# do not depend on each other. Computed once per run
+def sequenceLevels(run : dict) -> list[list[str]]:
+    levels = run.get("sequenceLevels")
+    if levels is not None:
+        return levels
+
+    sequences : dict = run["sequence"]
+    for key, seq in sequences.items():
+        for dependency in seq.get("after", []):
+            if dependency not in sequences:
+                raise ValueError(f"Sequence {key} runs after unknown sequence {dependency}")
+
+    levels, placed = [], set()
+    while len(placed) < len(sequences):
+        level = [
+            key for key, seq in sequences.items()
+            if key not in placed and all(d in placed for d in seq.get("after", []))
+        ]
+        if len(level) == 0:
+            raise ValueError(f"Sequence dependency cycle among {sorted(set(sequences) - placed)}")
+        levels.append(level)
+        placed.update(level)
+
+    run["sequenceLevels"] = levels
+    return levels
+
+# Count a frame in run["frameStats"]: "processed" when at least one
+# sequence ran, "skipped" when every sequence was skipped
+def countFrame(run : dict, anyRan : bool) -> None:
+    stats = run.setdefault("frameStats", {"processed": 0, "skipped": 0})
+    stats["processed" if anyRan else "skipped"] += 1
+
+# Run every sequence on the current frame in dependency order, skipping
+# the unchanged ones. Returns each sequence's result, fresh or reused
+def executeTOMLsequences(run : dict) -> dict[str, bool]:
+    results = {}
+    anyRan = False
+    for level in sequenceLevels(run):
+        for key in level:
+            results[key], ran = executeTOMLsequenceIfChanged(run["sequence"][key], run)
+            anyRan |= ran
+
+    countFrame(run, anyRan)
+    return results
\ No newline at end of file
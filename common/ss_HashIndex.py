@@ -0,0 +1,216 @@
+from typing import Any
+import numpy
+from numpy import ndarray
+from imagehash import ImageHash
+from common.ss_namespace_methods import NamespaceMethods
+
+"""
+Index of known image hashes for fast "is there a hash within Hamming
+distance k?" lookups.
+
+Hashes are stored as rows of packed uint64 words, so a query is one XOR
+and popcount over the whole table. When built with an mihTolerance, the
+index also keeps multi-index hashing tables: each hash is split into
+mihTolerance + 1 chunks, and any hash within that distance must match
+the query exactly on at least one chunk. Only those candidates are
+checked, which keeps lookups sublinear in the table size.
+
+Every chunk is folded into one uint64 key, salted with its chunk number,
+and the keys of all chunks share one sorted array searched with
+searchsorted. Equal chunks always give equal keys; the rare collision of
+unequal chunks only adds a candidate, which the distance check drops.
+Hashes added a few at a time go to a small dictionary first, merged
+into the sorted array when it fills. Apart from that dictionary the
+index holds only arrays and the id list, so it pickles and loads
+quickly.
+"""
+
+_foldMultiplier = numpy.uint64(0x9E3779B97F4A7C15)
+_saltMultiplier = numpy.uint64(0xC2B2AE3D27D4EB4F)
+
+# Popcount per uint64 word, numpy.bitwise_count needs numpy 2.0
+if hasattr(numpy, "bitwise_count"):
+    def popcount(words : ndarray) -> ndarray:
+        return numpy.bitwise_count(words)
+else:
+    _byteCounts = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+    def popcount(words : ndarray) -> ndarray:
+        return _byteCounts[words.view(numpy.uint8)].reshape(*words.shape, 8).sum(axis=-1)
+
+def hash_bits(hash : ImageHash | ndarray) -> ndarray:
+    return hash.hash if isinstance(hash, ImageHash) else numpy.asarray(hash)
+
+# Pack an ImageHash (or boolean array) into uint64 words
+def pack_hash(hash : ImageHash | ndarray) -> ndarray:
+    bits = hash_bits(hash)
+    packed = numpy.packbits(bits.astype(bool).reshape(-1))
+    padded = numpy.zeros(-(-len(packed) // 8) * 8, dtype=numpy.uint8)
+    padded[:len(packed)] = packed
+    return padded.view(numpy.uint64)
+
+class HashIndex:
+
+    def __init__(self, mihTolerance : int = None, capacity : int = 64) -> None:
+        self.mihTolerance = mihTolerance
+        self.words : ndarray = None
+        self.ids : list[Any] = []
+        self.count = 0
+        self.capacity = capacity
+        self.chunkBounds : list[tuple[int,int]] = None
+        self.chunkByteCount = 0
+        self.chunkGather : ndarray = None
+        self.chunkSalt : ndarray = None
+        self.chunkKeys : ndarray = None
+        self.chunkRows : ndarray = None
+        self.recent : dict[int, list[int]] = None
+        self.recentCount = 0
+        self.recentLimit = 4096
+
+    def __len__(self) -> int:
+        return self.count
+
+    # Split the hash bytes into mihTolerance + 1 nearly equal chunks
+    def _init_chunks(self, byteCount : int) -> None:
+        chunkCount = min(self.mihTolerance + 1, byteCount)
+        edges = numpy.linspace(0, byteCount, chunkCount + 1).astype(int)
+        self.chunkBounds = list(zip(edges[:-1], edges[1:]))
+
+        # Byte positions of every chunk, padded to whole words with
+        # byteCount, the position of a zero byte
+        width = -(-max(hi - lo for lo, hi in self.chunkBounds) // 8) * 8
+        self.chunkByteCount = byteCount
+        self.chunkGather = numpy.full((chunkCount, width), byteCount, dtype=numpy.intp)
+        for chunk, (lo, hi) in enumerate(self.chunkBounds):
+            self.chunkGather[chunk, :hi - lo] = numpy.arange(lo, hi)
+        self.chunkSalt = numpy.arange(1, chunkCount + 1, dtype=numpy.uint64) * _saltMultiplier
+
+        self.chunkKeys = numpy.zeros(0, dtype=numpy.uint64)
+        self.chunkRows = numpy.zeros(0, dtype=numpy.intp)
+        self.recent = {}
+
+    # Chunk keys (count, chunk count) of packed hashes (count, word count)
+    def _chunk_keys(self, words : ndarray) -> ndarray:
+        byteCount = self.chunkByteCount
+        raw = numpy.zeros((len(words), byteCount + 1), dtype=numpy.uint8)
+        raw[:, :byteCount] = words.view(numpy.uint8)[:, :byteCount]
+        folded = numpy.ascontiguousarray(raw[:, self.chunkGather]).view(numpy.uint64)
+
+        keys = folded[..., 0].copy()
+        for word in range(1, folded.shape[2]):
+            keys *= _foldMultiplier
+            keys ^= folded[..., word]
+        return keys ^ self.chunkSalt
+
+    def _add_chunks(self, rows : range) -> None:
+        keys = self._chunk_keys(self.words[rows.start:rows.stop])
+
+        if keys.size >= self.recentLimit:
+            self._merge(keys.reshape(-1), numpy.repeat(numpy.arange(rows.start, rows.stop, dtype=numpy.intp), keys.shape[1]))
+            return
+
+        for row, rowKeys in zip(rows, keys.tolist()):
+            for key in rowKeys:
+                self.recent.setdefault(key, []).append(row)
+        self.recentCount += keys.size
+
+        if self.recentCount >= self.recentLimit:
+            self._merge(
+                numpy.array([key for key, keyRows in self.recent.items() for _ in keyRows], dtype=numpy.uint64),
+                numpy.array([row for keyRows in self.recent.values() for row in keyRows], dtype=numpy.intp),
+            )
+            self.recent = {}
+            self.recentCount = 0
+
+    # Merge keys and their rows into the sorted array
+    def _merge(self, keys : ndarray, rows : ndarray) -> None:
+        keys = numpy.concatenate((self.chunkKeys, keys))
+        order = numpy.argsort(keys, kind="stable")
+        self.chunkKeys = keys[order]
+        self.chunkRows = numpy.concatenate((self.chunkRows, rows))[order]
+
+    def add(self, hash : ImageHash | ndarray, id : Any = None) -> int:
+        return self.add_packed(pack_hash(hash), [id], hash_bits(hash).size)[0]
+
+    # Bulk add already packed hashes, words of shape (count, word count).
+    # Returns the new rows
+    def add_packed(self, words : ndarray, ids : list[Any], bitCount : int) -> range:
+        words = numpy.asarray(words, dtype=numpy.uint64).reshape(len(ids), -1)
+        newCount = self.count + len(ids)
+
+        if self.words is None:
+            self.words = numpy.zeros((max(self.capacity, len(ids)), words.shape[1]), dtype=numpy.uint64)
+            # Chunks only cover hash bytes, never the zero padding
+            if self.mihTolerance is not None:
+                self._init_chunks(-(-bitCount // 8))
+        elif words.shape[1] != self.words.shape[1]:
+            raise ValueError(f"Hash size mismatch: {words.shape[1] * 64} bits, index holds {self.words.shape[1] * 64}")
+
+        # Grow by doubling
+        if newCount > len(self.words):
+            size = len(self.words)
+            while size < newCount:
+                size *= 2
+            grown = numpy.zeros((size, self.words.shape[1]), dtype=numpy.uint64)
+            grown[:self.count] = self.words[:self.count]
+            self.words = grown
+
+        rows = range(self.count, newCount)
+        self.words[self.count:newCount] = words
+        self.ids.extend(row if id is None else id for row, id in zip(rows, ids))
+        self.count = newCount
+
+        if self.chunkGather is not None:
+            self._add_chunks(rows)
+
+        return rows
+
+    # Hamming distance from hash to every row, or to the given rows
+    def distances(self, hash : ImageHash | ndarray, rows : ndarray = None) -> ndarray:
+        if self.count == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+        packed = pack_hash(hash)
+        table = self.words[:self.count] if rows is None else self.words[rows]
+        return popcount(table ^ packed).sum(axis=1, dtype=numpy.int64)
+
+    def _candidates(self, packed : ndarray) -> ndarray:
+        keys = self._chunk_keys(packed.reshape(1, -1))[0]
+        lows = numpy.searchsorted(self.chunkKeys, keys, "left")
+        highs = numpy.searchsorted(self.chunkKeys, keys, "right")
+        found = [self.chunkRows[lo:hi] for lo, hi in zip(lows.tolist(), highs.tolist()) if hi > lo]
+        for key in keys.tolist():
+            rows = self.recent.get(key)
+            if rows is not None:
+                found.append(numpy.array(rows, dtype=numpy.intp))
+        if len(found) == 0:
+            return numpy.zeros(0, dtype=numpy.intp)
+        return numpy.unique(numpy.concatenate(found))
+
+    # Rows within Hamming distance tolerance of hash, and their distances
+    def query(self, hash : ImageHash | ndarray, tolerance : int) -> tuple[ndarray, ndarray]:
+        if self.count == 0:
+            return numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.int64)
+
+        # Pigeonhole only holds with more chunks than the tolerance
+        if self.chunkGather is not None and tolerance < len(self.chunkBounds):
+            rows = self._candidates(pack_hash(hash))
+        else:
+            rows = numpy.arange(self.count)
+
+        d = self.distances(hash, rows)
+        keep = d <= tolerance
+        return rows[keep], d[keep]
+
+    # Closest row within tolerance as (found, id, distance)
+    def nearest(self, hash : ImageHash | ndarray, tolerance : int) -> tuple[bool, Any, int]:
+        rows, d = self.query(hash, tolerance)
+        if len(rows) == 0:
+            return False, None, None
+        best = int(numpy.argmin(d))
+        return True, self.ids[rows[best]], int(d[best])
+
+    def contains_within(self, hash : ImageHash | ndarray, tolerance : int) -> bool:
+        return len(self.query(hash, tolerance)[0]) > 0
+
+@NamespaceMethods.register
+def find_known_hash(hash : ImageHash, index : HashIndex, tolerance : int) -> tuple[bool, Any, int]:
+    return index.nearest(hash, tolerance)
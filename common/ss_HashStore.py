@@ -0,0 +1,211 @@
+import sqlite3
+import threading
+import time
+from typing import Iterator
+import numpy
+from numpy import ndarray
+from imagehash import ImageHash
+from common.ss_HashIndex import pack_hash, hash_bits
+try:
+    from common.ss_Logging import logSS
+except:
+    from ss_Logging import logSS
+
+"""
+Persistent store of discovered hashes, one SQLite file per profile.
+
+New hashes are queued in memory and written in one transaction when
+batchSize hashes are pending, flushSeconds have passed, or flush() is
+called. Every flush is a single atomic commit, so a crash loses at most
+the pending batch and never leaves a half-written file. Hashes are
+stored already packed into uint64 words, so loading a profile is one
+query and one frombuffer, with no hex parsing per row.
+
+With an ioWorker (see ss_Runtime) flushed batches are written on the
+worker's thread. Reads first wait for those writes. A batch that fails
+to write goes back to the front of the pending hashes and is retried
+by the next flush.
+
+Triggers keep a generation counter that every change other than an
+append (a new ID above all others) bumps: deletes, updates and inserts
+that replace or go below an existing ID, even when made outside this
+class. Data built from the hashes, such as a cached HashIndex, is
+current while the generation is unchanged, and only the hashes added
+after it need loading.
+"""
+
+class HashRecord:
+    __slots__ = ("id", "sequence", "words", "bitCount", "text", "character")
+
+    def __init__(self, id : int, sequence : str, words : ndarray, bitCount : int, text : str = "", character : str = "") -> None:
+        self.id = id
+        self.sequence = sequence
+        self.words = words
+        self.bitCount = bitCount
+        self.text = text
+        self.character = character
+
+class HashStore:
+
+    def __init__(self, path : str, batchSize : int = 32, flushSeconds : float = 5.0, ioWorker = None) -> None:
+        self.path = path
+        self.batchSize = batchSize
+        self.flushSeconds = flushSeconds
+        self.pending : list[HashRecord] = []
+        # Failed batches are requeued from the I/O worker's thread
+        self.pendingLock = threading.Lock()
+        self.lastFlush = time.monotonic()
+        self.ioWorker = ioWorker
+
+        # Writes may come from the I/O worker, the lock serializes them
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                id INTEGER PRIMARY KEY,
+                sequence TEXT NOT NULL,
+                bitCount INTEGER NOT NULL,
+                words BLOB NOT NULL,
+                text TEXT NOT NULL DEFAULT '',
+                character TEXT NOT NULL DEFAULT ''
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS hashes_sequence ON hashes (sequence)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+        bump = "UPDATE meta SET value = value + 1 WHERE key = 'generation'"
+        self.db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS hashes_rewrite BEFORE INSERT ON hashes
+            WHEN NEW.id <= (SELECT COALESCE(MAX(id), -1) FROM hashes) BEGIN {bump}; END
+        """)
+        self.db.execute(f"CREATE TRIGGER IF NOT EXISTS hashes_update AFTER UPDATE ON hashes BEGIN {bump}; END")
+        self.db.execute(f"CREATE TRIGGER IF NOT EXISTS hashes_delete AFTER DELETE ON hashes BEGIN {bump}; END")
+        self.db.commit()
+
+        self.nextID = self._max_id() + 1
+
+    def _max_id(self) -> int:
+        (maxID,) = self.db.execute("SELECT MAX(id) FROM hashes").fetchone()
+        return -1 if maxID is None else maxID
+
+    def __len__(self) -> int:
+        if self.ioWorker is not None:
+            self.ioWorker.wait()
+        with self.lock:
+            (count,) = self.db.execute("SELECT COUNT(*) FROM hashes").fetchone()
+        return count + len(self.pending)
+
+    # Queue a new hash and return its ID
+    def add(self, sequence : str, hash : ImageHash | ndarray, text : str = "", character : str = "", id : int = None) -> int:
+        if id is None:
+            id = self.nextID
+        self.nextID = max(self.nextID, id + 1)
+
+        record = HashRecord(id, sequence, pack_hash(hash), hash_bits(hash).size, text, character)
+        with self.pendingLock:
+            self.pending.append(record)
+
+        if len(self.pending) >= self.batchSize or time.monotonic() - self.lastFlush >= self.flushSeconds:
+            self.flush()
+        return id
+
+    def _insert(self, records : list[HashRecord]) -> None:
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO hashes (id, sequence, bitCount, words, text, character) VALUES (?, ?, ?, ?, ?, ?)",
+                [(r.id, r.sequence, r.bitCount, r.words.tobytes(), r.text, r.character) for r in records]
+            )
+
+    # Insert a flushed batch. On failure its hashes are pending again,
+    # ahead of newer ones, and the error is raised for the caller or the
+    # I/O worker to report
+    def _write(self, records : list[HashRecord]) -> None:
+        try:
+            self._insert(records)
+        except Exception:
+            with self.pendingLock:
+                self.pending[:0] = records
+            raise
+
+    # Write every pending hash in one atomic transaction, on the I/O
+    # worker if there is one
+    def flush(self) -> int:
+        with self.pendingLock:
+            records, self.pending = self.pending, []
+        count = len(records)
+        if count > 0:
+            if self.ioWorker is not None:
+                self.ioWorker.submit(self._write, records)
+            else:
+                self._write(records)
+        self.lastFlush = time.monotonic()
+        return count
+
+    # Flush and wait until every hash is on disk
+    def sync(self) -> None:
+        self.flush()
+        if self.ioWorker is not None:
+            self.ioWorker.wait()
+
+    # Bulk load every stored hash of a sequence with an ID above afterID
+    # as (ids, words (count, word count), bitCount)
+    def load_sequence(self, sequence : str, afterID : int = -1) -> tuple[list[int], ndarray, int]:
+        self.sync()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, bitCount, words FROM hashes WHERE sequence = ? AND id > ? ORDER BY id", (sequence, afterID)
+            ).fetchall()
+
+        if len(rows) == 0:
+            return [], numpy.zeros((0, 0), dtype=numpy.uint64), 0
+
+        bitCounts = {bitCount for _, bitCount, _ in rows}
+        if len(bitCounts) > 1:
+            raise ValueError(f"Mixed hash sizes {sorted(bitCounts)} stored for sequence {sequence}")
+
+        ids = [id for id, _, _ in rows]
+        words = numpy.frombuffer(b"".join(blob for _, _, blob in rows), dtype=numpy.uint64).reshape(len(rows), -1)
+        return ids, words, bitCounts.pop()
+
+    # Generation of the stored hashes, unchanged by appends
+    def generation(self) -> int:
+        self.sync()
+        with self.lock:
+            (generation,) = self.db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return generation
+
+    def sequences(self) -> list[str]:
+        self.sync()
+        with self.lock:
+            return [s for (s,) in self.db.execute("SELECT DISTINCT sequence FROM hashes")]
+
+    def records(self) -> Iterator[HashRecord]:
+        self.sync()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, sequence, bitCount, words, text, character FROM hashes ORDER BY id"
+            ).fetchall()
+        for id, sequence, bitCount, blob, text, character in rows:
+            yield HashRecord(id, sequence, numpy.frombuffer(blob, dtype=numpy.uint64), bitCount, text, character)
+
+    # Drop exact duplicate hashes (keeping the oldest), then fold the
+    # write-ahead log back in and reclaim free pages
+    def compact(self) -> int:
+        self.sync()
+        with self.lock:
+            with self.db:
+                removed = self.db.execute("""
+                    DELETE FROM hashes WHERE id NOT IN (
+                        SELECT MIN(id) FROM hashes GROUP BY sequence, bitCount, words
+                    )
+                """).rowcount
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.db.execute("VACUUM")
+        logSS.info(f"Compacted hash store {self.path}, removed {removed} duplicates")
+        return removed
+
+    def close(self) -> None:
+        self.sync()
+        self.db.close()
@@ -1,40 +1,293 @@
-from time import perf_counter
-from imagehash import ImageHash
+import math
+from functools import lru_cache
+from imagehash import ImageHash, hex_to_hash
+import numpy
 from numpy import ndarray
+from PIL.Image import Image as ImageClass
 from common.ss_namespace_methods import NamespaceMethods
+from common.ss_Image import flexCropBoxes
+from common.ss_HashIndex import pack_hash, popcount
+
+"""
+dHash computed straight from ndarray crops.
+
+The result is bit-identical to imagehash.dhash(), which converts to
+grayscale and resizes with PIL's LANCZOS filter. Both steps are redone
+here with PIL's own integer arithmetic:
+
+- grayscale uses PIL's ITU-R 601-2 fixed-point weights
+- resizing is PIL's two-pass separable convolution, with the filter
+  weights quantized to PIL's 22 fractional bits
+
+The horizontal pass works one row at a time, so a list of crops is
+hashed as if the crops were pasted on top of each other: every crop is
+resampled horizontally on its own and only the small resampled rows are
+stacked for the vertical pass. No merged image is ever built.
+"""
+
+# PIL's fixed-point precision for 8 bit resampling (Resample.c)
+resamplePrecisionBits = 32 - 8 - 2
+lanczosSupport = 3.0
+
+def _sinc(x : float) -> float:
+    if x == 0.0:
+        return 1.0
+    x = x * math.pi
+    return math.sin(x) / x
+
+def _lanczos(x : float) -> float:
+    if -lanczosSupport <= x < lanczosSupport:
+        return _sinc(x) * _sinc(x / 3)
+    return 0.0
+
+# Resampling weights from inSize to outSize pixels as a dense
+# (outSize, inSize) matrix, following PIL's precompute_coeffs() and
+# normalize_coeffs_8bpc(). Stored as float64 holding exact integers, so
+# the matrix product runs through BLAS and stays exact (every partial
+# sum is far below 2**53)
+@lru_cache(maxsize=64)
+def resample_weights(inSize : int, outSize : int) -> ndarray:
+    scale = filterScale = inSize / outSize
+    if filterScale < 1.0:
+        filterScale = 1.0
+    support = lanczosSupport * filterScale
+
+    weights = numpy.zeros((outSize, inSize), dtype=numpy.float64)
+    for xx in range(outSize):
+        center = (xx + 0.5) * scale
+        xMin = max(int(center - support + 0.5), 0)
+        xMax = min(int(center + support + 0.5), inSize)
+
+        k = [_lanczos((x - center + 0.5) / filterScale) for x in range(xMin, xMax)]
+        total = sum(k)
+        if total != 0.0:
+            k = [w / total for w in k]
+
+        weights[xx, xMin:xMax] = [
+            int(-0.5 + w * (1 << resamplePrecisionBits)) if w < 0 else int(0.5 + w * (1 << resamplePrecisionBits))
+            for w in k
+        ]
+
+    weights.flags.writeable = False
+    return weights
+
+# Round, shift and clamp fixed-point sums back to uint8 like PIL's clip8()
+def _clip8(sums : ndarray) -> ndarray:
+    fixed = sums.astype(numpy.int64) + (1 << (resamplePrecisionBits - 1))
+    return numpy.clip(fixed >> resamplePrecisionBits, 0, 255).astype(numpy.uint8)
+
+# Resample every row of a 2D uint8 array to width columns. With a wider
+# canvasWidth the rows are treated as padded with black on the right
+def resample_rows(gray : ndarray, width : int, canvasWidth : int = None) -> ndarray:
+    if canvasWidth is None:
+        canvasWidth = gray.shape[1]
+    if canvasWidth == width == gray.shape[1]:
+        return gray
+    return _clip8(gray @ resample_weights(canvasWidth, width)[:, :gray.shape[1]].T)
+
+# Resample every column of a 2D uint8 array to height rows
+def resample_columns(gray : ndarray, height : int) -> ndarray:
+    if gray.shape[0] == height:
+        return gray
+    return _clip8(resample_weights(gray.shape[0], height) @ gray)
+
+# PIL's "L" conversion: (299 R + 587 G + 114 B) / 1000 in 16 bit fixed point.
+# Alpha is ignored, exactly as PIL ignores it for RGBA images
+def grayscale_array(arr : ndarray) -> ndarray:
+    if arr.ndim == 2:
+        return arr
+    rgb = arr[..., :3].astype(numpy.uint32)
+    gray = rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000
+    return (gray >> 16).astype(numpy.uint8)
+
+def _hash_array(im : ImageClass | ndarray) -> ndarray:
+    if isinstance(im, ndarray):
+        return im
+    if im.mode not in ("L", "RGB", "RGBA", "RGBX"):
+        im = im.convert("L")
+    return numpy.asarray(im)
+
+# Flatten nested crop lists, the way mergeImages_Vertical accepts them
+def _flatten_crops(crops) -> list:
+    if not isinstance(crops, (list, tuple)):
+        return [crops]
+    flat = []
+    for crop in crops:
+        flat.extend(_flatten_crops(crop))
+    return flat
+
+# dHash of one image or array, or of a list of crops stacked top to bottom.
+# Crops narrower than the widest are padded with black, matching
+# mergeImages_Vertical
+@NamespaceMethods.register
+def compute_hash_dhash(im : ImageClass | ndarray | list, size : int = 8) -> ImageHash:
+    if size < 2:
+        raise ValueError("Hash size must be greater than or equal to 2")
+
+    crops = [grayscale_array(_hash_array(crop)) for crop in _flatten_crops(im)]
+    canvasWidth = max(gray.shape[1] for gray in crops)
+
+    rows = [resample_rows(gray, size + 1, canvasWidth) for gray in crops]
+    return _dhash_rows(rows[0] if len(rows) == 1 else numpy.concatenate(rows), size)
+
+# Finish a dHash from horizontally resampled uint8 rows
+def _dhash_rows(rows : ndarray, size : int) -> ImageHash:
+    pixels = resample_columns(rows, size)
+    return ImageHash(pixels[:, 1:] > pixels[:, :-1])
+
+"""
+Fused flexCropImage -> mergeImages_Vertical -> compute_hash_dhash.
+
+The crop grid is only index arithmetic over the frame: every piece is a
+view, its grayscale is written into a reused float64 buffer, and its
+horizontally resampled rows go straight to their place in the stitched
+row buffer. Buffers only grow, so after the first frame a hash allocates
+nothing but the small (size + 1) wide arrays of the vertical pass.
+The hash equals compute_hash_dhash(flexCropImage(...), size).
+"""
+class CropGridHasher:
+
+    lumaWeights = numpy.array([19595, 38470, 7471], dtype=numpy.float64)
+
+    def __init__(self, size : int = 8) -> None:
+        if size < 2:
+            raise ValueError("Hash size must be greater than or equal to 2")
+        self.size = size
+        self.grayBuffer = numpy.zeros((0, 0), dtype=numpy.float64)
+        self.rowBuffer = numpy.zeros((0, size + 1), dtype=numpy.float64)
+
+    def _reserve(self, height : int, width : int, totalHeight : int) -> None:
+        if height > self.grayBuffer.shape[0] or width > self.grayBuffer.shape[1]:
+            self.grayBuffer = numpy.zeros((max(height, self.grayBuffer.shape[0]), max(width, self.grayBuffer.shape[1])), dtype=numpy.float64)
+        if totalHeight > len(self.rowBuffer):
+            self.rowBuffer = numpy.zeros((totalHeight, self.size + 1), dtype=numpy.float64)
+
+    def hash(self, frame : ndarray, left, top, right, bottom, horizontalCount : int = None, verticalCount : int = None) -> ImageHash:
+        pieces = [frame[t:b, l:r] for l, t, r, b in flexCropBoxes(left, top, right, bottom, horizontalCount, verticalCount)]
+
+        canvasWidth = max(piece.shape[1] for piece in pieces)
+        totalHeight = sum(piece.shape[0] for piece in pieces)
+        self._reserve(max(piece.shape[0] for piece in pieces), canvasWidth, totalHeight)
+        weights = resample_weights(canvasWidth, self.size + 1)
+
+        offset = 0
+        for piece in pieces:
+            height, width = piece.shape[:2]
+            gray = self.grayBuffer[:height, :width]
+
+            # Same fixed-point "L" conversion as grayscale_array
+            if piece.ndim == 3:
+                numpy.matmul(piece[..., :3], self.lumaWeights, out=gray)
+                gray += 0x8000
+                gray *= 1.0 / (1 << 16)
+                numpy.floor(gray, out=gray)
+            else:
+                gray[...] = piece
+
+            numpy.matmul(gray, weights[:, :width].T, out=self.rowBuffer[offset:offset + height])
+            offset += height
+
+        return _dhash_rows(_clip8(self.rowBuffer[:totalHeight]), self.size)
+
+@NamespaceMethods.register
+def crop_grid_hash_dhash(frame : ndarray, left, top, right, bottom, horizontalCount : int = None, verticalCount : int = None, size : int = 8, hasher : CropGridHasher = None) -> ImageHash:
+    if hasher is None or hasher.size != size:
+        hasher = CropGridHasher(size)
+    return hasher.hash(frame, left, top, right, bottom, horizontalCount, verticalCount)
 
 @NamespaceMethods.register
 def dhash_nd_array(arr : ndarray) -> ImageHash:
     diff = arr[:, 1:] > arr[:, :-1]
     return ImageHash(diff)
 
-@NamespaceMethods.register
-def compute_hash_flatness(
-    hash : ImageHash,
-    prevHash : ImageHash,
-    diffTol : int, 
-    flat_duration : int, 
-    start_seconds : float
-) -> tuple[bool, ImageHash, float]:
-    
-    # Initialize if there is no previous hash
-    if prevHash is None:
-        prevHash = hash
-        start_seconds = 0
-        flat = False
-        diff = 0
-    else:
-        
-        # this uses the imagehash "hamming window" to find
-        # the similarity between two hash's original images
-        diff = hash - prevHash
-
-        if diff <= diffTol:
-            flat_time = perf_counter() - start_seconds
+"""
+Hash flatness ("is the screen region still?") detection.
+
+A region is flat once its hash has stayed within diffTolerance of the
+previous frame's hash for at least flatFrames consecutive frames and,
+if flatSeconds is set, for at least that long. Frame times come from the
+capture backend, so the duration is measured between captured frames.
+"""
+def _check_flatness_thresholds(flatFrames : int, flatSeconds : float) -> None:
+    if flatFrames is None and flatSeconds is None:
+        raise ValueError("Hash flatness needs a frame count or a duration threshold")
+
+class HashFlatnessDetector:
+    __slots__ = ("diffTolerance", "flatFrames", "flatSeconds", "prevHash", "stableFrames", "stableSince", "flat")
+
+    def __init__(self, diffTolerance : int, flatFrames : int = None, flatSeconds : float = None) -> None:
+        _check_flatness_thresholds(flatFrames, flatSeconds)
+        self.diffTolerance = diffTolerance
+        self.flatFrames = flatFrames
+        self.flatSeconds = flatSeconds
+        self.reset()
+
+    def reset(self) -> None:
+        self.prevHash : ImageHash = None
+        self.stableFrames = 0
+        self.stableSince : float = None
+        self.flat = False
+
+    # Feed one frame's hash, returns whether the region is flat
+    def update(self, hash : ImageHash, frameTime : float) -> bool:
+        if self.prevHash is not None and hash - self.prevHash <= self.diffTolerance:
+            self.stableFrames += 1
+        else:
+            self.stableFrames = 0
+            self.stableSince = frameTime
+        self.prevHash = hash
+
+        self.flat = (
+            (self.flatFrames is None or self.stableFrames >= self.flatFrames) and
+            (self.flatSeconds is None or frameTime - self.stableSince >= self.flatSeconds)
+        )
+        return self.flat
+
+# Many regions at once. Every frame brings one hash per region, packed
+# into a (regions, words) uint64 array, and all regions are compared
+# with a single XOR and popcount
+class MultiHashFlatnessDetector:
+    __slots__ = ("regionCount", "diffTolerance", "flatFrames", "flatSeconds", "prevWords", "stableFrames", "stableSince", "flat")
+
+    def __init__(self, regionCount : int, diffTolerance : int, flatFrames : int = None, flatSeconds : float = None) -> None:
+        _check_flatness_thresholds(flatFrames, flatSeconds)
+        self.regionCount = regionCount
+        self.diffTolerance = diffTolerance
+        self.flatFrames = flatFrames
+        self.flatSeconds = flatSeconds
+        self.reset()
+
+    def reset(self) -> None:
+        self.prevWords : ndarray = None
+        self.stableFrames = numpy.zeros(self.regionCount, dtype=numpy.int64)
+        self.stableSince = numpy.zeros(self.regionCount, dtype=numpy.float64)
+        self.flat = numpy.zeros(self.regionCount, dtype=bool)
+
+    # Feed one frame of hashes, ImageHashes or packed words, returns the
+    # flat state of every region
+    def update(self, hashes : list[ImageHash] | ndarray, frameTime : float) -> ndarray:
+        if isinstance(hashes, ndarray) and hashes.dtype == numpy.uint64:
+            words = hashes.reshape(self.regionCount, -1)
         else:
-            start_seconds = perf_counter()
+            words = numpy.stack([pack_hash(hash) for hash in hashes])
 
-        flat = True if flat_time >= flat_duration else False
+        if self.prevWords is None:
+            self.prevWords = words.copy()
+            self.stableFrames[:] = 0
+            self.stableSince[:] = frameTime
+        else:
+            stable = popcount(words ^ self.prevWords).sum(axis=1) <= self.diffTolerance
+            self.stableFrames = numpy.where(stable, self.stableFrames + 1, 0)
+            self.stableSince[~stable] = frameTime
+            numpy.copyto(self.prevWords, words)
+
+        self.flat[:] = True
+        if self.flatFrames is not None:
+            self.flat &= self.stableFrames >= self.flatFrames
+        if self.flatSeconds is not None:
+            self.flat &= frameTime - self.stableSince >= self.flatSeconds
+        return self.flat
 
-    print(f"count: {start_seconds}, diff: {diff}, flat: {flat}")
-    return flat, hash, start_seconds
\ No newline at end of file
+@NamespaceMethods.register
+def compute_hash_flatness(hash : ImageHash | list[ImageHash], detector : HashFlatnessDetector | MultiHashFlatnessDetector, frameTime : float) -> bool | ndarray:
+    return detector.update(hash, frameTime)
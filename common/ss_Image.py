@@ -5,35 +5,63 @@ import numpy
 from numpy import ndarray
 from typing import Union
 from common.ss_namespace_methods import NamespaceMethods
+from common.ss_Capture import get_capture_backend
 
 
+# Grab a frame from the active capture backend. The returned array is the
+# backend's reusable frame buffer and is overwritten by the next capture.
 @NamespaceMethods.register
-def screenshot() -> ImageClass:
-    return ImageGrab.grab()
+def capture_frame() -> ndarray:
+    return get_capture_backend().grab()
 
 @NamespaceMethods.register
-def make_np_array(im : ImageClass) -> ndarray:
-    return numpy.array(im)
+def screenshot() -> ImageClass:
+    return Image.fromarray(capture_frame())
 
+# Arrays pass through untouched, images are viewed without an extra copy
 @NamespaceMethods.register
-def flexCropImage(im : Image, left, top, right, bottom, horizontalCount : int = None, verticalCount : int = None):
+def make_np_array(im : ImageClass | ndarray) -> ndarray:
+    if isinstance(im, ndarray):
+        return im
+    return numpy.asarray(im)
+
+# Split the inclusive pixel range low..high into count pieces. Edges are
+# rounded so the pieces cover every pixel, widths differ by at most one
+def flexCropEdges(low : int, high : int, count : int) -> list[int]:
+    span = high - low + 1
+    return [low + (i * span) // count for i in range(count + 1)]
+
+# (left, top, right, bottom) crop boxes of a grid over the inclusive
+# region, ordered column by column like flexCropImage's pieces
+def flexCropBoxes(left, top, right, bottom, horizontalCount : int = None, verticalCount : int = None) -> list[tuple[int,int,int,int]]:
 
     if horizontalCount is None: horizontalCount = 1
     if verticalCount is None: verticalCount = 1
 
-    if horizontalCount == 1 and verticalCount == 1:
-        return im.crop((left, top, right, bottom))
-    else:
-        returnWidth = int((right - left + 1) / horizontalCount)
-        returnHeight = int((bottom - top + 1) / verticalCount)
+    xEdges = flexCropEdges(left, right, horizontalCount)
+    yEdges = flexCropEdges(top, bottom, verticalCount)
+    return [
+        (xEdges[hPiece], yEdges[vPiece], xEdges[hPiece + 1], yEdges[vPiece + 1])
+        for hPiece in range(horizontalCount)
+        for vPiece in range(verticalCount)
+    ]
 
-        returnImageList = []
-        for hPiece in range(horizontalCount):
-            for vPiece in range(verticalCount):
-                pieceLeft = left + hPiece * returnWidth
-                pieceTop = top + vPiece * returnHeight
-                returnImageList.append(im.crop((pieceLeft, pieceTop, pieceLeft + returnWidth, pieceTop + returnHeight)))
-        return returnImageList
+# Crop one box. Arrays are cropped into views of the frame, so no
+# pixels are copied
+def _crop(im : ImageClass | ndarray, left, top, right, bottom) -> ImageClass | ndarray:
+    if isinstance(im, ndarray):
+        return im[top:bottom, left:right]
+    return im.crop((left, top, right, bottom))
+
+# right and bottom are the last pixels of the region, as reported by the
+# pixel sequence scans
+@NamespaceMethods.register
+def flexCropImage(im : ImageClass | ndarray, left, top, right, bottom, horizontalCount : int = None, verticalCount : int = None):
+
+    boxes = flexCropBoxes(left, top, right, bottom, horizontalCount, verticalCount)
+    if len(boxes) == 1:
+        return _crop(im, *boxes[0])
+    return [_crop(im, *box) for box in boxes]
 
 @NamespaceMethods.register
 def mergeImages_Vertical(*images : ImageClass | list[ImageClass]) -> Image:
@@ -51,13 +79,15 @@ def mergeImages_Vertical(*images : ImageClass | list[ImageClass]) -> Image:
         else:
             imageList.append(arg)
 
+    imageList = [Image.fromarray(im) if isinstance(im, ndarray) else im for im in imageList]
+
     # find total image height
     totalHeight = 0
     for image in imageList:
         totalHeight += image.height
 
-    # create new image to hold all others
-    returnImage = Image.new('RGBA', (imageList[0].width, totalHeight))
+    # create new image to hold all others, as wide as the widest
+    returnImage = Image.new('RGBA', (max(image.width for image in imageList), totalHeight))
 
     # paste images, top to bottom
     yOffset = 0
@@ -68,7 +98,11 @@ def mergeImages_Vertical(*images : ImageClass | list[ImageClass]) -> Image:
     return returnImage
 
 @NamespaceMethods.register
-def saveImage(im : Image, fileNombre : str) -> bool:
+def saveImage(im : ImageClass | ndarray | list, fileNombre : str) -> bool:
+    if isinstance(im, list):
+        im = mergeImages_Vertical(im)
+    elif isinstance(im, ndarray):
+        im = Image.fromarray(im)
     try:
         im.save(fileNombre)
     except:
@@ -0,0 +1,406 @@
+import inspect
+import os
+import re
+from enum import IntEnum
+from typing import Any, Callable
+from common.ss_namespace_methods import NamespaceMethods
+from common.ss_ColorClasses import Color, ColorRequirement
+from common.ss_CompileCache import CompileCache, source_digest
+from common.ss_LOSLexer import LOS_SyntaxError, lex_lines
+from common.ss_LOSParser import (
+    LOS_ExpressionBase, LOS_ExpressionTypes, LOS_Expression_Assignment, LOS_Expression_Method,
+    parse_tokens,
+)
+
+"""
+Compiler and virtual machine for LOS scripts (.los).
+
+The expression tree is compiled to a register bytecode. Every variable,
+constant and intermediate value has a slot index into one flat list, so
+instructions name their operands by index and no dictionary is searched
+while a script runs. Constants are written to their slots once, when the
+VM is created.
+
+Calls are bound when compiling: the callable comes from
+NamespaceMethods.methods and named parameters are checked against its
+signature and turned into positional ones wherever possible. quit_if is
+not a call but the QUIT_IF instruction, which ends the run early.
+
+The setup(...) block runs once, when the VM is created; the rest of the
+script runs on every call to LOS_VM.run, e.g. once per frame.
+
+load_program keeps compiled programs in the compile cache of the
+script's directory, keyed by the source, losVersion and the signatures
+of the methods a script can call.
+"""
+
+# Version of the bytecode, bump it when compiled programs change
+losVersion = 1
+
+class LOS_Opcodes(IntEnum):
+    CALL0 = 0       # slots[dst] = fn()
+    CALL1 = 1       # slots[dst] = fn(slots[b])
+    CALL = 2        # slots[dst] = fn(*slots[b...])
+    CALLKW = 3      # slots[dst] = fn(*slots[args...], **{name: slots[kw]...})
+    INDEX = 4       # slots[dst] = slots[a][slots[b]]
+    ATTR = 5        # slots[dst] = getattr(slots[a], b)
+    NOT = 6         # slots[dst] = not slots[a]
+    LIST = 7        # slots[dst] = [slots[a...]]
+    MOVE = 8        # slots[dst] = slots[a]
+    QUIT_IF = 9     # stop the run if slots[a] is true
+    INDEXK = 10     # slots[dst] = slots[a][b], constant key
+    QUIT_UNLESS = 11    # stop the run if slots[a] is false, quit_if(!x)
+    CALL2 = 12      # slots[dst] = fn(slots[b[0]], slots[b[1]])
+    CALL3 = 13      # slots[dst] = fn(slots[b[0]], slots[b[1]], slots[b[2]])
+
+# For the dispatch loop: unpacking a tuple is cheap, iterating the enum is not
+_opcodes = tuple(LOS_Opcodes)
+
+# Methods whose LOS form differs from the Python one
+def make_color(r : int, g : int, b : int, tolerance : int = 0, required : bool = True) -> Color:
+    return Color((r, g, b), tolerance, ColorRequirement.required if required else ColorRequirement.notRequired)
+
+losAdapters = {
+    "Color" : make_color,
+}
+
+# LOS parameter names for the Python ones they stand for
+parameterAliases = {
+    "image" : "im",
+}
+
+# Names of methods compiled to instructions instead of calls
+quitMethod = "quit_if"
+
+# _[start_pixel] reads the startPixel attribute
+def attributeName(name : str) -> str:
+    return re.sub(r"_([a-z0-9])", lambda m: m.group(1).upper(), name)
+
+"""
+A compiled script: the bytecode of the setup block and of the per-run
+body, the slot layout and the source position of every instruction.
+Holds only plain values and module level callables, so it can be
+pickled.
+"""
+class LOS_Program:
+
+    def __init__(self, filename : str) -> None:
+        self.filename = filename
+        self.slotCount = 0
+        self.variables : dict[str, int] = {}
+        self.inputs : dict[str, int] = {}
+        self.constants : list[tuple[int, Any]] = []
+        self.setupCode : tuple = ()
+        self.code : tuple = ()
+        self.setupPositions : tuple = ()
+        self.positions : tuple = ()
+
+    def disassemble(self) -> list[str]:
+        names = {slot: name for name, slot in self.variables.items()}
+        names.update({slot: repr(value) for slot, value in self.constants})
+
+        def operand(value : Any) -> str:
+            if isinstance(value, int) and not isinstance(value, bool):
+                return names.get(value, f"%{value}")
+            if isinstance(value, tuple):
+                return "(" + ", ".join(operand(v) for v in value) + ")"
+            if callable(value):
+                return value.__name__
+            return repr(value)
+
+        lines = []
+        for label, code, positions in (("setup", self.setupCode, self.setupPositions), ("run", self.code, self.positions)):
+            lines.append(f"{label}:")
+            for (op, dst, a, b), (line, column) in zip(code, positions):
+                fields = [operand(x) for x in (dst, a) if x is not None]
+                if b is not None:
+                    fields.append(repr(b) if op in (LOS_Opcodes.ATTR, LOS_Opcodes.INDEXK) else operand(b))
+                lines.append(f"  {line:4}:{column:<3} {op.name:<8} {' '.join(fields)}")
+        return lines
+
+class LOS_Compiler:
+
+    def __init__(self, filename : str = "<los>", inputs : tuple[str, ...] = (), methods : dict[str, Callable] = None) -> None:
+        self.program = LOS_Program(filename)
+        self.methods = NamespaceMethods.methods if methods is None else methods
+        self.constantSlots : dict[tuple, int] = {}
+        self.defined : set[str] = set()
+        self.assigned : set[str] = set(inputs)
+        self.code : list[tuple] = []
+        self.positions : list[tuple[int, int]] = []
+
+        for name in inputs:
+            self.program.inputs[name] = self.variable_slot(name)
+            self.defined.add(name)
+
+    def error(self, message : str, node : LOS_ExpressionBase) -> LOS_SyntaxError:
+        return LOS_SyntaxError(message, self.program.filename, node.line, node.column)
+
+    def new_slot(self) -> int:
+        self.program.slotCount += 1
+        return self.program.slotCount - 1
+
+    def variable_slot(self, name : str) -> int:
+        slot = self.program.variables.get(name)
+        if slot is None:
+            slot = self.program.variables[name] = self.new_slot()
+        return slot
+
+    def constant_slot(self, value : Any) -> int:
+        # 1, 1.0 and true are equal but stay separate constants
+        key = (type(value), value)
+        slot = self.constantSlots.get(key)
+        if slot is None:
+            slot = self.constantSlots[key] = self.new_slot()
+            self.program.constants.append((slot, value))
+        return slot
+
+    def emit(self, node : LOS_ExpressionBase, op : LOS_Opcodes, dst : int = None, a : Any = None, b : Any = None) -> None:
+        self.code.append((op, dst, a, b))
+        self.positions.append((node.line, node.column))
+
+    def compile(self, statements : list[LOS_ExpressionBase]) -> LOS_Program:
+        for statement in statements:
+            if isinstance(statement, LOS_Expression_Assignment):
+                self.assigned.add(statement.destination)
+            elif statement.type == LOS_ExpressionTypes.SETUP:
+                self.assigned.update(a.destination for a in statement.assignments)
+
+        # The setup blocks, wherever they are, run before the body
+        for statement in statements:
+            if statement.type == LOS_ExpressionTypes.SETUP:
+                for assignment in statement.assignments:
+                    self.compile_statement(assignment)
+        self.program.setupCode, self.program.setupPositions = tuple(self.code), tuple(self.positions)
+        self.code, self.positions = [], []
+
+        for statement in statements:
+            if statement.type != LOS_ExpressionTypes.SETUP:
+                self.compile_statement(statement)
+        self.program.code, self.program.positions = tuple(self.code), tuple(self.positions)
+
+        return self.program
+
+    def compile_statement(self, node : LOS_ExpressionBase) -> None:
+        if isinstance(node, LOS_Expression_Assignment):
+            dst = self.variable_slot(node.destination)
+            src = self.compile_expression(node.source, dst)
+            if src != dst:
+                self.emit(node, LOS_Opcodes.MOVE, dst, src)
+            self.defined.add(node.destination)
+        elif isinstance(node, LOS_Expression_Method):
+            self.compile_call(node, self.new_slot())
+        else:
+            raise self.error(f"Expected an assignment or a method call, got {node}", node)
+
+    # Slot holding the value of node, dst if the value has to be computed
+    def compile_expression(self, node : LOS_ExpressionBase, dst : int = None) -> int:
+        kind = node.type
+
+        if kind == LOS_ExpressionTypes.CONSTANT:
+            return self.constant_slot(node.value)
+
+        if kind == LOS_ExpressionTypes.VARIABLE:
+            if node.name not in self.defined:
+                if node.name in self.assigned:
+                    raise self.error(f"{node.name} is used before it is assigned", node)
+                raise self.error(f"Undefined variable {node.name}", node)
+            return self.program.variables[node.name]
+
+        if dst is None:
+            dst = self.new_slot()
+
+        if kind == LOS_ExpressionTypes.METHOD_CALL:
+            self.compile_call(node, dst)
+        elif kind == LOS_ExpressionTypes.GETATTR:
+            var = self.compile_expression(node.var)
+            # A bare name that is never assigned is an attribute name
+            if node.attr.type == LOS_ExpressionTypes.VARIABLE and node.attr.name not in self.assigned:
+                self.emit(node, LOS_Opcodes.ATTR, dst, var, attributeName(node.attr.name))
+            elif node.attr.type == LOS_ExpressionTypes.CONSTANT:
+                self.emit(node, LOS_Opcodes.INDEXK, dst, var, node.attr.value)
+            else:
+                self.emit(node, LOS_Opcodes.INDEX, dst, var, self.compile_expression(node.attr))
+        elif kind == LOS_ExpressionTypes.NOT:
+            self.emit(node, LOS_Opcodes.NOT, dst, self.compile_expression(node.operand))
+        elif kind == LOS_ExpressionTypes.LIST:
+            self.emit(node, LOS_Opcodes.LIST, dst, tuple(self.compile_expression(i) for i in node.items))
+        else:
+            raise self.error(f"Cannot compile {node}", node)
+        return dst
+
+    def compile_call(self, node : LOS_Expression_Method, dst : int) -> None:
+        if node.name == quitMethod:
+            if len(node.args) != 1 or node.params:
+                raise self.error(f"{quitMethod} takes one condition", node)
+            condition = node.args[0]
+            if condition.type == LOS_ExpressionTypes.NOT:
+                self.emit(node, LOS_Opcodes.QUIT_UNLESS, None, self.compile_expression(condition.operand))
+            else:
+                self.emit(node, LOS_Opcodes.QUIT_IF, None, self.compile_expression(condition))
+            return
+
+        function = losAdapters.get(node.name) or self.methods.get(node.name)
+        if function is None:
+            raise self.error(f"Unknown method {node.name}", node)
+
+        args = [self.compile_expression(a) for a in node.args]
+        params = {name: self.compile_expression(p) for name, p in node.params.items()}
+        args, params = self.bind(node, function, args, params)
+
+        if params:
+            names = tuple(params)
+            self.emit(node, LOS_Opcodes.CALLKW, dst, function, (tuple(args), names, tuple(params[n] for n in names)))
+        elif len(args) == 0:
+            self.emit(node, LOS_Opcodes.CALL0, dst, function)
+        elif len(args) == 1:
+            self.emit(node, LOS_Opcodes.CALL1, dst, function, args[0])
+        elif len(args) == 2:
+            self.emit(node, LOS_Opcodes.CALL2, dst, function, tuple(args))
+        elif len(args) == 3:
+            self.emit(node, LOS_Opcodes.CALL3, dst, function, tuple(args))
+        else:
+            self.emit(node, LOS_Opcodes.CALL, dst, function, tuple(args))
+
+    # Check the call against the signature, named parameters that can be
+    # passed by position become positional
+    def bind(self, node : LOS_Expression_Method, function : Callable, args : list[int], params : dict[str, int]) -> tuple[list[int], dict[str, int]]:
+        try:
+            signature = inspect.signature(function)
+        except (TypeError, ValueError):
+            return args, params
+
+        parameters = signature.parameters
+        named = {}
+        for name, slot in params.items():
+            alias = parameterAliases.get(name)
+            named[alias if name not in parameters and alias in parameters else name] = slot
+
+        try:
+            bound = signature.bind(*args, **named)
+        except TypeError as e:
+            raise self.error(f"Bad call to {node.name}: {e}", node) from None
+        return list(bound.args), dict(bound.kwargs)
+
+"""
+Runs a compiled program. The slot list is the VM's whole state: it is
+filled with the constants and the setup results once, then every run
+overwrites the per-run slots in place.
+"""
+class LOS_VM:
+
+    def __init__(self, program : LOS_Program) -> None:
+        self.program = program
+        self.slots : list[Any] = [None] * program.slotCount
+        for slot, value in program.constants:
+            self.slots[slot] = value
+        self.runCount = 0
+        self.quitCount = 0
+        self.execute(program.setupCode, program.setupPositions)
+
+    def __getitem__(self, name : str) -> Any:
+        return self.slots[self.program.variables[name]]
+
+    # Run the script body with the given inputs, e.g. run(frame= frame).
+    # True if it ran to the end, False if a quit_if stopped it
+    def run(self, **inputs : Any) -> bool:
+        slots = self.slots
+        for name, value in inputs.items():
+            slots[self.program.inputs[name]] = value
+
+        self.runCount += 1
+        completed = self.execute(self.program.code, self.program.positions)
+        if not completed:
+            self.quitCount += 1
+        return completed
+
+    def execute(self, code : tuple, positions : tuple) -> bool:
+        slots = self.slots
+        CALL0, CALL1, CALL, CALLKW, INDEX, ATTR, NOT, LIST, MOVE, QUIT_IF, INDEXK, QUIT_UNLESS, CALL2, CALL3 = _opcodes
+
+        # Most frequent instructions first
+        ins = None
+        try:
+            for ins in code:
+                op, dst, a, b = ins
+                if op == CALL2:
+                    slots[dst] = a(slots[b[0]], slots[b[1]])
+                elif op == INDEXK:
+                    slots[dst] = slots[a][b]
+                elif op == QUIT_UNLESS:
+                    if not slots[a]:
+                        return False
+                elif op == CALL1:
+                    slots[dst] = a(slots[b])
+                elif op == CALL3:
+                    slots[dst] = a(slots[b[0]], slots[b[1]], slots[b[2]])
+                elif op == ATTR:
+                    slots[dst] = getattr(slots[a], b)
+                elif op == INDEX:
+                    slots[dst] = slots[a][slots[b]]
+                elif op == QUIT_IF:
+                    if slots[a]:
+                        return False
+                elif op == CALL0:
+                    slots[dst] = a()
+                elif op == CALL:
+                    slots[dst] = a(*[slots[i] for i in b])
+                elif op == NOT:
+                    slots[dst] = not slots[a]
+                elif op == LIST:
+                    slots[dst] = [slots[i] for i in a]
+                elif op == MOVE:
+                    slots[dst] = slots[a]
+                else:
+                    argSlots, names, kwSlots = b
+                    slots[dst] = a(*[slots[i] for i in argSlots], **{n: slots[i] for n, i in zip(names, kwSlots)})
+        except Exception as e:
+            pc = next(i for i, x in enumerate(code) if x is ins)
+            line, column = positions[pc]
+            e.add_note(f"in LOS script at {self.program.filename}:{line}:{column}")
+            raise
+        return True
+
+def compile_program(statements : list[LOS_ExpressionBase], filename : str = "<los>", inputs : tuple[str, ...] = (), methods : dict[str, Callable] = None) -> LOS_Program:
+    return LOS_Compiler(filename, inputs, methods).compile(statements)
+
+def compile_string(source : str, filename : str = "<los>", inputs : tuple[str, ...] = (), methods : dict[str, Callable] = None) -> LOS_Program:
+    tokens = list(lex_lines(source.splitlines(), filename))
+    return compile_program(parse_tokens(tokens, filename), filename, inputs, methods)
+
+def compile_file(path : str, inputs : tuple[str, ...] = (), methods : dict[str, Callable] = None) -> LOS_Program:
+    with open(path, 'r') as los:
+        tokens = list(lex_lines(los, path))
+    return compile_program(parse_tokens(tokens, path), path, inputs, methods)
+
+# Everything a compiled program depends on besides its source. Reading
+# signatures is slow, so the stamp is kept until a method changes
+_bindingStamp : tuple[tuple, str] = ((), "")
+
+def binding_stamp() -> str:
+    global _bindingStamp
+    methods = {**NamespaceMethods.methods, **losAdapters}
+    bound = tuple(methods.items()) + tuple(parameterAliases.items())
+    if _bindingStamp[0] != bound:
+        lines = [f"{name} {m.__module__}.{m.__qualname__}{inspect.signature(m)}" for name, m in sorted(methods.items())]
+        lines.append(repr(sorted(parameterAliases.items())))
+        _bindingStamp = (bound, "\n".join(lines))
+    return _bindingStamp[1]
+
+# compile_file through the compile cache of the script's directory
+def load_program(path : str, inputs : tuple[str, ...] = (), cache : CompileCache = None) -> LOS_Program:
+    with open(path, 'rb') as los:
+        source = los.read()
+
+    if cache is None:
+        cache = CompileCache(os.path.dirname(path))
+    name = f"los/{os.path.basename(path)}"
+    key = source_digest(str(losVersion), path, source, repr(tuple(inputs)), binding_stamp())
+
+    program = cache.get(name, key)
+    if program is None:
+        tokens = list(lex_lines(source.decode("utf-8").splitlines(), path))
+        program = compile_program(parse_tokens(tokens, path), path, inputs)
+        cache.put(name, key, program)
+        cache.save()
+    return program
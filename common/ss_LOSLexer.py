@@ -0,0 +1,145 @@
+import re
+from enum import Enum, auto as enum_auto
+from typing import Any, Iterable, Iterator
+from common.ss_namespace_methods import NamespaceMethods
+
+"""
+Lexer for LOS scripts (.los).
+
+One pass over the source, one line at a time: a single regular
+expression matches token after token along the line, so the cost
+is linear in the script length and a file never has to be held in
+memory as a whole.
+
+Every token keeps its line and column (both from 1) for error reports.
+Number, string and boolean tokens carry their decoded value. String
+literals are kept whole, with '#' and punctuation inside them intact.
+"""
+
+class LOS_TokenTypes(Enum):
+    VARIABLE = enum_auto()
+    METHOD = enum_auto()
+    OPEN_PARENTHESES = enum_auto()
+    CLOSE_PARENTHESES = enum_auto()
+    OPEN_BRACKET_SQUARE = enum_auto()
+    CLOSE_BRACKET_SQUARE = enum_auto()
+    ASSIGN = enum_auto()
+    COMMA = enum_auto()
+    NOT_OPERATOR = enum_auto()
+    IMMEDIATE_INTEGER = enum_auto()
+    IMMEDIATE_FLOAT = enum_auto()
+    IMMEDIATE_BOOLEAN = enum_auto()
+    STRING = enum_auto()
+    SETUP = enum_auto()
+    GETATTR = enum_auto()
+
+namespace_forbidden = [
+    "from", "import"
+]
+
+namespace_TokenType_Strings = {
+    "(" : LOS_TokenTypes.OPEN_PARENTHESES,
+    ")" : LOS_TokenTypes.CLOSE_PARENTHESES,
+    "[" : LOS_TokenTypes.OPEN_BRACKET_SQUARE,
+    "]" : LOS_TokenTypes.CLOSE_BRACKET_SQUARE,
+    "=" : LOS_TokenTypes.ASSIGN,
+    "," : LOS_TokenTypes.COMMA,
+    "!" : LOS_TokenTypes.NOT_OPERATOR,
+    "setup" : LOS_TokenTypes.SETUP,
+}
+
+namespace_booleans = {"true": True, "false": False}
+
+class LOS_Token:
+    __slots__ = ("type", "string", "value", "line", "column")
+
+    def __init__(self, type : LOS_TokenTypes, string : str = None, value : Any = None, line : int = None, column : int = None) -> None:
+        self.type = type
+        self.string = string
+        self.value = value
+        self.line = line
+        self.column = column
+
+    def __str__(self) -> str:
+        return f"Type: {self.type.name}:: {self.string} ({self.line}:{self.column})"
+
+class LOS_SyntaxError(SyntaxError):
+
+    def __init__(self, message : str, filename : str, line : int, column : int, text : str = None) -> None:
+        super().__init__(f"{message} at {filename}:{line}:{column}", (filename, line, column, text))
+        self.line = line
+        self.column = column
+
+# Leading white space belongs to the token that follows it, so every
+# match is a token or a comment
+_tokenPattern = re.compile(r"""[ \t\r\n\f]*(?:
+     (?P<name>[A-Za-z_]\w*)
+    |(?P<punct>[()\[\]=,!])
+    |(?P<float>-?(?:\d+\.\d*|\.\d+))
+    |(?P<int>-?\d+)
+    |(?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    |(?P<comment>\#.*)
+)""", re.VERBOSE)
+
+_escapes = {"n": "\n", "t": "\t", "\\": "\\", '"': '"', "'": "'"}
+_escapePattern = re.compile(r"\\(.)")
+
+def _unescape(literal : str) -> str:
+    return _escapePattern.sub(lambda m: _escapes.get(m.group(1), m.group(0)), literal[1:-1])
+
+# Tokens of the given source lines, e.g. an open file
+def lex_lines(lines : Iterable[str], filename : str = "<los>") -> Iterator[LOS_Token]:
+    finditer = _tokenPattern.finditer
+    methods = NamespaceMethods.methods
+    punct = namespace_TokenType_Strings
+
+    for lineNumber, text in enumerate(lines, 1):
+        # Blank and comment lines are common in scripts, skip them outright
+        stripped = text.lstrip()
+        if not stripped or stripped[0] == "#":
+            continue
+
+        pos = 0
+        for m in finditer(text):
+            # A gap between matches is a character no token starts with
+            if m.start() != pos:
+                break
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == "comment":
+                continue
+
+            string = m.group(kind)
+            column = m.start(kind) + 1
+            if kind == "name":
+                if string in punct:
+                    yield LOS_Token(punct[string], string, None, lineNumber, column)
+                elif string in namespace_booleans:
+                    yield LOS_Token(LOS_TokenTypes.IMMEDIATE_BOOLEAN, string, namespace_booleans[string], lineNumber, column)
+                elif string in methods:
+                    yield LOS_Token(LOS_TokenTypes.METHOD, string, None, lineNumber, column)
+                elif string in namespace_forbidden:
+                    raise LOS_SyntaxError(f"{string} is not allowed", filename, lineNumber, column, text)
+                else:
+                    yield LOS_Token(LOS_TokenTypes.VARIABLE, string, None, lineNumber, column)
+            elif kind == "punct":
+                yield LOS_Token(punct[string], string, None, lineNumber, column)
+            elif kind == "int":
+                yield LOS_Token(LOS_TokenTypes.IMMEDIATE_INTEGER, string, int(string), lineNumber, column)
+            elif kind == "float":
+                yield LOS_Token(LOS_TokenTypes.IMMEDIATE_FLOAT, string, float(string), lineNumber, column)
+            else:
+                yield LOS_Token(LOS_TokenTypes.STRING, string, _unescape(string), lineNumber, column)
+
+        if pos != len(text) and not text[pos:].isspace():
+            # Skip the white space in front of the offending character
+            pos += len(text[pos:]) - len(text[pos:].lstrip(" \t\r\n\f"))
+            message = "Unterminated string" if text[pos] in "\"'" else f"Unexpected character {text[pos]!r}"
+            raise LOS_SyntaxError(message, filename, lineNumber, pos + 1, text)
+
+def lex_string(source : str, filename : str = "<los>") -> list[LOS_Token]:
+    return list(lex_lines(source.splitlines(), filename))
+
+def lex_file(path : str) -> list[LOS_Token]:
+    with open(path, 'r') as los:
+        return list(lex_lines(los, path))
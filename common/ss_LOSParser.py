@@ -0,0 +1,294 @@
+from enum import Enum, auto as enum_auto
+from typing import Any, Callable
+from common.ss_namespace_methods import NamespaceMethods
+from common.ss_LOSLexer import LOS_TokenTypes, LOS_Token, LOS_SyntaxError, lex_lines
+
+"""
+Parser for LOS scripts (.los).
+
+Recursive descent over the lexer's tokens: each token is looked at a
+fixed number of times, so parsing is linear in the script length. The
+result is a typed tree of expression nodes, each keeping the line and
+column of the token it starts at.
+
+    program     := statement*
+    statement   := setup | assignment | call
+    setup       := "setup" "(" (assignment ","?)* ")"
+    assignment  := VARIABLE "=" expression
+    expression  := "!" expression | primary ("[" expression "]")*
+    primary     := call | VARIABLE | number | boolean | STRING | "[" list "]"
+    call        := (METHOD | VARIABLE) "(" arguments ")"
+    arguments   := (VARIABLE "=" expression | expression) ("," ...)*
+"""
+
+class LOS_ExpressionTypes(Enum):
+    ASSIGNMENT = enum_auto()
+    METHOD_CALL = enum_auto()
+    GETATTR = enum_auto()
+    NOT = enum_auto()
+    VARIABLE = enum_auto()
+    CONSTANT = enum_auto()
+    LIST = enum_auto()
+    SETUP = enum_auto()
+
+class LOS_ExpressionBase:
+    __slots__ = ("type", "line", "column")
+
+    def __init__(self, type : LOS_ExpressionTypes, token : LOS_Token) -> None:
+        self.type = type
+        self.line = token.line
+        self.column = token.column
+
+    def __eq__(self, other : Any) -> bool:
+        return type(self) is type(other) and str(self) == str(other)
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+    def __repr__(self) -> str:
+        return f"<{self.type.name} {self} ({self.line}:{self.column})>"
+
+class LOS_Expression_Constant(LOS_ExpressionBase):
+    __slots__ = ("value",)
+
+    def __init__(self, token : LOS_Token) -> None:
+        super().__init__(LOS_ExpressionTypes.CONSTANT, token)
+        self.value = token.value
+
+    def __str__(self) -> str:
+        if isinstance(self.value, bool):
+            return "true" if self.value else "false"
+        return repr(self.value)
+
+class LOS_Expression_Variable(LOS_ExpressionBase):
+    __slots__ = ("name",)
+
+    def __init__(self, token : LOS_Token) -> None:
+        super().__init__(LOS_ExpressionTypes.VARIABLE, token)
+        self.name = token.string
+
+    def __str__(self) -> str:
+        return self.name
+
+class LOS_Expression_List(LOS_ExpressionBase):
+    __slots__ = ("items",)
+
+    def __init__(self, token : LOS_Token, items : list[LOS_ExpressionBase]) -> None:
+        super().__init__(LOS_ExpressionTypes.LIST, token)
+        self.items = items
+
+    def __str__(self) -> str:
+        return f"[{', '.join(str(i) for i in self.items)}]"
+
+class LOS_Expression_Not(LOS_ExpressionBase):
+    __slots__ = ("operand",)
+
+    def __init__(self, token : LOS_Token, operand : LOS_ExpressionBase) -> None:
+        super().__init__(LOS_ExpressionTypes.NOT, token)
+        self.operand = operand
+
+    def __str__(self) -> str:
+        return f"!{self.operand}"
+
+# var[attr]: an attribute by name (_[start_pixel]) or an index (r[0])
+class LOS_Expression_GetAttr(LOS_ExpressionBase):
+    __slots__ = ("var", "attr")
+
+    def __init__(self, token : LOS_Token, var : LOS_ExpressionBase, attr : LOS_ExpressionBase) -> None:
+        super().__init__(LOS_ExpressionTypes.GETATTR, token)
+        self.var = var
+        self.attr = attr
+
+    def __str__(self) -> str:
+        return f"{self.var}[{self.attr}]"
+
+class LOS_Expression_Method(LOS_ExpressionBase):
+    __slots__ = ("name", "method", "args", "params")
+
+    def __init__(self, token : LOS_Token, args : list[LOS_ExpressionBase], params : dict[str, LOS_ExpressionBase]) -> None:
+        super().__init__(LOS_ExpressionTypes.METHOD_CALL, token)
+        self.name = token.string
+        self.method : Callable = NamespaceMethods.methods.get(token.string)
+        self.args = args
+        self.params = params
+
+    def __str__(self) -> str:
+        parts = [str(a) for a in self.args] + [f"{k} = {v}" for k, v in self.params.items()]
+        return f"{self.name}({', '.join(parts)})"
+
+class LOS_Expression_Assignment(LOS_ExpressionBase):
+    __slots__ = ("destination", "source")
+
+    def __init__(self, token : LOS_Token, source : LOS_ExpressionBase) -> None:
+        super().__init__(LOS_ExpressionTypes.ASSIGNMENT, token)
+        self.destination = token.string
+        self.source = source
+
+    def __str__(self) -> str:
+        return f"{self.destination} = {self.source}"
+
+class LOS_Expression_Setup(LOS_ExpressionBase):
+    __slots__ = ("assignments",)
+
+    def __init__(self, token : LOS_Token, assignments : list[LOS_Expression_Assignment]) -> None:
+        super().__init__(LOS_ExpressionTypes.SETUP, token)
+        self.assignments = assignments
+
+    def __str__(self) -> str:
+        return f"setup({', '.join(str(a) for a in self.assignments)})"
+
+_constantTypes = {
+    LOS_TokenTypes.IMMEDIATE_INTEGER,
+    LOS_TokenTypes.IMMEDIATE_FLOAT,
+    LOS_TokenTypes.IMMEDIATE_BOOLEAN,
+    LOS_TokenTypes.STRING,
+}
+
+class LOS_Parser:
+
+    def __init__(self, tokens : list[LOS_Token], filename : str = "<los>") -> None:
+        self.tokens = tokens
+        self.filename = filename
+        self.pos = 0
+
+    def error(self, message : str, token : LOS_Token = None) -> LOS_SyntaxError:
+        if token is None:
+            if self.pos < len(self.tokens):
+                token = self.tokens[self.pos]
+            elif self.tokens:
+                # Past the last token, point just after it
+                last = self.tokens[-1]
+                return LOS_SyntaxError(f"{message}, got end of script", self.filename, last.line, last.column + len(last.string))
+            else:
+                return LOS_SyntaxError(f"{message}, got end of script", self.filename, 1, 1)
+        return LOS_SyntaxError(f"{message}, got {token.string!r}", self.filename, token.line, token.column)
+
+    def peek(self, offset : int = 0) -> LOS_Token | None:
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else None
+
+    def at(self, type : LOS_TokenTypes, offset : int = 0) -> bool:
+        token = self.peek(offset)
+        return token is not None and token.type is type
+
+    # A method, or any name followed by "(": the compiler may be given
+    # methods that are not registered
+    def at_call(self) -> bool:
+        return self.at(LOS_TokenTypes.METHOD) or (self.at(LOS_TokenTypes.VARIABLE) and self.at(LOS_TokenTypes.OPEN_PARENTHESES, 1))
+
+    def expect(self, type : LOS_TokenTypes, what : str) -> LOS_Token:
+        token = self.peek()
+        if token is None or token.type is not type:
+            raise self.error(f"Expected {what}")
+        self.pos += 1
+        return token
+
+    def parse_program(self) -> list[LOS_ExpressionBase]:
+        statements = []
+        while self.pos < len(self.tokens):
+            statements.append(self.parse_statement())
+        return statements
+
+    def parse_statement(self) -> LOS_ExpressionBase:
+        token = self.peek()
+        if token.type is LOS_TokenTypes.SETUP:
+            return self.parse_setup()
+        if self.at_call():
+            return self.parse_call()
+        if token.type is LOS_TokenTypes.VARIABLE:
+            return self.parse_assignment()
+        raise self.error("Expected an assignment, a method call or setup")
+
+    def parse_setup(self) -> LOS_Expression_Setup:
+        token = self.expect(LOS_TokenTypes.SETUP, "setup")
+        self.expect(LOS_TokenTypes.OPEN_PARENTHESES, "'(' after setup")
+        assignments = []
+        while not self.at(LOS_TokenTypes.CLOSE_PARENTHESES):
+            if not self.at(LOS_TokenTypes.VARIABLE):
+                raise self.error("Expected an assignment or ')' in setup")
+            assignments.append(self.parse_assignment())
+            if self.at(LOS_TokenTypes.COMMA):
+                self.pos += 1
+        self.pos += 1
+        return LOS_Expression_Setup(token, assignments)
+
+    def parse_assignment(self) -> LOS_Expression_Assignment:
+        token = self.expect(LOS_TokenTypes.VARIABLE, "a variable")
+        self.expect(LOS_TokenTypes.ASSIGN, f"'=' after {token.string}")
+        return LOS_Expression_Assignment(token, self.parse_expression())
+
+    def parse_expression(self) -> LOS_ExpressionBase:
+        token = self.peek()
+        if token is not None and token.type is LOS_TokenTypes.NOT_OPERATOR:
+            self.pos += 1
+            return LOS_Expression_Not(token, self.parse_expression())
+
+        expression = self.parse_primary()
+        while self.at(LOS_TokenTypes.OPEN_BRACKET_SQUARE):
+            bracket = self.peek()
+            self.pos += 1
+            attr = self.parse_expression()
+            self.expect(LOS_TokenTypes.CLOSE_BRACKET_SQUARE, "']'")
+            expression = LOS_Expression_GetAttr(bracket, expression, attr)
+        return expression
+
+    def parse_primary(self) -> LOS_ExpressionBase:
+        token = self.peek()
+        if token is None:
+            raise self.error("Expected an expression")
+        if self.at_call():
+            return self.parse_call()
+        if token.type is LOS_TokenTypes.VARIABLE:
+            self.pos += 1
+            return LOS_Expression_Variable(token)
+        if token.type in _constantTypes:
+            self.pos += 1
+            return LOS_Expression_Constant(token)
+        if token.type is LOS_TokenTypes.OPEN_BRACKET_SQUARE:
+            self.pos += 1
+            items = self.parse_list(LOS_TokenTypes.CLOSE_BRACKET_SQUARE, "']'")
+            return LOS_Expression_List(token, items)
+        raise self.error("Expected an expression")
+
+    def parse_list(self, close : LOS_TokenTypes, what : str) -> list[LOS_ExpressionBase]:
+        items = []
+        while not self.at(close):
+            items.append(self.parse_expression())
+            if not self.at(LOS_TokenTypes.COMMA):
+                break
+            self.pos += 1
+        self.expect(close, f"',' or {what}")
+        return items
+
+    def parse_call(self) -> LOS_Expression_Method:
+        token = self.peek()
+        self.pos += 1
+        self.expect(LOS_TokenTypes.OPEN_PARENTHESES, f"'(' after {token.string}")
+        args = []
+        params = {}
+        while not self.at(LOS_TokenTypes.CLOSE_PARENTHESES):
+            if self.at(LOS_TokenTypes.VARIABLE) and self.at(LOS_TokenTypes.ASSIGN, 1):
+                name = self.peek()
+                if name.string in params:
+                    raise LOS_SyntaxError(f"Repeated parameter {name.string}", self.filename, name.line, name.column)
+                self.pos += 2
+                params[name.string] = self.parse_expression()
+            elif params:
+                raise self.error("Expected a named parameter after named parameters")
+            else:
+                args.append(self.parse_expression())
+            if not self.at(LOS_TokenTypes.COMMA):
+                break
+            self.pos += 1
+        self.expect(LOS_TokenTypes.CLOSE_PARENTHESES, "',' or ')'")
+        return LOS_Expression_Method(token, args, params)
+
+def parse_tokens(tokens : list[LOS_Token], filename : str = "<los>") -> list[LOS_ExpressionBase]:
+    return LOS_Parser(tokens, filename).parse_program()
+
+def parse_string(source : str, filename : str = "<los>") -> list[LOS_ExpressionBase]:
+    return parse_tokens(list(lex_lines(source.splitlines(), filename)), filename)
+
+def parse_file(path : str) -> list[LOS_ExpressionBase]:
+    with open(path, 'r') as los:
+        return parse_tokens(list(lex_lines(los, path)), path)
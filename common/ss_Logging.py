@@ -1,5 +1,6 @@
 import logging
 import logging.config
+import os
 
 """
 Set up logging. There are two logs:
@@ -10,7 +11,7 @@ try:
     logging.config.fileConfig('.\\common\\logging.conf', disable_existing_loggers=False)
 except Exception as err:
     try:
-        logging.config.fileConfig('logging.conf', disable_existing_loggers=False)
+        logging.config.fileConfig(os.path.join(os.path.dirname(__file__), 'logging.conf'), disable_existing_loggers=False)
     except Exception as err:
         raise Exception(err)
 logSS = logging.getLogger("ss")
\ No newline at end of file
@@ -4,32 +4,41 @@ except:
     from ss_Logging import logSS
 
 try:
-    from common.ss_ColorClasses import Color, ColorRequirement
+    from common.ss_ColorClasses import Color, ColorRequirement, ColorSequence, ColorMatch
 except:
-    from ss_ColorClasses import Color, ColorRequirement
+    from ss_ColorClasses import Color, ColorRequirement, ColorSequence, ColorMatch
 
 import numpy
+from enum import Enum, auto as enumAuto
 from common.ss_namespace_methods import NamespaceMethods
 
+class ScanEngine(Enum):
+    PYTHON = enumAuto()
+    NUMPY = enumAuto()
+
+# Engine used by pixel_sequence_scan when none is passed explicitly
+default_scan_engine = ScanEngine.NUMPY
+
 @NamespaceMethods.register
 def get_pixel_row_absolute(im : numpy.ndarray, row : int, limitPixel_Low : int = None, limitPixel_High : int = None) -> numpy.ndarray:
-    row_count = len(im)
-    column_count = len(im[0])
+    im = numpy.asarray(im)
+    column_count = im.shape[1]
 
     if limitPixel_Low is None: limitPixel_Low = 0
-    if limitPixel_High is None: limitPixel_High = column_count + 1
+    if limitPixel_High is None: limitPixel_High = column_count
 
-    return im[row][limitPixel_Low:limitPixel_High]
+    return im[row, limitPixel_Low:limitPixel_High, :3]
 
+# Returns a strided view into the image, no pixels are copied
 @NamespaceMethods.register
-def get_pixel_column_absolute(im : list[list[tuple[int,int,int,int]]], column : int, limitPixel_Low : int = None, limitPixel_High : int = None) -> list[list[int,int,int]]:
-    row_count = len(im)
-    column_count = len(im[0])
+def get_pixel_column_absolute(im : numpy.ndarray, column : int, limitPixel_Low : int = None, limitPixel_High : int = None) -> numpy.ndarray:
+    im = numpy.asarray(im)
+    row_count = im.shape[0]
 
     if limitPixel_Low is None: limitPixel_Low = 0
-    if limitPixel_High is None: limitPixel_High = row_count + 1
+    if limitPixel_High is None: limitPixel_High = row_count
 
-    return [row[column][:3] for row in im[limitPixel_Low:limitPixel_High]]
+    return im[limitPixel_Low:limitPixel_High, column, :3]
 
 @NamespaceMethods.register
 def get_percent_of_range(low, high, percent : float):
@@ -41,52 +50,87 @@ def get_percent_of_range(low, high, percent : float):
     else:
         return percent * len + low
 
+# Index of the line at percent of count lines, 1.0 is the last line
+def get_index_percent(count : int, percent : float) -> int:
+    return min(int(get_percent_of_range(0, count, percent)), count - 1)
+
 @NamespaceMethods.register
 def get_pixel_row_percent(
-    im : list[list[tuple[int,int,int,int]]],
+    im : numpy.ndarray,
     percent : float,
     limitPercent_Low : float = None,
     limitPercent_High : float = None
-) -> list[list[int,int,int]]:
+) -> numpy.ndarray:
     
-    numberOfRows = len(im)
-    numberOfColumns = len(im[0])
+    im = numpy.asarray(im)
+    numberOfRows, numberOfColumns = im.shape[:2]
 
     if limitPercent_Low is None: limitPercent_Low = 0.0
     if limitPercent_High is None: limitPercent_High = 1.0
 
-    row = int(get_percent_of_range(0, numberOfRows, percent))
+    row = get_index_percent(numberOfRows, percent)
     limitPixel_Low = int(get_percent_of_range(0, numberOfColumns, limitPercent_Low))
     limitPixel_High = int(get_percent_of_range(0, numberOfColumns, limitPercent_High))
 
-    return im[row][limitPixel_Low:limitPixel_High]
+    return im[row, limitPixel_Low:limitPixel_High, :3]
 
+# Returns a strided view into the image, no pixels are copied
 @NamespaceMethods.register
 def get_pixel_column_percent(
-    im : list[list[tuple[int,int,int,int]]],
+    im : numpy.ndarray,
     percent : float,
     limitPercent_Low : float = None,
     limitPercent_High : float = None
-) -> list[list[int,int,int]]:
+) -> numpy.ndarray:
     
-    numberOfRows = len(im)
-    numberOfColumns = len(im[0])
+    im = numpy.asarray(im)
+    numberOfRows, numberOfColumns = im.shape[:2]
 
     if limitPercent_Low is None: limitPercent_Low = 0.0
     if limitPercent_High is None: limitPercent_High = 1.0
 
-    column = int(get_percent_of_range(0, numberOfColumns + 1, percent))
+    column = get_index_percent(numberOfColumns, percent)
     limitPixel_Low = int(get_percent_of_range(0, numberOfRows, limitPercent_Low))
     limitPixel_High = int(get_percent_of_range(0, numberOfRows, limitPercent_High))
 
-    return [row[column] for row in im[limitPixel_Low:limitPixel_High]]
+    return im[limitPixel_Low:limitPixel_High, column, :3]
+
+# True if the first three channels of color are each
+# within tolerance of the target color
+def colorWithinTolerance(color, target : tuple[int,int,int], tolerance : int) -> bool:
+    for c in range(3):
+        if abs(int(color[c]) - int(target[c])) > tolerance:
+            return False
+    return True
+
+# Reset the scan start / end pixels of every color
+def clearColorScanPixels(colors : list[Color]) -> list[Color]:
+    for color in colors:
+        color.clearColorScanPixels()
+    return colors
 
 # Returns detection result as bool and ColorScanInstance
-# of single instance or equal list length
+# of single instance or equal list length.
+# For a ColorSequence the colors are left untouched and the start / end
+# pixels come back as a list of ColorMatch instead
 @NamespaceMethods.register
-def pixel_sequence_scan(pixels : list[tuple[int,int,int]],\
-     colors : list[Color] | Color)\
-            -> tuple[bool, list[Color] | Color]:
+def pixel_sequence_scan(pixels : list[tuple[int,int,int]] | numpy.ndarray,\
+     colors : list[Color] | Color | ColorSequence,\
+     engine : ScanEngine = None)\
+            -> tuple[bool, list[Color] | Color | list[ColorMatch]]:
+
+    if engine is None:
+        engine = default_scan_engine
+
+    if isinstance(colors, ColorSequence):
+        if engine == ScanEngine.NUMPY:
+            result, starts, ends = scan_color_sequence(pixels, colors)
+        else:
+            scanColors = colors.to_colors()
+            result = pixel_sequence_scan_python(pixels, scanColors)
+            starts = [c.startPixel for c in scanColors]
+            ends = [c.endPixel for c in scanColors]
+        return result, [ColorMatch(start, end) for start, end in zip(starts, ends)]
 
     ####################################################
     #               Error Handling
@@ -103,6 +147,20 @@ def pixel_sequence_scan(pixels : list[tuple[int,int,int]],\
         # logSS.critical(f"pixelSequenceScan received colors input of invalid type: {colors[0].__class__.__name__}")
         raise TypeError(f"pixelSequenceScan received colors input of invalid type: {colors[0].__class__.__name__}")
 
+    if engine == ScanEngine.NUMPY:
+        result = pixel_sequence_scan_numpy(pixels, colors)
+    else:
+        result = pixel_sequence_scan_python(pixels, colors)
+
+    if singleColorInstance:
+        return result, colors[0]
+    else:
+        return result, colors
+
+# Reference implementation, walks the pixels one at a time.
+# Sets start / end pixels on colors and returns the detection result
+def pixel_sequence_scan_python(pixels : list[tuple[int,int,int]] | numpy.ndarray, colors : list[Color]) -> bool:
+
     ####################################################
     #               Initialize
     ####################################################
@@ -129,10 +187,7 @@ def pixel_sequence_scan(pixels : list[tuple[int,int,int]],\
 
             # If the last color in the sequence matches the last pixel, set Complete
             if px == len(pixels) - 1 and cIndex == len(colors) - 1 :
-                if singleColorInstance: 
-                    return True, colors[0]
-                else: 
-                    return True, colors
+                return True
 
         # If this pixel doesn't match the current scan color...
         elif colors[cIndex].startPixel is not None:
@@ -171,25 +226,276 @@ def pixel_sequence_scan(pixels : list[tuple[int,int,int]],\
             # a pure required color
             else:
                 if colors[cIndex].requirement == ColorRequirement.required:
-                    if singleColorInstance:
-                        return True, colors[0]
-                    else:
-                        return True, colors
+                    return True
 
     # If the entire pixel set is scanned and the sequence
     # is not completed, return false
+    return colors[-1].requirement == ColorRequirement.notRequired and colors[-1].endPixel is not None
+
+# Boolean match masks of shape (..., pixel count, color count)
+# for pixels of shape (..., pixel count, channels)
+def color_match_masks(pixels : numpy.ndarray, sequence : ColorSequence) -> numpy.ndarray:
+    diff = numpy.abs(pixels[..., None, :3].astype(numpy.int16) - sequence.targets)
+    return numpy.all(diff <= sequence.tolerances[:, None], axis=-1)
+
+# First value in sorted indexes that is >= pos, or None
+def _next_index(indexes : numpy.ndarray, pos : int) -> int | None:
+    i = numpy.searchsorted(indexes, pos)
+    return int(indexes[i]) if i < len(indexes) else None
+
+# Resolve the color sequence state machine for one line of match masks,
+# jumping between run boundaries instead of visiting each pixel.
+# Returns the detection result and per color start / end pixels (None if unset)
+def resolve_match_masks(masks : numpy.ndarray, required : list[bool]) -> tuple[bool, list[int], list[int]]:
+
+    pixelCount, colorCount = masks.shape
+    lastIndex = colorCount - 1
+    starts = [None] * colorCount
+    ends = [None] * colorCount
+
+    # Run boundaries per color: where it matches, where it doesn't,
+    # and where it stops matching while the next color takes over
+    matches = [numpy.flatnonzero(masks[:, c]) for c in range(colorCount)]
+    misses = [numpy.flatnonzero(~masks[:, c]) for c in range(colorCount)]
+    handoffs = [numpy.flatnonzero(~masks[:, c] & masks[:, c + 1]) for c in range(lastIndex)]
+
+    cIndex, px = 0, 0
+    while True:
+
+        # Sequence not started, wait for the first color
+        if starts[0] is None:
+            px = _next_index(matches[0], px)
+            if px is None:
+                return False, starts, ends
+            starts[0] = px
+
+        # Required colors are interrupted by the first mismatch, non-required
+        # colors only when the next color takes over. A non-required last
+        # color keeps collecting matches to the end of the pixels.
+        if required[cIndex]:
+            stop = _next_index(misses[cIndex], px)
+        elif cIndex == lastIndex:
+            stop = None
+        else:
+            stop = _next_index(handoffs[cIndex], px)
 
-    if colors[-1].requirement == ColorRequirement.notRequired and colors[-1].endPixel is not None:
-        if singleColorInstance:
-            return True, colors[0]
+        # Last matching pixel of this color before it is interrupted
+        runMatches = matches[cIndex]
+        if stop is None:
+            ends[cIndex] = int(runMatches[-1])
         else:
-            return True, colors
-    else:
-        if singleColorInstance:
-            return False, colors[0]
+            ends[cIndex] = int(runMatches[numpy.searchsorted(runMatches, stop) - 1])
+
+        # Reaching the last color completes the sequence, except when a
+        # required last color is handed off on the very last pixel
+        if cIndex == lastIndex:
+            result = not (required[cIndex] and cIndex > 0 and starts[cIndex] == pixelCount - 1)
+            return result, starts, ends
+
+        if stop is None:
+            return False, starts, ends
+
+        if masks[stop, cIndex + 1]:
+            cIndex += 1
+            starts[cIndex] = stop
+            ends[cIndex] = stop
         else:
-            return False, colors
+            # Required color broken, restart the whole sequence
+            starts = [None] * colorCount
+            ends = [None] * colorCount
+            cIndex = 0
+        px = stop + 1
+
+# Vectorized implementation. Builds every color's match mask at once,
+# then resolves the sequence from run boundaries.
+# Returns the detection result and per color start / end pixels (None if unset)
+def scan_color_sequence(pixels : list[tuple[int,int,int]] | numpy.ndarray, sequence : ColorSequence) -> tuple[bool, list[int], list[int]]:
+
+    pixels = numpy.asarray(pixels)
+    if len(pixels) == 0:
+        return False, [None] * len(sequence), [None] * len(sequence)
+
+    masks = color_match_masks(pixels.reshape(len(pixels), -1), sequence)
+    return resolve_match_masks(masks, sequence.required)
+
+# Vectorized scan that sets start / end pixels on colors like
+# pixel_sequence_scan_python. Results are identical.
+def pixel_sequence_scan_numpy(pixels : list[tuple[int,int,int]] | numpy.ndarray, colors : list[Color]) -> bool:
+
+    result, starts, ends = scan_color_sequence(pixels, ColorSequence(colors))
+
+    for color, start, end in zip(colors, starts, ends):
+        color.startPixel = start
+        color.endPixel = end
+
+    return result
+
+# Structured result of pixel_sequence_scan_lines, one record per line.
+# Unset start / end pixels are -1
+def line_scan_dtype(colorCount : int) -> numpy.dtype:
+    return numpy.dtype([
+        ("line", numpy.int32),
+        ("result", numpy.bool_),
+        ("startPixel", numpy.int32, (colorCount,)),
+        ("endPixel", numpy.int32, (colorCount,)),
+    ])
+
+# Scan many rows (or columns, if vertical) of an image for the same
+# color sequence. Match masks for every line are computed in one pass.
+# Start / end pixels are relative to limitPixel_Low, like pixel_sequence_scan
+# over get_pixel_row_absolute / get_pixel_column_absolute
+@NamespaceMethods.register
+def pixel_sequence_scan_lines(
+    im : numpy.ndarray,
+    colors : list[Color] | Color | ColorSequence,
+    lines : list[int],
+    vertical : bool = False,
+    limitPixel_Low : int = None,
+    limitPixel_High : int = None
+) -> numpy.ndarray:
+
+    if not isinstance(colors, ColorSequence):
+        colors = ColorSequence(colors)
+
+    lines = numpy.asarray(lines, dtype=numpy.intp).reshape(-1)
+    results = numpy.zeros(len(lines), dtype=line_scan_dtype(len(colors)))
+    results["line"] = lines
+    results["startPixel"] = -1
+    results["endPixel"] = -1
+
+    if limitPixel_Low is None: limitPixel_Low = 0
+
+    # (line count, pixel count, channels)
+    if vertical:
+        pixels = im[limitPixel_Low:limitPixel_High, lines].swapaxes(0, 1)
+    else:
+        pixels = im[lines, limitPixel_Low:limitPixel_High]
+
+    if pixels.shape[1] == 0:
+        return results
+
+    masks = color_match_masks(pixels, colors)
+
+    # Lines that never show the first color can't start a sequence
+    for i in numpy.flatnonzero(masks[:, :, 0].any(axis=1)):
+        result, starts, ends = resolve_match_masks(masks[i], colors.required)
+        results["result"][i] = result
+        results["startPixel"][i] = [-1 if s is None else s for s in starts]
+        results["endPixel"][i] = [-1 if e is None else e for e in ends]
+
+    return results
 
+# pixel_sequence_scan_lines with line positions and limits given as
+# percents of the image height / width
+@NamespaceMethods.register
+def pixel_sequence_scan_lines_percent(
+    im : numpy.ndarray,
+    colors : list[Color] | Color | ColorSequence,
+    percents : list[float],
+    vertical : bool = False,
+    limitPercent_Low : float = None,
+    limitPercent_High : float = None
+) -> numpy.ndarray:
+
+    numberOfRows = len(im)
+    numberOfColumns = len(im[0])
 
+    if limitPercent_Low is None: limitPercent_Low = 0.0
+    if limitPercent_High is None: limitPercent_High = 1.0
 
+    lineCount, pixelCount = (numberOfColumns, numberOfRows) if vertical else (numberOfRows, numberOfColumns)
+
+    lines = [get_index_percent(lineCount, p) for p in percents]
+    limitPixel_Low = int(get_percent_of_range(0, pixelCount, limitPercent_Low))
+    limitPixel_High = int(get_percent_of_range(0, pixelCount, limitPercent_High))
+
+    return pixel_sequence_scan_lines(im, colors, lines, vertical, limitPixel_Low, limitPixel_High)
+
+"""
+Tracked sequence scans for things that barely move between frames,
+like the dialogue box.
+
+After a successful full scan the tracker keeps the matches and probes
+the edges of every matched run: its first and last pixel and the pixel
+on either side. While every probe still agrees with the sequence colors
+the way it did when the matches were found, the cached result is
+returned without scanning the line. Any disagreement is a miss and
+falls back to the full pixel_sequence_scan.
+"""
+class SequenceScanTracker:
+    __slots__ = ("sequence", "pixelCount", "result", "probeIndexes", "probeColors", "probeMatches", "hits", "misses")
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.sequence : ColorSequence = None
+        self.pixelCount = 0
+        self.result : tuple[bool, list[ColorMatch]] = None
+
+    @property
+    def hitRate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    # Which probe pixels match their probe color
+    def _probe(self, pixels : numpy.ndarray) -> numpy.ndarray:
+        diff = numpy.abs(pixels[self.probeIndexes, :3].astype(numpy.int16) - self.sequence.targets[self.probeColors])
+        return numpy.all(diff <= self.sequence.tolerances[self.probeColors, None], axis=-1)
+
+    def _track(self, pixels : numpy.ndarray, sequence : ColorSequence, result : tuple[bool, list[ColorMatch]]) -> None:
+        indexes, colors = [], []
+        for c, match in enumerate(result[1]):
+            if match.startPixel is None:
+                continue
+            for px in (match.startPixel - 1, match.startPixel, match.endPixel, match.endPixel + 1):
+                if 0 <= px < len(pixels):
+                    indexes.append(px)
+                    colors.append(c)
+
+        self.sequence = sequence
+        self.pixelCount = len(pixels)
+        self.result = result
+        self.probeIndexes = numpy.array(indexes, dtype=numpy.intp)
+        self.probeColors = numpy.array(colors, dtype=numpy.intp)
+        self.probeMatches = self._probe(pixels)
+
+    def _same_sequence(self, sequence : ColorSequence) -> bool:
+        return sequence is self.sequence or (
+            numpy.array_equal(sequence.targets, self.sequence.targets) and
+            numpy.array_equal(sequence.tolerances, self.sequence.tolerances) and
+            numpy.array_equal(sequence.required, self.sequence.required)
+        )
+
+    def verify(self, pixels : numpy.ndarray, sequence : ColorSequence) -> bool:
+        if self.result is None or len(pixels) != self.pixelCount or not self._same_sequence(sequence):
+            return False
+        return bool((self._probe(pixels) == self.probeMatches).all())
+
+    def scan(self, pixels : list[tuple[int,int,int]] | numpy.ndarray, sequence : ColorSequence) -> tuple[bool, list[ColorMatch]]:
+        pixels = numpy.asarray(pixels)
+        if len(pixels) == 0:
+            self.misses += 1
+            self.reset()
+            return pixel_sequence_scan(pixels, sequence)
+        pixels = pixels.reshape(len(pixels), -1)
+
+        if self.verify(pixels, sequence):
+            self.hits += 1
+            return self.result
+
+        self.misses += 1
+        result = pixel_sequence_scan(pixels, sequence)
+        if result[0]:
+            self._track(pixels, sequence, result)
+        else:
+            self.reset()
+        return result
 
+@NamespaceMethods.register
+def pixel_sequence_scan_tracked(pixels : list[tuple[int,int,int]] | numpy.ndarray, colors : ColorSequence | list[Color], tracker : SequenceScanTracker) -> tuple[bool, list[ColorMatch]]:
+    if not isinstance(colors, ColorSequence):
+        colors = ColorSequence(colors)
+    return tracker.scan(pixels, colors)
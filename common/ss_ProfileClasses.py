@@ -1,6 +1,8 @@
 
+import json
 import tomllib
 import os
+from concurrent.futures import ThreadPoolExecutor
 try:
     from common.ss_PathClasses import PathElement, SSPath, PathType
 except:
@@ -40,54 +42,188 @@ class ProfileInstance:
         return f"{self.name}, v{self.version}"
 
 
+"""
+Profile discovery keeps a small manifest in every profile directory
+(.ss_manifest.json) with what was read from run.toml and the audio
+packs, stamped with the mtimes of the files and directories it came
+from. A later start only stats those files and re-reads the ones that
+changed, so an unchanged profile costs a handful of stat calls instead
+of parsing run.toml and every desc.toml and listing every pack.
+
+Pack directories of all profiles are scanned in parallel.
+"""
+
+manifestName = ".ss_manifest.json"
+manifestVersion = 1
+
+# Audio pack description file, desc.tomli is the older name
+descNames = ("desc.toml", "desc.tomli")
+
+def _loadManifest(profilePath : str) -> dict:
+    try:
+        with open(os.path.join(profilePath, manifestName), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) and manifest.get("version") == manifestVersion else {}
+
+def _saveManifest(profilePath : str, manifest : dict) -> None:
+    path = os.path.join(profilePath, manifestName)
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logSS.debug(f"Cannot write profile manifest {path}: {e}")
+
+# What discovery needs from run.toml, or the reason it is not a valid profile
+def _parseRunTOML(runPath : str) -> dict:
+    try:
+        with open(runPath, 'rb') as f:
+            a = tomllib.load(f)
+        _ = a["initSequence"]
+        _ = a["hash"]
+        return {
+            "name": a["name"],
+            "version": a["version"],
+            "sequenceCount": len(a["sequence"]),
+            "colorCount": len(a["colors"]),
+        }
+    except KeyError as e:
+        return {"error": f"missing key {e}"}
+    except tomllib.TOMLDecodeError as e:
+        return {"error": f"cannot decode run.toml... corrupted file: {e}"}
+    except Exception as e:
+        logSS.critical(f"Unhandled exception at parse profiles: {e}")
+        raise e
+
+# Description file of a pack directory and the stamp that says whether
+# the manifest entry of the pack is still current
+def _audioPackStamp(packPath : str, dirMtime : int) -> tuple[str | None, list]:
+    for name in descNames:
+        try:
+            st = os.stat(os.path.join(packPath, name))
+        except FileNotFoundError:
+            continue
+        return os.path.join(packPath, name), [dirMtime, [st.st_mtime_ns, st.st_size]]
+    return None, [dirMtime, None]
+
+# What discovery needs from one pack directory
+def _readAudioPack(packPath : str, descPath : str | None, stamp : list) -> dict:
+    if descPath is None:
+        return {"stamp": stamp, "error": "missing desc file"}
+    try:
+        with open(descPath, 'rb') as f:
+            desc = tomllib.load(f)
+        title = desc["title"]
+        authors = desc["authors"]
+    except KeyError as e:
+        return {"stamp": stamp, "error": f"missing key {e}"}
+    except tomllib.TOMLDecodeError:
+        return {"stamp": stamp, "error": "has desc file that cannot be decoded"}
+
+    # Numerically named .wav files in the pack directory, as parallel
+    # lists of hash IDs and file names
+    ids, names = [], []
+    with os.scandir(packPath) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if ext == ".wav" and stem.isnumeric() and entry.is_file():
+                ids.append(int(stem))
+                names.append(entry.name)
+
+    return {"stamp": stamp, "descPath": descPath, "title": title, "authors": authors, "ids": ids, "names": names}
+
+# Stat run.toml and the pack directories of one profile. Returns the old
+# manifest, the run.toml facts, the packs by directory name (None where
+# the manifest entry is stale) and the stale packs to read again
+def _scanProfile(profilePath : str) -> tuple[dict, dict, dict[str, dict], list[tuple]]:
+    manifest = _loadManifest(profilePath)
+    runPath = os.path.join(profilePath, 'run.toml')
+
+    try:
+        st = os.stat(runPath)
+    except FileNotFoundError:
+        return manifest, {"error": f"missing run file {runPath}"}, {}, []
+
+    runStamp = [st.st_mtime_ns, st.st_size]
+    if manifest.get("runStamp") == runStamp:
+        runFacts = manifest["run"]
+    else:
+        runFacts = _parseRunTOML(runPath)
+    runFacts = dict(runFacts, stamp=runStamp)
+
+    cachedPacks = manifest.get("packs", {})
+    packs, stale = {}, []
+    try:
+        with os.scandir(os.path.join(profilePath, "Audio Packs")) as entries:
+            packDirs = sorted((entry.name, entry.path, entry.stat().st_mtime_ns) for entry in entries if entry.is_dir())
+    except (FileNotFoundError, NotADirectoryError):
+        runFacts["noAudioPacks"] = True
+        packDirs = []
+
+    for name, path, dirMtime in packDirs:
+        descPath, stamp = _audioPackStamp(path, dirMtime)
+        cached = cachedPacks.get(name)
+        if cached is not None and cached.get("stamp") == stamp:
+            packs[name] = cached
+        else:
+            packs[name] = None
+            stale.append((name, path, descPath, stamp))
+
+    return manifest, runFacts, packs, stale
+
 # If reqSeq is set, this function will not return any profiles that don't have a run.toml["sequence"] length > 0
 # If reqCol is set, this function will not return any profiles that don't have a run.toml["colors"] length > 0
 # If reqAud is set, this function will not return any audio packs that don't have at least one valid audio file
 # If reqAud is set, this function will not return any profiles that don't have at least one valid audio pack
 
-def findAllProfiles(reqSeq : bool, reqCol : bool, reqAud : bool) -> list[ProfileInstance]:
+def findAllProfiles(reqSeq : bool, reqCol : bool, reqAud : bool, profilesPath : str = None, workers : int = 8) -> list[ProfileInstance]:
 
     # os.system('cls' if os.name == 'nt' else 'clear')
     print("Loading profiles...")
 
+    if profilesPath is None:
+        profilesPath = SSPath.profiles.path_str
+
     """
     Scan for all available profiles
     """
-    allProfilePaths = [ f.path for f in os.scandir(SSPath.profiles.path_str) if f.is_dir()]
+    allProfilePaths = sorted(f.path for f in os.scandir(profilesPath) if f.is_dir())
+
+    with ThreadPoolExecutor(workers) as pool:
+        scans = list(pool.map(_scanProfile, allProfilePaths))
+
+        # Read the new and changed packs of every profile
+        packJobs = [
+            (packs, name, pool.submit(_readAudioPack, path, descPath, stamp))
+            for _, _, packs, stale in scans
+            for name, path, descPath, stamp in stale
+        ]
+        for packs, name, job in packJobs:
+            packs[name] = job.result()
 
     validProfilePaths = []
-    for profilePath in allProfilePaths:
+    for profilePath, (manifest, runFacts, profilePacks, stale) in zip(allProfilePaths, scans):
 
-        # Determine if valid run.toml
-        try:
-            runPath = os.path.join(profilePath,'run.toml')
-            with open(runPath, 'rb') as f:
-                a = tomllib.load(f)
-                profileName = a["name"]
-                profileVersion = a["version"]
-                _ = a["sequence"]
-                _ = a["colors"]
-                _ = a["initSequence"]
-                _ = a["hash"]
-        except KeyError as e:
-            logSS.warning(f"Invalid profile detected: {profilePath}, missing key {e}")
-            continue
-        except FileNotFoundError as e:
-            logSS.warning(f"Invalid profile detected: {profilePath}, missing run file {e}")
-            continue
-        except tomllib.TOMLDecodeError as e:
-            logSS.warning(f"Invalid profile detected: {profilePath}, cannot decode run.tomli... corrupted file: {e}")
+        if "stamp" in runFacts:
+            runStamp = runFacts.pop("stamp")
+            noAudioPacks = runFacts.pop("noAudioPacks", False)
+            if manifest.get("runStamp") != runStamp or len(stale) > 0 or manifest.get("packs", {}).keys() != profilePacks.keys():
+                _saveManifest(profilePath, {"version": manifestVersion, "runStamp": runStamp, "run": runFacts, "packs": profilePacks})
+        else:
+            noAudioPacks = False
+
+        if "error" in runFacts:
+            logSS.warning(f"Invalid profile detected: {profilePath}, {runFacts['error']}")
             continue
-        except Exception as e:
-            logSS.critical(f"Unhandled exception at parse profiles: {e}")
-            raise e
 
-        if len(a["colors"]) == 0:
+        if runFacts["colorCount"] == 0:
             logSS.warning(f"Invalid profile detected: {profilePath}, no colors in run.toml")
             if reqCol:
                 continue
 
-        if len(a["sequence"]) == 0:
+        if runFacts["sequenceCount"] == 0:
             logSS.warning(f"Invalid profile detected: {profilePath}, no sequences in run.toml")
             if reqSeq:
                 continue
@@ -95,51 +231,30 @@ def findAllProfiles(reqSeq : bool, reqCol : bool, reqAud : bool) -> list[Profile
         # At this point, run.toml is presumed to be valid
 
         # Determine if this profile has the required Audio Packs directory
-        audioPath = PathElement(PathType.DIRECTORY, os.path.join(profilePath, "Audio Packs"))
-        if not audioPath.detect():
+        audioPath = os.path.join(profilePath, "Audio Packs")
+        if noAudioPacks:
             logSS.warning(f"Invalid profile detected: {profilePath}, does not have Audio Packs folder")
             continue
 
-        allValidAudioPacks : list[AudioPackData] = []
-
-        # Scan the AudioPack directory for all folders
-        audioPackPaths = [ a.path for a in os.scandir(audioPath.path_str) if a.is_dir()]
-
         # Compile only those directories with an Audio Pack Description file that contains a title and hash table
-        for packDir in audioPackPaths:
-
-            # Audio Pack Description
-            filePathStr = os.path.join(packDir,'desc.toml')
-            try:
-                desc = tomllib.load(open(filePathStr, 'rb'))
-                title = desc["title"]
-                authors = desc["authors"]
-            except KeyError as e:
-                logSS.warning(f"Invalid Audio Pack detected in: {profilePath}, pack: {packDir} missing key {e}")
-                continue
-            except FileNotFoundError as e:
-                logSS.warning(f"Invalid Audio Pack detected in: {profilePath}, pack: {packDir} missing desc file {e}")
-                continue
-            except tomllib.TOMLDecodeError as e:
-                logSS.warning(f"Invalid Audio Pack detected in: {profilePath}, pack: {packDir} has desc.toml that cannot be decoded")
+        allValidAudioPacks : list[AudioPackData] = []
+        for packName, pack in profilePacks.items():
+            packDir = os.path.join(audioPath, packName)
+            if "error" in pack:
+                logSS.warning(f"Invalid Audio Pack detected in: {profilePath}, pack: {packDir} {pack['error']}")
                 continue
-            except Exception as e:
-                logSS.critical(f"Unhandled exception at parse audio packs: {e}")
-                raise e
-
-            # Get all numerically named .wav files in pack directory
-            aDict = { int(fileName.split('.')[0]):fileName for fileName in [f for f in os.listdir(dir) if f.endswith('.wav') and f.split('.')[0].isnumeric()]}
 
-            if len(aDict) == 0 and reqAud:
+            if len(pack["ids"]) == 0 and reqAud:
                 logSS.warning(f"Invalid Audio Pack detected in: {profilePath}, pack: {packDir} has no valid audio files")
                 continue
 
-            allValidAudioPacks.append(AudioPackData(title, authors, filePathStr, aDict))
+            aDict = dict(zip(pack["ids"], pack["names"]))
+            allValidAudioPacks.append(AudioPackData(pack["title"], pack["authors"], pack["descPath"], aDict))
 
         if len(allValidAudioPacks) == 0 and reqAud:
             logSS.warning(f"Invalid Profile detected in: {profilePath}, has no valid Audio Pack")
             continue
 
-        validProfilePaths.append(ProfileInstance(profileName, profileVersion, profilePath, audioPath.path_str, allValidAudioPacks))
+        validProfilePaths.append(ProfileInstance(runFacts["name"], runFacts["version"], profilePath, audioPath, allValidAudioPacks))
 
-    return validProfilePaths
\ No newline at end of file
+    return validProfilePaths
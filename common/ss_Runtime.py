@@ -0,0 +1,270 @@
+import queue
+import threading
+import time
+from typing import Any, Callable
+from numpy import ndarray
+from common.ss_Capture import CaptureBackend, get_capture_backend
+from common.ss_ExecuteTOMLscript import executeTOMLsequences
+try:
+    from common.ss_Logging import logSS
+except:
+    from ss_Logging import logSS
+
+"""
+Producer / consumer runtime for the capture loop.
+
+- A capture thread grabs frames straight into a ring of preallocated
+  buffers and publishes each one as the newest frame.
+- The processing stage (the caller's thread) always takes the newest
+  frame. Frames published while it was busy are dropped, so a slow
+  frame never builds up a backlog.
+- An I/O worker thread runs hash store writes and image saves, so disk
+  I/O never stalls capture or processing.
+
+Every stage keeps latency and drop counters in a StageStats.
+"""
+
+class StageStats:
+    __slots__ = ("name", "count", "dropped", "failed", "totalSeconds", "maxSeconds")
+
+    def __init__(self, name : str) -> None:
+        self.name = name
+        self.count = 0
+        self.dropped = 0
+        self.failed = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+
+    def record(self, seconds : float) -> None:
+        self.count += 1
+        self.totalSeconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+
+    @property
+    def meanSeconds(self) -> float:
+        return self.totalSeconds / self.count if self.count > 0 else 0.0
+
+    def __str__(self) -> str:
+        failed = f", {self.failed} failed" if self.failed > 0 else ""
+        return f"{self.name}: {self.count} done, {self.dropped} dropped{failed}, mean {self.meanSeconds * 1e3:.2f} ms, max {self.maxSeconds * 1e3:.2f} ms"
+
+"""
+Ring of frame buffers shared by one writer and one reader. The writer
+never touches the newest published buffer or the one being read, so
+three buffers are enough for both sides to run without waiting.
+"""
+class FrameRing:
+
+    def __init__(self, size : int = 3) -> None:
+        if size < 3:
+            raise ValueError("A frame ring needs at least 3 buffers")
+        self.buffers : list[ndarray] = [None] * size
+        self.frameTimes : list[float] = [None] * size
+        self.captureTimes : list[float] = [None] * size
+        self.frameIDs = [0] * size
+        self.condition = threading.Condition()
+        self.latest : int = None
+        self.latestTaken = True
+        self.reading : int = None
+        self.nextSlot = 0
+        self.published = 0
+        self.dropped = 0
+        self.closed = False
+        # Called by the writer after every publish and on close, e.g. to
+        # wake an event loop
+        self.onPublish : Callable[[], None] = None
+
+    # Slot the writer may fill next
+    def write_slot(self) -> int:
+        with self.condition:
+            while self.nextSlot in (self.latest, self.reading):
+                self.nextSlot = (self.nextSlot + 1) % len(self.buffers)
+            slot = self.nextSlot
+            self.nextSlot = (self.nextSlot + 1) % len(self.buffers)
+            return slot
+
+    # Make a filled slot the newest frame. An untaken older frame is dropped
+    def publish(self, slot : int, buffer : ndarray, frameTime : float, captureTime : float = None) -> None:
+        with self.condition:
+            if not self.latestTaken:
+                self.dropped += 1
+            self.published += 1
+            self.buffers[slot] = buffer
+            self.frameTimes[slot] = frameTime
+            self.captureTimes[slot] = captureTime
+            self.frameIDs[slot] = self.published
+            self.latest = slot
+            self.latestTaken = False
+            self.condition.notify_all()
+        if self.onPublish is not None:
+            self.onPublish()
+
+    # Wait for a frame newer than the last one taken. Returns
+    # (buffer, frameTime, frameID, captureTime), or None on timeout or once closed
+    def take(self, timeout : float = None) -> tuple[ndarray, float, int, float] | None:
+        with self.condition:
+            if not self.condition.wait_for(lambda: not self.latestTaken or self.closed, timeout):
+                return None
+            if self.latestTaken:
+                return None
+            self.reading = self.latest
+            self.latestTaken = True
+            return self.buffers[self.reading], self.frameTimes[self.reading], self.frameIDs[self.reading], self.captureTimes[self.reading]
+
+    # The reader is done with the frame it took
+    def release(self) -> None:
+        with self.condition:
+            self.reading = None
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.onPublish is not None:
+            self.onPublish()
+
+    # A published frame is waiting to be taken
+    @property
+    def pending(self) -> bool:
+        return not self.latestTaken
+
+    # Closed and the last frame already taken
+    @property
+    def exhausted(self) -> bool:
+        return self.closed and self.latestTaken
+
+class CaptureThread(threading.Thread):
+
+    def __init__(self, backend : CaptureBackend, ring : FrameRing) -> None:
+        super().__init__(name="ss_capture", daemon=True)
+        self.backend = backend
+        self.ring = ring
+        self.stats = StageStats("capture")
+        self.running = True
+        self.error : BaseException = None
+
+    def run(self) -> None:
+        try:
+            while self.running:
+                slot = self.ring.write_slot()
+                start = time.perf_counter()
+
+                # The backend grabs straight into the ring buffer
+                self.backend.buffer = self.ring.buffers[slot]
+                frame = self.backend.grab()
+
+                self.stats.record(time.perf_counter() - start)
+                self.ring.publish(slot, frame, self.backend.frameTime, self.backend.captureTime)
+        except EOFError:
+            logSS.info("Capture source exhausted")
+        except BaseException as e:
+            self.error = e
+            logSS.error(f"Capture thread stopped: {e!r}")
+        finally:
+            self.ring.close()
+
+    def stop(self) -> None:
+        self.running = False
+
+# Runs submitted jobs in order on one background thread
+class IOWorker(threading.Thread):
+
+    def __init__(self) -> None:
+        super().__init__(name="ss_io", daemon=True)
+        self.jobs : queue.Queue = queue.Queue()
+        self.stats = StageStats("io")
+        self.start()
+
+    # Jobs that raised, also reported as failed in stats
+    @property
+    def failures(self) -> int:
+        return self.stats.failed
+
+    def submit(self, job : Callable, *args) -> None:
+        self.jobs.put((job, args))
+
+    def run(self) -> None:
+        while True:
+            item = self.jobs.get()
+            try:
+                if item is None:
+                    return
+                job, args = item
+                start = time.perf_counter()
+                try:
+                    job(*args)
+                except Exception as e:
+                    self.stats.failed += 1
+                    logSS.error(f"I/O job {getattr(job, '__name__', job)} failed: {e!r}")
+                self.stats.record(time.perf_counter() - start)
+            finally:
+                self.jobs.task_done()
+
+    # Block until every submitted job is done
+    def wait(self) -> None:
+        self.jobs.join()
+
+    def close(self) -> None:
+        self.jobs.put(None)
+        self.join()
+
+"""
+Ties the stages to a run dict from initRun. process() handles one frame:
+it loads the newest captured frame into run["coreFeatures"] and calls
+the handler, executeTOMLsequences by default.
+"""
+class Runtime:
+
+    def __init__(self, run : dict, backend : CaptureBackend = None, ringSize : int = 3) -> None:
+        self.run = run
+        self.ring = FrameRing(ringSize)
+        self.capture = CaptureThread(backend if backend is not None else get_capture_backend(), self.ring)
+        self.io = IOWorker()
+        self.processStats = StageStats("process")
+
+        run["ioWorker"] = self.io
+        if "hashStore" in run:
+            run["hashStore"].ioWorker = self.io
+
+    def start(self) -> "Runtime":
+        self.capture.start()
+        return self
+
+    # Process the newest frame. Returns the handler's result, or None when
+    # no frame arrived within timeout or capture has stopped
+    def process(self, handler : Callable[[dict], Any] = None, timeout : float = None) -> Any:
+        taken = self.ring.take(timeout)
+        if taken is None:
+            return None
+        frame, frameTime, _, captureTime = taken
+
+        if handler is None:
+            handler = executeTOMLsequences
+
+        start = time.perf_counter()
+        try:
+            self.run["coreFeatures"].set_frame(frame, frameTime, captureTime)
+            return handler(self.run)
+        finally:
+            self.ring.release()
+            self.processStats.record(time.perf_counter() - start)
+            self.processStats.dropped = self.ring.dropped
+
+    @property
+    def running(self) -> bool:
+        return not self.ring.exhausted
+
+    def stats(self) -> dict[str, StageStats]:
+        return {s.name: s for s in (self.capture.stats, self.processStats, self.io.stats)}
+
+    # Stop capture and finish all pending I/O
+    def stop(self) -> None:
+        self.capture.stop()
+        self.capture.join()
+        if "hashStore" in self.run:
+            self.run["hashStore"].sync()
+            self.run["hashStore"].ioWorker = None
+        self.io.close()
+        self.run.pop("ioWorker", None)
+        for s in self.stats().values():
+            logSS.info(str(s))
@@ -0,0 +1,179 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy
+from numpy import ndarray
+from common.ss_ExecuteTOMLscript import initWorkerRun, parseSeqStepIndexes, sequenceLevels, executeTOMLsequenceIfChanged, countFrame
+try:
+    from common.ss_Logging import logSS
+except:
+    from ss_Logging import logSS
+
+"""
+Runs independent sequences in worker processes, so pure Python scans of
+different sequences use different cores.
+
+A sequence opts in with parallel = true in its run.toml table. Each
+parallel sequence is pinned to one worker, which loads its own copy of
+the sequences from run.toml (initWorkerRun), so the sequence's step
+state (trackers, hashers, flatness detectors) lives in that worker from
+frame to frame. With workerCount = 0 they all run in the main process.
+
+Frames are not pickled. The parent copies each frame into a shared
+memory block and the workers map it as an ndarray. What comes back are
+the step results of the sequence, which are merged into the parent's
+run, so later sequences and the parent can read them as usual.
+
+Levels from sequenceLevels() keep the after = [...] order: a level's
+parallel sequences run in the workers while its other sequences run in
+the parent, and the next level starts once all of them are done.
+Results of earlier levels are sent along to the workers that need them.
+
+Sequences that use the hash store stay in the parent, since every
+worker would otherwise hand out hash IDs on its own and look hashes up
+in a stale index, and so do sequences that play audio, which the parent
+owns.
+"""
+
+parentOnlyFunctions = ("saveHash_IfNew", "findKnownHash", "updateRun", "compactHashStore", "playAudio")
+
+# Per worker process state
+_workerRun : dict = None
+_workerFrames : dict[str, shared_memory.SharedMemory] = {}
+
+# Workers are spawned from the parent and share its resource tracker, so
+# the block is only ever unlinked once, by the parent
+def _attach_shared_memory(name : str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+def _init_worker(runPath : str, optimize : bool) -> None:
+    global _workerRun
+    _workerRun = initWorkerRun(runPath, optimize)
+
+def _worker_frame(name : str, shape : tuple, dtype : str) -> ndarray:
+    block = _workerFrames.get(name)
+    if block is None:
+        for old in _workerFrames.values():
+            old.close()
+        _workerFrames.clear()
+        block = _workerFrames[name] = _attach_shared_memory(name)
+    return numpy.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def _step_results(seq : dict) -> dict:
+    return {stepIndex: seq[stepIndex]["result"] for stepIndex in parseSeqStepIndexes(seq) if "result" in seq[stepIndex]}
+
+def _merge_step_results(seq : dict, stepResults : dict) -> None:
+    for stepIndex, result in stepResults.items():
+        seq[stepIndex]["result"] = result
+
+# Runs in the worker: one sequence on the shared frame
+def _run_sequence(key : str, frameName : str, shape : tuple, dtype : str, frameTime : float, frameID : int, dependencyResults : dict) -> tuple[bool, bool, str, dict]:
+    run = _workerRun
+    core = run["coreFeatures"]
+
+    # Sequences pinned to the same worker share the frame they were sent
+    if core.frameID != frameID:
+        core.set_frame(_worker_frame(frameName, shape, dtype), frameTime)
+        core.frameID = frameID
+
+    for dependency, stepResults in dependencyResults.items():
+        _merge_step_results(run["sequence"][dependency], stepResults)
+
+    seq = run["sequence"][key]
+    result, ran = executeTOMLsequenceIfChanged(seq, run)
+    return result, ran, seq.get("stoppedBy"), _step_results(seq) if ran else {}
+
+class SequencePool:
+
+    def __init__(self, run : dict, workerCount : int = None) -> None:
+        self.run = run
+        self.frameBlock : shared_memory.SharedMemory = None
+        self.frameID = 0
+
+        self.parallelKeys = []
+        for key, seq in run["sequence"].items():
+            if not seq.get("parallel", False):
+                continue
+            blocking = sorted({seq[i].get("function") for i in parseSeqStepIndexes(seq)} & set(parentOnlyFunctions))
+            if blocking:
+                logSS.warning(f"Sequence {key} uses {blocking}, it runs in the main process")
+                continue
+            self.parallelKeys.append(key)
+
+        if workerCount is None:
+            workerCount = min(len(self.parallelKeys), multiprocessing.cpu_count())
+        elif workerCount < 0:
+            raise ValueError(f"workerCount must be 0 or more, got {workerCount}")
+        elif workerCount == 0 and self.parallelKeys:
+            logSS.info(f"No workers, sequences {self.parallelKeys} run in the main process")
+            self.parallelKeys = []
+
+        # One single-process executor per worker pins sequences to workers
+        context = multiprocessing.get_context("spawn")
+        self.workers = [
+            ProcessPoolExecutor(1, mp_context=context, initializer=_init_worker, initargs=(run["runPath"], run.get("optimizeSequences", True)))
+            for _ in range(workerCount)
+        ]
+        self.assignment = {key: self.workers[i % workerCount] for i, key in enumerate(self.parallelKeys)}
+
+    # Copy the current frame into shared memory, growing the block if needed
+    def _share_frame(self, frame : ndarray) -> None:
+        if self.frameBlock is None or self.frameBlock.size < frame.nbytes:
+            if self.frameBlock is not None:
+                self.frameBlock.close()
+                self.frameBlock.unlink()
+            self.frameBlock = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+        numpy.copyto(numpy.ndarray(frame.shape, dtype=frame.dtype, buffer=self.frameBlock.buf), frame)
+
+    # Run every sequence on the current frame of run["coreFeatures"], like
+    # executeTOMLsequences
+    def execute(self) -> dict[str, bool]:
+        run = self.run
+        core = run["coreFeatures"]
+        frame = core[core.frameArrayKey]
+        sequences : dict = run["sequence"]
+
+        if len(self.assignment) > 0:
+            self._share_frame(frame)
+        self.frameID += 1
+
+        results = {}
+        anyRan = False
+        for level in sequenceLevels(run):
+            futures : dict[str, Future] = {}
+            for key in level:
+                if key in self.assignment:
+                    dependencyResults = {d: _step_results(sequences[d]) for d in sequences[key].get("after", [])}
+                    futures[key] = self.assignment[key].submit(
+                        _run_sequence, key, self.frameBlock.name, frame.shape, frame.dtype.str,
+                        core.frameTime, self.frameID, dependencyResults
+                    )
+
+            for key in level:
+                if key not in futures:
+                    results[key], ran = executeTOMLsequenceIfChanged(sequences[key], run)
+                    anyRan |= ran
+
+            for key, future in futures.items():
+                seq = sequences[key]
+                result, ran, stoppedBy, stepResults = future.result()
+                _merge_step_results(seq, stepResults)
+                seq["lastResult"], seq["stoppedBy"] = result, stoppedBy
+                countKey = "runCount" if ran else "skipCount"
+                seq[countKey] = seq.get(countKey, 0) + 1
+                results[key] = result
+                anyRan |= ran
+
+        countFrame(run, anyRan)
+        return results
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.shutdown()
+        if self.frameBlock is not None:
+            self.frameBlock.close()
+            self.frameBlock.unlink()
+            self.frameBlock = None
@@ -1,4 +1,3 @@
-
 class NamespaceMethods():
 
     methods = {}
@@ -6,3 +5,4 @@ class NamespaceMethods():
     @classmethod
     def register(clsself, cls):
         NamespaceMethods.methods[cls.__name__] = cls
+        return cls
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import os
 import imagehash
@@ -5,17 +6,20 @@ import numpy
 from PIL import Image, ImageGrab
 from PIL.Image import Image as ImageClass
 from enum import Enum, auto as enumAuto
-import winsound
 from common.ss_Logging import logSS
 from common.ss_PathClasses import PathElement, PathType, SSPath, Path
 from common.ss_ColorClasses import *
-from common.methods.ss_Pixel import *
+from common.ss_Pixel import *
 from common.ss_ProfileClasses import findAllProfiles, AudioPackData, ProfileInstance
 from typing import Any
 import tomllib
 import time
 from common.ss_ExecuteTOMLscript import executeTOMLsequence, initRun
-import requests
+from common.ss_Runtime import Runtime
+from common.ss_SequencePool import SequencePool
+from common.ss_Api import ApiSession
+from common.ss_Audio import make_audio_player
+from common.ss_AsyncRuntime import AsyncRuntime, executeTOMLsequenceAsync
 
 SSPath.runTOML.path_str = os.path.join(SSPath.root.path_str, "Profiles\\PokeFR\\run.toml")
 SSPath.runTOML.detect()
@@ -38,11 +42,36 @@ data_={
         "password": password
     }
 }
-result=requests.get(api_location + "/login",json=data_)
-print(result.json())
 
-while True:
-    executeTOMLsequence(run["sequence"]["BlueTB"], run)
+# Player for the first audio pack of the run's profile, so BlueTB's
+# playAudio step speaks the lines it recognizes. Without a pack the
+# lines are still detected and recorded, just not played
+def loadAudioPlayer(run : dict) -> None:
+    profilePath = os.path.dirname(os.path.realpath(run["runPath"]))
+    for profile in findAllProfiles(reqSeq= True, reqCol= True, reqAud= True, profilesPath= os.path.dirname(profilePath)):
+        if os.path.realpath(profile.path) == profilePath:
+            # Every clip of the pack is decoded now, so lines play without disk I/O
+            run["audioPlayer"] = make_audio_player(profile.audioPacksList[0], run.get("audio"))
+            return
+    logSS.warning(f"No audio pack in {profilePath}, recognized lines will not play")
+
+# Log in, then run detection while the session stays open for reports.
+# Capture, the sequences and server calls share one event loop
+async def main() -> None:
+    loadAudioPlayer(run)
+    async with ApiSession(api_location) as api:
+        print(await api.get("/login", data_))
+        run["apiSession"] = api
+
+        runtime = AsyncRuntime(run)
+        try:
+            await runtime.serve(lambda run: executeTOMLsequenceAsync(run["sequence"]["BlueTB"], run))
+        finally:
+            runtime.stop()
+            if "audioPlayer" in run:
+                run["audioPlayer"].close()
+
+asyncio.run(main())
 
 exit()
 
@@ -90,20 +119,23 @@ if __name__ == "__main__":
     SSPath.selectedAudioPack.path_str = audioPack.path
     SSPath.selectedAudioPack.detect()
 
+    # Every clip of the pack is decoded now, so lines play without disk I/O
+    run["audioPlayer"] = make_audio_player(audioPack, run.get("audio"))
+
     SSPath.runTOML.path_str = os.path.join(SSPath.selectedProfile.path_str, "run.toml")
     SSPath.runTOML.detect()
 
     
 
-    while True:
-
-        # Generate Core Features
-        im = ImageGrab.grab()
-        run["coreFeatures"]["screenShot_Whole_Image"] = im
-        run["coreFeatures"]["screenShot_Whole_npArray"] = numpy.array(im)
-
-        # Execute all sequences
-        for i in run:
-
-            for seq in run["sequence"]:
-                executeTOMLsequence(seq, run)
\ No newline at end of file
+    # Capture on its own thread, hash and image I/O on another. Each pass
+    # executes all sequences on the newest frame, skipping those whose
+    # input did not change. Sequences marked parallel run in worker processes
+    pool = SequencePool(run)
+    runtime = Runtime(run).start()
+    try:
+        while runtime.running:
+            runtime.process(lambda run: pool.execute())
+    finally:
+        runtime.stop()
+        pool.close()
+        run["audioPlayer"].close()
\ No newline at end of file
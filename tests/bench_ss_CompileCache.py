@@ -0,0 +1,81 @@
+import sys
+import os
+import shutil
+import tempfile
+import time
+import logging
+import numpy
+from imagehash import ImageHash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ss_CompileCache import cachePath
+from common.ss_ExecuteTOMLscript import initRun
+from common.ss_LOSCompiler import load_program
+import core
+
+"""
+Benchmark of profile startup with and without the compile cache: initRun
+on a copy of Profiles/PokeFR with its hash store grown to a number of
+36x36 dHashes, and loading main.los.
+
+Cold runs delete the cache file first, so they parse run.toml, build
+every hash index and compile the script, then write the cache. Warm
+runs read the cache.
+
+Run from the repository root: python tests/bench_ss_CompileCache.py
+"""
+
+profileDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Profiles", "PokeFR")
+hashSize = 36
+
+def bestOf(fn, repeat : int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def cold(directory : str, fn) -> None:
+    path = cachePath(directory)
+    if os.path.exists(path):
+        os.remove(path)
+    fn()
+
+def startRun(runPath : str) -> None:
+    initRun(runPath)["hashStore"].close()
+
+if __name__ == "__main__":
+
+    logging.disable(logging.WARNING)
+    cacheRoot = tempfile.TemporaryDirectory()
+    os.environ["SS_CACHE_DIR"] = cacheRoot.name
+    rng = numpy.random.default_rng(0)
+
+    for count in (0, 20_000, 100_000):
+        with tempfile.TemporaryDirectory() as directory:
+            runPath = os.path.join(directory, "run.toml")
+            losPath = os.path.join(directory, "main.los")
+            shutil.copy(os.path.join(profileDir, "run.toml"), runPath)
+            shutil.copy(os.path.join(profileDir, "main.los"), losPath)
+
+            run = initRun(runPath, useCache= False)
+            store = run["hashStore"]
+            store.batchSize = count + 1
+            for bits in rng.random((count, hashSize, hashSize)) < 0.5:
+                store.add("BlueTB", ImageHash(bits))
+            store.close()
+
+            repeat = 5 if count < 100_000 else 2
+            runCold = bestOf(lambda: cold(directory, lambda: startRun(runPath)), repeat)
+            runWarm = bestOf(lambda: startRun(runPath), repeat)
+            print(f"initRun, {count + 13 :>7} hashes: cold {runCold * 1e3 :8.1f} ms, warm {runWarm * 1e3 :7.1f} ms ({runCold / runWarm :.1f}x)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        losPath = os.path.join(directory, "main.los")
+        shutil.copy(os.path.join(profileDir, "main.los"), losPath)
+
+        losCold = bestOf(lambda: cold(directory, lambda: load_program(losPath)), 20)
+        losWarm = bestOf(lambda: load_program(losPath), 20)
+        print(f"main.los load: cold {losCold * 1e3 :.2f} ms, warm {losWarm * 1e3 :.3f} ms ({losCold / losWarm :.0f}x)")
@@ -0,0 +1,58 @@
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ss_ExecuteTOMLscript import seqEx, getArgVal, resolveArg, parseSeqStepIndexes, executeTOMLsequence, compileSequence
+
+"""
+Micro-benchmark of per-frame interpreter overhead. Every step calls a
+function that only reads its arguments, so the timings are the cost of
+step ordering, dispatch and argument resolution alone.
+
+Run from the repository root: python tests/bench_ss_ExecuteTOMLscript.py
+"""
+
+def seqEx_readArgs(step : dict, run : dict) -> None:
+    step["result"] = [getArgVal(step, arg, run) for arg in ("a", "b", "c", "d")]
+
+# The interpreter loop as it was before sequences were compiled
+def executeUncompiled(seq : dict, run : dict) -> bool:
+    for stepIndex in parseSeqStepIndexes(seq):
+        step = seq[stepIndex]
+        seqEx[step["function"]](step, run)
+        if "continue" in step:
+            continueVal = resolveArg(step["continue"], run)
+            if isinstance(continueVal, bool) and not continueVal:
+                return False
+    return True
+
+def makeRun(stepCount : int) -> dict:
+    run = {"sequence": {"bench": {}}, "enum": {"lines": {"top": 0.25}}}
+    seq = run["sequence"]["bench"]
+    for i in range(1, stepCount + 1):
+        seq[str(i)] = {
+            "function": "readArgs",
+            "a": ["const", 0.5],
+            "b": ["run", ["enum", "lines", "top"]],
+            "c": ["run", ["sequence", "bench", str(max(i - 1, 1)), "result", 0]],
+            "d": ["const", True],
+            "continue": ["run", ["sequence", "bench", str(i), "result", 3]],
+        }
+        seq[str(i)]["result"] = [0.5, 0.25, 0.5, True]
+    return run
+
+if __name__ == "__main__":
+
+    seqEx["readArgs"] = seqEx_readArgs
+    number = 5000
+
+    run = makeRun(12)
+    seq = run["sequence"]["bench"]
+    before = timeit.timeit(lambda: executeUncompiled(seq, run), number=number) / number
+
+    seq["plan"] = compileSequence(seq, run)
+    after = timeit.timeit(lambda: executeTOMLsequence(seq, run), number=number) / number
+
+    print(f"12-step sequence, per frame: uncompiled {before * 1e6 :7.1f} us, compiled {after * 1e6 :7.1f} us ({before / after :.1f}x)")
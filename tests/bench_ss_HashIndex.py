@@ -0,0 +1,46 @@
+import sys
+import os
+import timeit
+import numpy
+from imagehash import ImageHash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ss_HashIndex import HashIndex
+
+"""
+Benchmark of known-hash lookups for 36x36 dHashes at the BlueTB
+tolerance of 30, comparing the old ImageHash loop, a full popcount scan
+and multi-index hashing.
+
+Run from the repository root: python tests/bench_ss_HashIndex.py
+"""
+
+hashSize = 36
+tolerance = 30
+
+def timeQuery(fn, number : int) -> float:
+    return timeit.timeit(fn, number=number) / number
+
+if __name__ == "__main__":
+
+    rng = numpy.random.default_rng(0)
+
+    for count in (10_000, 100_000):
+        bits = rng.random((count, hashSize, hashSize)) < 0.5
+        hashes = [ImageHash(b) for b in bits]
+
+        linear = HashIndex(capacity=count)
+        mih = HashIndex(mihTolerance=tolerance, capacity=count)
+        for i, h in enumerate(hashes):
+            linear.add(h, i)
+            mih.add(h, i)
+
+        # A new dialogue line: nothing within tolerance
+        query = ImageHash(rng.random((hashSize, hashSize)) < 0.5)
+
+        loop = timeQuery(lambda: any(query - h <= tolerance for h in hashes), 3)
+        scan = timeQuery(lambda: linear.contains_within(query, tolerance), 20)
+        multi = timeQuery(lambda: mih.contains_within(query, tolerance), 200)
+
+        print(f"{count :>7} hashes: ImageHash loop {loop * 1e3 :8.2f} ms, popcount scan {scan * 1e3 :7.3f} ms, multi-index {multi * 1e3 :7.3f} ms")
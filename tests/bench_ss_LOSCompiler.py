@@ -0,0 +1,116 @@
+import sys
+import os
+import time
+import timeit
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ss_ExecuteTOMLscript import executeTOMLsequence, compileSequence, getArgVal, seqEx
+from common.ss_Capture import CoreFeatures
+from common.ss_ColorClasses import Color, ColorRequirement, ColorMatch
+from common.ss_LOSCompiler import LOS_VM, compile_string
+
+"""
+Benchmark of the LOS VM against the TOML interpreter on the BlueTB
+detection of Profiles/PokeFR/run.toml (steps 3 to 6): column of the
+frame, vertical scan, row of the frame, horizontal scan, stopping when
+a scan fails.
+
+Both run the real pixel functions on a frame with a text box, then
+stub functions that return at once, which leaves the cost of dispatch
+and argument passing alone.
+
+Run from the repository root: python tests/bench_ss_LOSCompiler.py
+"""
+
+blueTB_LOS = """
+column = get_pixel_column_percent(image = frame, percent = 0.5)
+scan_v = pixel_sequence_scan(pixels = column, colors = colors_v)
+quit_if(!scan_v[0])
+row = get_pixel_row_absolute(image = frame, row = scan_v[1][2][start_pixel])
+scan_h = pixel_sequence_scan(pixels = row, colors = colors_h)
+quit_if(!scan_h[0])
+"""
+
+colorTables = {
+    "DialogueBlue_Outer_V": ((72, 112, 160), True),
+    "DialogueBlue_Inner_V": ((160, 208, 224), True),
+    "DialogueBlue_Outer_H": ((160, 208, 224), True),
+    "DialogueBlue_Inner_H": ((208, 224, 240), True),
+    "DialogueBlue_Body": ((248, 248, 248), False),
+}
+colorsV = ["DialogueBlue_Outer_V", "DialogueBlue_Inner_V", "DialogueBlue_Body", "DialogueBlue_Inner_V", "DialogueBlue_Outer_V"]
+colorsH = ["DialogueBlue_Outer_H", "DialogueBlue_Inner_H", "DialogueBlue_Body", "DialogueBlue_Inner_H", "DialogueBlue_Outer_H"]
+
+def blueBoxFrame() -> numpy.ndarray:
+    frame = numpy.zeros((160, 240, 3), dtype=numpy.uint8)
+    outerV, innerV, outerH, innerH, body = (72, 112, 160), (160, 208, 224), (160, 208, 224), (208, 224, 240), (248, 248, 248)
+    for columns, color in (((10, 230), outerH), ((13, 227), innerH), ((15, 225), body)):
+        frame[100:150, columns[0]:columns[1]] = color
+    for rows, color in (((100, 150), outerV), ((103, 147), innerV), ((105, 145), body)):
+        frame[rows[0]:rows[1], 15:225] = color
+    return frame
+
+def makeRun(frame : numpy.ndarray) -> dict:
+    seq = {
+        "3": {"function": "getPixelColumn_Percent", "image": ["core", "screenShot_Whole_npArray"], "percent": ["const", 0.5]},
+        "4": {"function": "pixelSequenceScan", "pixels": ["run", ["sequence", "BlueTB", "3", "result"]], "colors": ["colors", colorsV],
+              "continue": ["run", ["sequence", "BlueTB", "4", "result", 0]]},
+        "5": {"function": "getPixelRow_Absolute", "image": ["core", "screenShot_Whole_npArray"],
+              "row": ["run", ["sequence", "BlueTB", "4", "result", 1, 2, "startPixel"]]},
+        "6": {"function": "pixelSequenceScan", "pixels": ["run", ["sequence", "BlueTB", "5", "result"]], "colors": ["colors", colorsH],
+              "continue": ["run", ["sequence", "BlueTB", "6", "result", 0]]},
+    }
+    run = {"sequence": {"BlueTB": seq}, "coreFeatures": CoreFeatures()}
+    run["colorInstances"] = {
+        name: Color(rgb, 0, ColorRequirement.required if required else ColorRequirement.notRequired)
+        for name, (rgb, required) in colorTables.items()
+    }
+    run["coreFeatures"].set_frame(frame, time.perf_counter())
+    return run
+
+# Stubs with the shapes of the real results
+matches = [ColorMatch(105, 144)] * 5
+
+def stubColumn(im, percent):
+    return im
+
+def stubScan(pixels, colors):
+    return True, matches
+
+def stubRow(im, row):
+    return im
+
+stubFunctions = {
+    "getPixelColumn_Percent": lambda step, run: step.__setitem__("result", stubColumn(getArgVal(step, "image", run), getArgVal(step, "percent", run))),
+    "pixelSequenceScan": lambda step, run: step.__setitem__("result", stubScan(getArgVal(step, "pixels", run), getArgVal(step, "colors", run))),
+    "getPixelRow_Absolute": lambda step, run: step.__setitem__("result", stubRow(getArgVal(step, "image", run), getArgVal(step, "row", run))),
+}
+stubMethods = {
+    "get_pixel_column_percent": stubColumn,
+    "pixel_sequence_scan": stubScan,
+    "get_pixel_row_absolute": stubRow,
+}
+
+def perFrame(fn, number : int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+if __name__ == "__main__":
+
+    frame = blueBoxFrame()
+    number = 2000
+
+    for label, functions, methods in (("pixel functions", seqEx, None), ("stub functions", stubFunctions, stubMethods)):
+        run = makeRun(frame)
+        seq = run["sequence"]["BlueTB"]
+        seq["plan"] = compileSequence(seq, run, functions)
+        assert executeTOMLsequence(seq, run)
+
+        vm = LOS_VM(compile_string(blueTB_LOS, inputs=("frame", "colors_v", "colors_h"), methods=methods))
+        inputs = {"frame": frame, "colors_v": run["colorSequences"][tuple(colorsV)], "colors_h": run["colorSequences"][tuple(colorsH)]}
+        assert vm.run(**inputs)
+
+        toml = perFrame(lambda: executeTOMLsequence(seq, run), number)
+        los = perFrame(lambda: vm.run(**inputs), number)
+        print(f"BlueTB per frame, {label:15}: TOML {toml * 1e6:7.1f} us, LOS VM {los * 1e6:7.1f} us ({toml / los:.1f}x)")
@@ -0,0 +1,100 @@
+import sys
+import os
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ss_LOSLexer import lex_file
+from common.ss_LOSParser import parse_tokens
+import core
+
+"""
+Benchmark of LOS tokenizing on a generated 50k line script: copies of
+the body of Profiles/PokeFR/main.los with numbered variables, tokenized
+by the old replace-and-split tokenizer and by the single pass lexer,
+then parsed into expressions.
+
+Run from the repository root: python tests/bench_ss_LOSLexer.py [lines]
+"""
+
+mainLOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Profiles", "PokeFR", "main.los")
+
+def makeScript(path : str, lineCount : int) -> int:
+    with open(mainLOS) as f:
+        body = f.read()
+    names = ["scan_v_result", "scan_h_result", "scan_colors_v", "scan_colors_h", "pixel_column_middle", "pixel_row_dialogue_top", "box_top", "box_bottom", "box_left", "box_right"]
+
+    lines = 0
+    with open(path, "w") as out:
+        copy = 0
+        while lines < lineCount:
+            text = body
+            for name in names:
+                text = text.replace(name, f"{name}_{copy}")
+            out.write(text + "\n")
+            lines += text.count("\n") + 1
+            copy += 1
+    return lines
+
+# The tokenizer this lexer replaced, minus namespace bookkeeping
+def legacyTokenize(path : str) -> list[str]:
+    prog_str = ""
+    with open(path, 'r') as los:
+        for line in los:
+            if "#" in line:
+                line_parts = [p.strip() for p in line.split("#")]
+                if line_parts[0] == "":
+                    continue
+                line = line_parts[0]
+            else:
+                line = line.strip()
+            if not line:
+                continue
+            prog_str = line if prog_str == "" else prog_str + " " + line
+
+    for c in ["(", ")", "[", "]", "=", ",", "!", """ ' """, ''' " ''']:
+        prog_str = prog_str.replace(c, f" {c} ")
+    while "  " in prog_str:
+        prog_str = prog_str.replace("  ", " ")
+
+    tokens = []
+    for token_str in prog_str.split(" "):
+        if "." in token_str:
+            try:
+                _ = float(token_str)
+            except:
+                pass
+        else:
+            try:
+                _ = int(token_str)
+            except:
+                pass
+        tokens.append(token_str)
+    return tokens
+
+def best(fn, repeat : int = 3) -> tuple[float, int]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(fn())
+        times.append(time.perf_counter() - start)
+    return min(times), count
+
+if __name__ == "__main__":
+
+    lineCount = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.los")
+        lines = makeScript(path, lineCount)
+        print(f"{lines} lines, {os.path.getsize(path) / 1e6:.1f} MB")
+
+        seconds, count = best(lambda: legacyTokenize(path))
+        print(f"legacy tokenizer: {seconds * 1e3:8.1f} ms, {count} tokens")
+        seconds, count = best(lambda: lex_file(path))
+        print(f"lexer:            {seconds * 1e3:8.1f} ms, {count} tokens")
+
+        tokens = lex_file(path)
+        seconds, count = best(lambda: parse_tokens(tokens, path))
+        print(f"parser:           {seconds * 1e3:8.1f} ms, {count} expressions")
@@ -0,0 +1,46 @@
+import sys
+import os
+import timeit
+import tracemalloc
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ss_Pixel import get_pixel_column_percent
+
+"""
+Micro-benchmark for pixel column extraction on a 1440p RGBA frame.
+Compares the previous per-row list comprehension with the strided view
+get_pixel_column_percent now returns.
+
+Run from the repository root: python tests/bench_ss_Pixel.py
+"""
+
+def column_list_comprehension(im : numpy.ndarray, percent : float) -> list:
+    column = int(percent * len(im[0]))
+    return [row[column][:3] for row in im]
+
+def count_allocations(fn, *args) -> tuple[int, int]:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = fn(*args)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+    size = sum(s.size_diff for s in stats if s.size_diff > 0)
+    del result
+    return blocks, size
+
+if __name__ == "__main__":
+
+    frame = numpy.zeros((1440, 2560, 4), dtype=numpy.uint8)
+
+    for name, fn in [
+        ("list comprehension", column_list_comprehension),
+        ("strided view", get_pixel_column_percent),
+    ]:
+        blocks, size = count_allocations(fn, frame, 0.5)
+        seconds = timeit.timeit(lambda: fn(frame, 0.5), number=200) / 200
+        print(f"{name :<20} allocations: {blocks :>6}, bytes: {size :>8}, time: {seconds * 1e6 :8.1f} us")
@@ -0,0 +1,77 @@
+import sys
+import os
+import logging
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ss_ProfileClasses import findAllProfiles, manifestName
+
+"""
+Benchmark of profile discovery over a synthetic Profiles tree: a cold
+start without manifests, then warm starts with nothing changed.
+
+Run from the repository root:
+    python tests/bench_ss_ProfileClasses.py [profiles] [packs] [wavs]
+The default tree, 100 profiles x 20 packs x 1000 wavs, is two million
+empty files; pass smaller counts for a quick run.
+"""
+
+runTOML = """
+name = "Profile {index}"
+version = "1.0.0"
+initSequence = "BlueTB"
+
+[hash]
+
+[colors.red]
+tolerance = 0
+
+[sequence.BlueTB]
+"""
+
+def makeTree(root : str, profileCount : int, packCount : int, wavCount : int) -> None:
+    for index in range(profileCount):
+        profilePath = os.path.join(root, f"profile_{index:03d}")
+        os.makedirs(profilePath)
+        with open(os.path.join(profilePath, "run.toml"), "w") as f:
+            f.write(runTOML.format(index=index))
+        for pack in range(packCount):
+            packPath = os.path.join(profilePath, "Audio Packs", f"pack_{pack:02d}")
+            os.makedirs(packPath)
+            with open(os.path.join(packPath, "desc.toml"), "w") as f:
+                f.write(f'title = "Pack {pack}"\nauthors = ["Nate"]\n')
+            for hashID in range(wavCount):
+                open(os.path.join(packPath, f"{hashID}.wav"), "wb").close()
+
+def timeDiscovery(root : str) -> tuple[float, int]:
+    start = time.perf_counter()
+    profiles = findAllProfiles(True, True, True, profilesPath=root)
+    return time.perf_counter() - start, len(profiles)
+
+if __name__ == "__main__":
+
+    profileCount, packCount, wavCount = (int(a) for a in (sys.argv[1:] + ["100", "20", "1000"][len(sys.argv) - 1:]))
+    logging.disable(logging.WARNING)
+
+    root = tempfile.mkdtemp(prefix="ss_profiles_")
+    try:
+        start = time.perf_counter()
+        makeTree(root, profileCount, packCount, wavCount)
+        print(f"Tree of {profileCount} profiles x {packCount} packs x {wavCount} wavs built in {time.perf_counter() - start:.1f} s")
+
+        seconds, found = timeDiscovery(root)
+        print(f"cold: {seconds * 1e3:9.1f} ms ({found} profiles)")
+        for run in range(3):
+            seconds, found = timeDiscovery(root)
+            print(f"warm: {seconds * 1e3:9.1f} ms ({found} profiles)")
+
+        # Cold again, every manifest removed
+        for entry in os.scandir(root):
+            os.remove(os.path.join(entry.path, manifestName))
+        seconds, found = timeDiscovery(root)
+        print(f"cold: {seconds * 1e3:9.1f} ms ({found} profiles)")
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,9 @@
+import os
+import pytest
+
+# Compile cache files go to a scratch directory, never the user's cache
+@pytest.fixture(scope="session", autouse=True)
+def compileCacheDirectory(tmp_path_factory):
+    os.environ["SS_CACHE_DIR"] = str(tmp_path_factory.mktemp("ss_cache"))
+    yield
+    os.environ.pop("SS_CACHE_DIR", None)
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy
+import pytest
+from common.ss_Api import ApiSession, ApiError
+from common.ss_AsyncRuntime import AsyncRuntime, executeTOMLsequenceAsync
+from common.ss_Capture import CaptureBackend, CoreFeatures
+from common.ss_ExecuteTOMLscript import executeTOMLsequence, seqEx
+
+# Stands in for the SpokenScreen server: echoes JSON bodies back
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self) -> None:
+        self.reply()
+
+    def do_POST(self) -> None:
+        self.reply()
+
+    def reply(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.received.append((self.command, self.path, json.loads(body) if body else None))
+
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        # Handled, then the connection drops before the response
+        if self.path == "/drop":
+            self.close_connection = True
+            return
+
+        data = json.dumps({"path": self.path, "echo": json.loads(body) if body else None}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if self.path == "/logout":
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        # Kept alive as far as the client knows, then closed while idle
+        if self.path == "/idle":
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args) -> None:
+        pass
+
+@pytest.fixture
+def stubServer():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.received = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def stubURL(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_session_reuses_connection(stubServer):
+    async def main():
+        async with ApiSession(stubURL(stubServer)) as api:
+            login = await api.get("/login", {"authentication": {"username": "a", "password": "b"}})
+            report = await api.post("/report", {"hashID": 7})
+            assert api.connections == 1
+
+            # Both close the connection, the next request reconnects
+            with pytest.raises(ApiError) as error:
+                await api.get("/missing")
+            assert error.value.status == 404
+            await api.post("/logout")
+            await api.post("/report", {"hashID": 8})
+            return login, report, api.connections, api.requests
+
+    login, report, connections, requests = asyncio.run(main())
+    assert login == {"path": "/login", "echo": {"authentication": {"username": "a", "password": "b"}}}
+    assert report["echo"] == {"hashID": 7}
+    assert connections == stubServer.connections == 3
+    assert requests == 5
+
+def test_dropped_post_is_not_sent_twice(stubServer):
+    async def main():
+        async with ApiSession(stubURL(stubServer)) as api:
+            await api.get("/login")
+            with pytest.raises(ConnectionError):
+                await api.post("/drop", {"hashID": 7})
+
+            # A GET can safely go out again on a new connection
+            await api.get("/login")
+            with pytest.raises(ConnectionError):
+                await api.get("/drop")
+
+            # A connection the server closed while idle is reopened first
+            await api.get("/idle")
+            await asyncio.sleep(0.1)
+            return await api.post("/report", {"hashID": 8})
+
+    report = asyncio.run(main())
+    drops = [(command, body) for command, path, body in stubServer.received if path == "/drop"]
+    assert drops == [("POST", {"hashID": 7}), ("GET", None), ("GET", None)]
+    assert report["echo"] == {"hashID": 8}
+
+def test_sequence_awaits_io_steps(stubServer):
+    run = {"sequence": {"seq": {
+        "1": {
+            "function": "flexMultiply",
+            "input1": ["const", 2],
+            "input2": ["const", 3],
+        },
+        "2": {
+            "function": "apiRequest",
+            "path": ["const", "/report"],
+            "body": ["run", ["sequence", "seq", "1", "result"]],
+        },
+        "3": {
+            "function": "flexMultiply",
+            "input1": ["run", ["sequence", "seq", "2", "result", "echo"]],
+            "input2": ["const", 10],
+            "continue": ["const", False],
+        },
+    }}}
+    seq = run["sequence"]["seq"]
+
+    async def main():
+        async with ApiSession(stubURL(stubServer)) as api:
+            run["apiSession"] = api
+            return await executeTOMLsequenceAsync(seq, run)
+
+    assert asyncio.run(main()) is False
+    assert seq["stoppedBy"] == "flexMultiply" and seq["3"]["result"] == 60
+    assert stubServer.received == [("POST", "/report", 6)]
+
+    # Coroutine steps do not run in the synchronous executor
+    with pytest.raises(KeyError):
+        executeTOMLsequence(seq, run)
+
+# Numbered frames, one every delay seconds
+class CountingCaptureBackend(CaptureBackend):
+
+    def __init__(self, frameLimit : int, delay : float) -> None:
+        super().__init__()
+        self.frameLimit = frameLimit
+        self.delay = delay
+
+    def grab(self) -> numpy.ndarray:
+        if self.frameCount >= self.frameLimit:
+            raise EOFError
+        time.sleep(self.delay)
+        buffer = self.get_buffer(4, 4)
+        buffer[:] = self.frameCount
+        self.stamp_frame()
+        return buffer
+
+def slowStepRun() -> tuple[dict, list]:
+    calls = []
+    run = {"coreFeatures": CoreFeatures(), "sequence": {"seq": {
+        str(i): {"function": "slowStep", "index": ["const", i]} for i in range(1, 6)
+    }}}
+    return run, calls
+
+def test_newer_frame_cancels_in_flight(monkeypatch):
+    run, calls = slowStepRun()
+
+    # Five 4 ms steps per frame, a new frame every 8 ms
+    def slowStep(step, run):
+        calls.append((int(run["coreFeatures"]["screenShot_Whole_npArray"][0, 0, 0]), step["compiledArgs"]["index"](run)))
+        time.sleep(0.004)
+    monkeypatch.setitem(seqEx, "slowStep", slowStep)
+
+    runtime = AsyncRuntime(run, CountingCaptureBackend(30, delay=0.008))
+    try:
+        asyncio.run(runtime.serve(lambda run: executeTOMLsequenceAsync(run["sequence"]["seq"], run)))
+    finally:
+        runtime.stop()
+
+    frames = [frame for frame, _ in calls]
+    assert runtime.superseded > 0
+    assert runtime.processStats.count + runtime.superseded + runtime.ring.dropped == runtime.ring.published
+    # A cancelled frame stops at a step boundary before the next one starts
+    assert frames == sorted(frames)
+    assert any(len([c for c in calls if c[0] == f]) < 5 for f in set(frames))
+    # The last frame has nothing newer and completes
+    assert [index for frame, index in calls if frame == 29] == [1, 2, 3, 4, 5]
+    assert run["sequence"]["seq"]["lastResult"] is True
+    assert "cpuExecutor" not in run
+
+def test_frames_complete_while_processing_is_slower_than_capture(monkeypatch):
+    run, calls = slowStepRun()
+    monkeypatch.setitem(seqEx, "slowStep", lambda step, run: time.sleep(0.004))
+
+    # Five 4 ms steps per frame, a new frame every 8 ms
+    runtime = AsyncRuntime(run, CountingCaptureBackend(60, delay=0.008))
+    completedLive = []
+
+    async def handler(run):
+        result = await executeTOMLsequenceAsync(run["sequence"]["seq"], run)
+        if not runtime.ring.closed:
+            completedLive.append(runtime.processStats.count)
+        return result
+
+    try:
+        asyncio.run(runtime.serve(handler))
+    finally:
+        runtime.stop()
+
+    assert runtime.superseded > 0
+    assert len(completedLive) >= 10
+    assert completedLive == sorted(completedLive)
+    assert runtime.processStats.count + runtime.superseded + runtime.ring.dropped == runtime.ring.published
+
+def test_without_supersede_every_taken_frame_completes(monkeypatch):
+    run, calls = slowStepRun()
+
+    def slowStep(step, run):
+        calls.append(int(run["coreFeatures"]["screenShot_Whole_npArray"][0, 0, 0]))
+        time.sleep(0.002)
+    monkeypatch.setitem(seqEx, "slowStep", slowStep)
+
+    runtime = AsyncRuntime(run, CountingCaptureBackend(20, delay=0.004), supersede=False)
+    try:
+        asyncio.run(runtime.serve(lambda run: executeTOMLsequenceAsync(run["sequence"]["seq"], run)))
+    finally:
+        runtime.stop()
+
+    assert runtime.superseded == 0
+    assert len(calls) == 5 * runtime.processStats.count
+    assert calls[-1] == 19
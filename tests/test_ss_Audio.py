@@ -0,0 +1,164 @@
+import os
+import time
+import wave
+import numpy
+import pytest
+from PIL import Image
+from common.ss_Audio import decode_wav, encode_wav, ClipCache, AudioPlayer, NullAudioBackend, FileSinkAudioBackend, make_audio_backend
+from common.ss_Capture import CoreFeatures, ReplayCaptureBackend
+from common.ss_ExecuteTOMLscript import executeTOMLsequence
+from common.ss_Runtime import Runtime
+
+def writeWav(path : str, samples : numpy.ndarray, sampleWidth : int, sampleRate : int = 8000) -> None:
+    if sampleWidth == 3:
+        data = (samples.astype("<i4") << 8).view(numpy.uint8).reshape(-1, 4)[:, 1:].tobytes()
+    else:
+        data = samples.tobytes()
+    with wave.open(path, "wb") as w:
+        w.setnchannels(samples.shape[1])
+        w.setsampwidth(sampleWidth)
+        w.setframerate(sampleRate)
+        w.writeframes(data)
+
+# A pack of clips named by hash ID, 0.1 s each
+def makePack(tmp_path, count : int) -> dict[int, str]:
+    rng = numpy.random.default_rng(count)
+    files = {}
+    for hashID in range(count):
+        files[hashID] = f"{hashID}.wav"
+        writeWav(str(tmp_path / files[hashID]), rng.integers(-2**15, 2**15, size=(800, 1), dtype="<i2"), 2)
+    return files
+
+@pytest.mark.parametrize("sampleWidth, dtype, low, high", [(1, numpy.uint8, 0, 256), (2, "<i2", -2**15, 2**15), (3, "<i4", -2**23, 2**23), (4, "<i4", -2**31, 2**31)])
+@pytest.mark.parametrize("channels", [1, 2])
+def test_decode_round_trip(tmp_path, sampleWidth, dtype, low, high, channels):
+    samples = numpy.random.default_rng(sampleWidth).integers(low, high, size=(500, channels), dtype=dtype)
+    path = str(tmp_path / "clip.wav")
+    writeWav(path, samples, sampleWidth, 22050)
+
+    clip = decode_wav(path)
+    assert (clip.samples == samples).all() and clip.samples.shape == (500, channels)
+    assert clip.sampleRate == 22050 and clip.duration == 500 / 22050
+
+    with open(path, "rb") as f:
+        assert encode_wav(clip) == f.read()
+
+def test_cache_preloads_pack(tmp_path):
+    files = makePack(tmp_path, 6)
+    files[6] = "6.wav"
+    (tmp_path / "6.wav").write_bytes(b"not a wav")
+
+    cache = ClipCache(str(tmp_path), files)
+    assert cache.preload() == 6
+    assert 6 not in cache and cache.get(6) is None
+
+    for hashID in range(6):
+        assert cache.get(hashID) is cache.clips[hashID]
+    assert cache.hits == 6 and cache.misses == 1
+    assert cache.get(99) is None
+
+def test_cache_cap_evicts_least_recent(tmp_path):
+    files = makePack(tmp_path, 6)
+    clipBytes = 800 * 2
+
+    cache = ClipCache(str(tmp_path), files, maxBytes=3 * clipBytes)
+    assert cache.preload() == 3
+    assert list(cache.clips) == [0, 1, 2]
+
+    cache.get(0)
+    cache.get(4)
+    assert list(cache.clips) == [2, 0, 4]
+    assert cache.nbytes == 3 * clipBytes and cache.evictions == 1
+
+def test_player_preempts_and_ignores_repeats(tmp_path):
+    backend = NullAudioBackend()
+    player = AudioPlayer(ClipCache(str(tmp_path), makePack(tmp_path, 3)), backend)
+    player.cache.preload()
+
+    assert player.play(0, time.perf_counter())
+    # The same line, still on screen in the next frames
+    assert player.play(0, time.perf_counter())
+    assert player.play(1, time.perf_counter())
+    assert not player.play(7)
+
+    assert [player.cache.clips.get(i) for i in (0, 1)] == [clip for clip, _ in backend.played]
+    assert player.preempted == 1
+    assert player.latency.count == 2 and player.latency.maxSeconds < 0.05
+
+    # After stop() the line plays again
+    player.stop()
+    assert player.play(1)
+    assert len(backend.played) == 3
+
+def test_line_still_on_screen_does_not_loop(tmp_path):
+    backend = NullAudioBackend()
+    player = AudioPlayer(ClipCache(str(tmp_path), makePack(tmp_path, 6)), backend, forgetSeconds=0.2)
+
+    # Asked for on every frame, well past the end of its 0.1 s clip
+    for _ in range(5):
+        assert player.play(5)
+        time.sleep(0.12)
+    assert len(backend.played) == 1 and not player.playing
+
+    # A box that went away and came back plays its line again
+    time.sleep(0.25)
+    assert player.play(5)
+    assert len(backend.played) == 2
+
+def test_file_sink_and_play_step(tmp_path):
+    files = makePack(tmp_path, 2)
+    sinkPath = str(tmp_path / "out")
+    backend = make_audio_backend({"backend": "file", "path": sinkPath})
+    assert isinstance(backend, FileSinkAudioBackend)
+
+    core = CoreFeatures()
+    core.set_frame(numpy.zeros((4, 4, 3), dtype=numpy.uint8), time.perf_counter())
+    run = {
+        "coreFeatures": core,
+        "audioPlayer": AudioPlayer(ClipCache(str(tmp_path), files), backend),
+        "found": (True, 1, 3),
+        "sequence": {"seq": {
+            "1": {
+                "function": "playAudio",
+                "hashID": ["run", ["found", 1]],
+            },
+        }},
+    }
+
+    executeTOMLsequence(run["sequence"]["seq"], run)
+
+    assert run["sequence"]["seq"]["1"]["result"]
+    assert os.listdir(sinkPath) == ["000001.wav"]
+    with open(os.path.join(sinkPath, "000001.wav"), "rb") as f, open(tmp_path / "1.wav", "rb") as original:
+        assert f.read() == original.read()
+    # Hash to playback latency counts from the frame's capture time
+    assert 0 < run["audioPlayer"].latency.totalSeconds < 0.5
+
+    with pytest.raises(ValueError):
+        make_audio_backend({"backend": "speaker"})
+
+def test_replay_latency_uses_the_wall_clock(tmp_path):
+    files = makePack(tmp_path, 2)
+    for i in range(4):
+        Image.fromarray(numpy.full((6, 8, 3), i * 10, dtype=numpy.uint8)).save(tmp_path / f"frame_{i:03}.png")
+
+    # frameTime counts 0, 0.01, ... on the replay's clock, far from perf_counter()
+    backend = NullAudioBackend()
+    run = {
+        "coreFeatures": CoreFeatures(),
+        "audioPlayer": AudioPlayer(ClipCache(str(tmp_path), files), backend),
+        "sequence": {"seq": {"1": {"function": "playAudio", "hashID": ["run", ["line"]]}}},
+    }
+    runtime = Runtime(run, ReplayCaptureBackend(str(tmp_path), loop=False, fps=100)).start()
+    frameTimes = []
+    while runtime.running:
+        def handler(run):
+            frameTimes.append(run["coreFeatures"].frameTime)
+            run["line"] = len(frameTimes) % 2
+            executeTOMLsequence(run["sequence"]["seq"], run)
+        runtime.process(handler, timeout=1.0)
+    runtime.stop()
+
+    assert max(frameTimes) < 0.05 and len(backend.played) == len(frameTimes)
+    latency = run["audioPlayer"].latency
+    assert latency.count == len(frameTimes) and 0 <= latency.maxSeconds < 0.5
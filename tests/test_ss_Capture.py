@@ -0,0 +1,157 @@
+import numpy
+import pytest
+from PIL import Image
+from common.ss_Capture import CoreFeatures, ReplayCaptureBackend, FrameChangeDetector, make_capture_backend, set_capture_backend, get_capture_backend
+from common.ss_Image import screenshot, make_np_array
+from common.ss_ExecuteTOMLscript import getArgVal
+
+def writeFrames(directory, count : int, size : tuple[int,int] = (8, 6)) -> list[numpy.ndarray]:
+    frames = []
+    for i in range(count):
+        frame = numpy.full((size[1], size[0], 3), i * 10, dtype=numpy.uint8)
+        frame[0, 0] = (255, i, 0)
+        Image.fromarray(frame).save(directory / f"frame_{i:03}.png")
+        frames.append(frame)
+    return frames
+
+def test_replay_order_and_buffer_reuse(tmp_path):
+    frames = writeFrames(tmp_path, 3)
+    backend = ReplayCaptureBackend(str(tmp_path), loop=True)
+
+    first = backend.grab()
+    assert (first == frames[0]).all()
+
+    second = backend.grab()
+    assert second is first
+    assert (second == frames[1]).all()
+
+    backend.grab()
+    assert (backend.grab() == frames[0]).all()
+    assert backend.frameCount == 4
+
+def test_replay_exhausted_without_loop(tmp_path):
+    writeFrames(tmp_path, 1)
+    backend = ReplayCaptureBackend(str(tmp_path), loop=False)
+    backend.grab()
+    with pytest.raises(EOFError):
+        backend.grab()
+
+def test_replay_region(tmp_path):
+    frames = writeFrames(tmp_path, 1)
+    backend = make_capture_backend({"backend": "replay", "path": str(tmp_path), "region": [0, 0, 4, 3]})
+
+    frame = backend.grab()
+    assert frame.shape == (3, 4, 3)
+    assert (frame == frames[0][:3, :4]).all()
+
+def test_screenshot_uses_active_backend(tmp_path):
+    frames = writeFrames(tmp_path, 2)
+    set_capture_backend(ReplayCaptureBackend(str(tmp_path)))
+
+    try:
+        im = screenshot()
+        assert (numpy.asarray(im) == frames[0]).all()
+
+        frame = get_capture_backend().grab()
+        assert make_np_array(frame) is frame
+    finally:
+        set_capture_backend(None)
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        make_capture_backend({"backend": "nope"})
+
+def test_core_features_capture_once(tmp_path):
+    frames = writeFrames(tmp_path, 2)
+    backend = ReplayCaptureBackend(str(tmp_path))
+    core = CoreFeatures()
+
+    frame = core.capture(backend)
+    assert core["screenShot_Whole_npArray"] is backend.buffer
+    assert CoreFeatures.frameImageKey not in core
+
+    im = core["screenShot_Whole_Image"]
+    assert core["screenShot_Whole_Image"] is im
+    assert (numpy.asarray(im) == frames[0]).all()
+
+    core.capture(backend)
+    assert core["screenShot_Whole_npArray"] is frame
+    assert (numpy.asarray(core["screenShot_Whole_Image"]) == frames[1]).all()
+    assert core.frameID == 2
+
+    with pytest.raises(KeyError):
+        core["missingFeature"]
+
+def test_core_argument(tmp_path):
+    writeFrames(tmp_path, 1)
+    run = {"coreFeatures": CoreFeatures()}
+    run["coreFeatures"].capture(ReplayCaptureBackend(str(tmp_path)))
+
+    step = {"image": ["core", "screenShot_Whole_npArray"], "shape": ["core", ["screenShot_Whole_npArray", "shape"]]}
+    assert getArgVal(step, "image", run) is run["coreFeatures"]["screenShot_Whole_npArray"]
+    assert getArgVal(step, "shape", run) == (6, 8, 3)
+
+def test_replay_fps_frame_times(tmp_path):
+    writeFrames(tmp_path, 2)
+    backend = make_capture_backend({"backend": "replay", "path": str(tmp_path), "fps": 4})
+    features = CoreFeatures()
+
+    times = []
+    for _ in range(3):
+        features.capture(backend)
+        times.append(features["frameTime"])
+
+    assert times == [0.0, 0.25, 0.5]
+    assert features.frameTime == 0.5
+
+def test_change_detector_tiles():
+    detector = FrameChangeDetector(tileSize=4)
+    frame = numpy.zeros((10, 13, 3), dtype=numpy.uint8)
+
+    assert detector.update(frame)
+    assert not detector.update(frame.copy())
+    assert detector.dirty_bounds() is None
+
+    # One channel of one pixel, in a partial edge tile
+    frame[9, 12, 2] = 1
+    assert detector.update(frame)
+    assert detector.dirtyTiles.shape == (3, 4)
+    assert list(zip(*numpy.nonzero(detector.dirtyTiles))) == [(2, 3)]
+    assert detector.dirty_bounds() == (12, 8, 13, 10)
+    assert detector.region_changed((10, 6, 13, 10))
+    assert not detector.region_changed((0, 0, 12, 8))
+
+    assert not detector.update(frame.copy())
+    assert (detector.changedFrames, detector.unchangedFrames) == (2, 2)
+
+def test_core_features_change_report(tmp_path):
+    writeFrames(tmp_path, 2)
+    backend = ReplayCaptureBackend(str(tmp_path))
+    core = CoreFeatures(FrameChangeDetector(tileSize=4))
+
+    core.capture(backend)
+    assert core["frameChanged"] and core.changed()
+
+    # Frames differ everywhere, so every tile is dirty
+    core.capture(backend)
+    assert core["dirtyTiles"].all()
+    assert core["dirtyBounds"] == (0, 0, 8, 6)
+
+    assert CoreFeatures().changed((0, 0, 1, 1))
+
+@pytest.mark.parametrize("shape, tileSize", [((48, 64, 3), 16), ((50, 70, 3), 16), ((20, 24, 4), 8), ((17, 9), 4)])
+def test_change_detector_matches_naive_tiles(shape, tileSize):
+    rng = numpy.random.default_rng(sum(shape))
+    detector = FrameChangeDetector(tileSize)
+    frame = rng.integers(0, 256, size=shape, dtype=numpy.uint8)
+    detector.update(frame)
+
+    for _ in range(5):
+        previous = frame.copy()
+        for _ in range(3):
+            frame[rng.integers(shape[0]), rng.integers(shape[1])] += 1
+        detector.update(frame)
+
+        changed = (frame != previous).reshape(shape[0], shape[1], -1).any(axis=2)
+        for (row, column), dirty in numpy.ndenumerate(detector.dirtyTiles):
+            assert dirty == changed[row * tileSize:(row + 1) * tileSize, column * tileSize:(column + 1) * tileSize].any()
@@ -0,0 +1,51 @@
+import numpy
+import pytest
+from common.ss_ColorClasses import Color, ColorRequirement, ColorCompareMode, match_palette
+
+def test_color_is_compact():
+    c = Color((237, 28, 36), 3, ColorRequirement.required)
+    assert not hasattr(c, "__dict__")
+    assert c.color == (237, 28, 36)
+
+    with pytest.raises(ValueError):
+        Color((256, 0, 0), 0, ColorRequirement.required)
+
+def test_color_cmp_default_tolerance_not_shared():
+    a = Color((10, 20, 30), 0, ColorRequirement.required)
+    b = Color((12, 20, 30), 0, ColorRequirement.required)
+    assert not a.color_cmp(b)
+    assert a.color_cmp(b, tolerance=[2, 0, 0])
+    assert not a.color_cmp(b)
+
+def test_color_cmp_hsv_hue_wraps():
+    reddish = Color((255, 0, 8), 0, ColorRequirement.required)
+    redOther = Color((255, 8, 0), 0, ColorRequirement.required)
+    green = Color((0, 255, 0), 0, ColorRequirement.required)
+
+    assert reddish.color_cmp(redOther, ColorCompareMode.HSV, [3, 0, 0])
+    assert not reddish.color_cmp(green, ColorCompareMode.HSV, [3, 255, 255])
+
+@pytest.mark.parametrize("mode", list(ColorCompareMode))
+def test_match_pixels_agrees_with_color_cmp(mode):
+    rng = numpy.random.default_rng(7)
+    pixels = rng.integers(0, 256, size=(40, 30, 3), dtype=numpy.uint8)
+    target = Color(tuple(int(v) for v in pixels[5, 5]), 40, ColorRequirement.required)
+
+    mask = target.match_pixels(pixels, mode)
+
+    expected = numpy.array([
+        [target.color_cmp(Color(tuple(int(v) for v in px), 0, ColorRequirement.required), mode, [40, 40, 40]) for px in row]
+        for row in pixels
+    ])
+    assert mask.shape == (40, 30)
+    assert mask[5, 5]
+    assert (mask == expected).all()
+
+def test_match_palette_labels():
+    red = Color((237, 28, 36), 0, ColorRequirement.required)
+    green = Color((34, 177, 76), 10, ColorRequirement.required)
+    strip = numpy.array([(237, 28, 36), (40, 180, 70), (0, 0, 0), (237, 28, 36)], dtype=numpy.uint8)
+
+    assert list(match_palette(strip, [red, green])) == [0, 1, -1, 0]
+    assert list(match_palette(strip, [green, red])) == [1, 0, -1, 1]
+    assert list(match_palette(strip, [red, green], ColorCompareMode.HSV)) == [0, 1, -1, 0]
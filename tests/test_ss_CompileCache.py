@@ -0,0 +1,146 @@
+import os
+import shutil
+import numpy
+import pytest
+from imagehash import hex_to_hash
+import common.ss_CompileCache
+from common.ss_CompileCache import CompileCache
+from common.ss_ExecuteTOMLscript import initRun
+from common.ss_HashStore import HashStore
+from common.ss_LOSCompiler import LOS_VM, load_program
+import core
+
+profileDir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Profiles", "PokeFR")
+
+@pytest.fixture
+def profile(tmp_path):
+    shutil.copy(os.path.join(profileDir, "run.toml"), tmp_path / "run.toml")
+    shutil.copy(os.path.join(profileDir, "main.los"), tmp_path / "main.los")
+    return tmp_path
+
+def test_entries_survive_a_reload(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    assert cache.get("a", "k1") is None
+    cache.put("a", "k1", {"x": [1, 2]})
+    assert cache.save() and not cache.save()
+
+    cache = CompileCache(str(tmp_path))
+    assert cache.get("a", "k1") == {"x": [1, 2]}
+    assert cache.get("a", "k2") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_other_version_or_corrupt_file_is_empty(tmp_path, monkeypatch):
+    cache = CompileCache(str(tmp_path))
+    cache.put("a", "k", 1)
+    cache.save()
+
+    monkeypatch.setattr(common.ss_CompileCache, "cacheVersion", common.ss_CompileCache.cacheVersion + 1)
+    assert CompileCache(str(tmp_path)).entries == {}
+    monkeypatch.undo()
+
+    with open(cache.path, "r+b") as f:
+        f.truncate(os.path.getsize(cache.path) - 5)
+    assert CompileCache(str(tmp_path)).entries == {}
+
+def test_warm_init_run_skips_parsing(profile, monkeypatch):
+    cold = initRun(str(profile / "run.toml"))
+    entryCount = 1 + len(cold["sequence"])
+    assert (cold["compileCache"].hits, cold["compileCache"].misses) == (0, entryCount)
+
+    # A warm start neither parses run.toml nor rebuilds the index
+    monkeypatch.setattr("tomllib.loads", None)
+    monkeypatch.setattr("common.ss_HashIndex.HashIndex.add_packed", None)
+    warm = initRun(str(profile / "run.toml"))
+    assert (warm["compileCache"].hits, warm["compileCache"].misses) == (entryCount, 0)
+
+    seq = warm["sequence"]["BlueTB"]
+    assert seq["hashIDList"] == cold["sequence"]["BlueTB"]["hashIDList"] == list(range(13))
+    assert [step[0]["function"] for step in seq["plan"]] == [step[0]["function"] for step in cold["sequence"]["BlueTB"]["plan"]]
+    assert warm["hash"] == cold["hash"]
+
+def test_edited_run_toml_is_parsed_again(profile):
+    initRun(str(profile / "run.toml"))
+    with open(profile / "run.toml", "a") as f:
+        f.write('\n[colors.Extra]\ncolor = {r = 1, g = 2, b = 3}\ntolerance = 0\npureReq = false\n')
+
+    run = initRun(str(profile / "run.toml"))
+    assert "Extra" in run["colorInstances"]
+    assert run["compileCache"].misses == 1
+
+def test_new_hashes_are_appended_to_the_cached_index(profile):
+    run = initRun(str(profile / "run.toml"))
+    newHash = hex_to_hash(run["hash"]["4"][1])
+    newHash.hash[0, :4] = ~newHash.hash[0, :4]
+    run["hashStore"].add("BlueTB", newHash)
+    run["hashStore"].close()
+
+    run = initRun(str(profile / "run.toml"))
+    seq = run["sequence"]["BlueTB"]
+    assert run["compileCache"].misses == 0
+    assert seq["hashIDList"] == list(range(14))
+    assert seq["hashIndex"].nearest(newHash, 0) == (True, 13, 0)
+
+def test_changed_store_rebuilds_the_index(profile):
+    run = initRun(str(profile / "run.toml"))
+    store : HashStore = run["hashStore"]
+    with store.db:
+        store.db.execute("DELETE FROM hashes WHERE id = 4")
+    store.close()
+
+    run = initRun(str(profile / "run.toml"))
+    assert run["sequence"]["BlueTB"]["hashIDList"] == [i for i in range(13) if i != 4]
+    assert 4 not in run["sequence"]["BlueTB"]["hashIndex"].ids
+
+def test_replaced_hash_rebuilds_the_index(profile):
+    run = initRun(str(profile / "run.toml"))
+    replacement = hex_to_hash(run["hash"]["7"][1])
+    run["hashStore"].add("BlueTB", replacement, id= 4)
+    run["hashStore"].close()
+
+    run = initRun(str(profile / "run.toml"))
+    assert run["sequence"]["BlueTB"]["hashIndex"].nearest(replacement, 0) == (True, 4, 0)
+
+def test_appends_keep_the_store_generation(tmp_path):
+    store = HashStore(str(tmp_path / "hashes.sqlite"))
+    store.add("BlueTB", numpy.zeros((8, 8), dtype=bool))
+    store.add("BlueTB", numpy.ones((8, 8), dtype=bool))
+    assert store.generation() == 0
+    store.add("BlueTB", numpy.ones((8, 8), dtype=bool), id= 0)
+    assert store.generation() == 1
+    assert store.compact() == 1 and store.generation() == 2
+    store.close()
+
+def test_cache_never_lives_in_the_profile(profile, monkeypatch):
+    # A profile shipping a cache file must not get it unpickled
+    monkeypatch.setattr("pickle.load", None)
+    monkeypatch.setattr("pickle.loads", None)
+    (profile / ".ss_cache.bin").write_bytes(b"crafted")
+    cache = CompileCache(str(profile))
+    assert os.path.dirname(cache.path) == os.environ["SS_CACHE_DIR"]
+    assert CompileCache(str(profile / "..")).path != cache.path
+
+def test_init_run_without_cache_writes_nothing(profile):
+    run = initRun(str(profile / "run.toml"), useCache= False)
+    assert run["compileCache"] is None
+    assert not os.path.exists(CompileCache(str(profile)).path)
+
+def test_load_program_cache_and_invalidation(profile, monkeypatch):
+    path = str(profile / "main.los")
+    cold = load_program(path)
+
+    cache = CompileCache(str(profile))
+    warm = load_program(path, cache= cache)
+    assert cache.hits == 1
+    assert warm.disassemble() == cold.disassemble()
+    assert LOS_VM(warm)["blue_background"].color == (248, 248, 248)
+
+    # Other inputs, a new method signature or an edited script compile again
+    cache = CompileCache(str(profile))
+    load_program(path, inputs= ("frame",), cache= cache)
+    monkeypatch.setitem(core.NamespaceMethods.methods, "quit_if", lambda condition: None)
+    load_program(path, cache= cache)
+    monkeypatch.undo()
+    with open(path, "a") as f:
+        f.write("\nextra = 1\n")
+    assert "extra" in load_program(path, cache= cache).variables
+    assert cache.hits == 0 and cache.misses == 3
@@ -0,0 +1,229 @@
+import os
+import shutil
+import numpy
+from common.ss_ColorClasses import Color, ColorRequirement
+from common.ss_Capture import CoreFeatures, FrameChangeDetector, CaptureBackend
+from common.ss_ExecuteTOMLscript import executeTOMLsequence, executeTOMLsequences, compileSequence, getArgVal, setArgConst, scanTrackerStats, initRun
+from common.ss_ExecuteTOMLscript import seqEx_computHashFlatness
+from imagehash import ImageHash
+
+red = (237, 28, 36)
+green = (34, 177, 76)
+
+def makeRun() -> dict:
+    row = numpy.zeros((10, 10, 3), dtype=numpy.uint8)
+    row[2, 3:6] = red
+    row[2, 6:8] = green
+
+    run = {
+        "colorInstances": {
+            "red": Color(red, 0, ColorRequirement.required),
+            "green": Color(green, 0, ColorRequirement.required),
+        },
+        "sequence": {},
+        "frame": row,
+    }
+    run["sequence"]["scan"] = {
+        "10": {
+            "function": "pixelSequenceScan",
+            "pixels": ["run", ["sequence", "scan", "2", "result"]],
+            "colors": ["colors", ["red", "green"]],
+            "continue": ["run", ["sequence", "scan", "10", "result", 0]],
+        },
+        "2": {
+            "function": "getPixelRow_Absolute",
+            "image": ["run", ["frame"]],
+            "row": ["const", 2],
+        },
+        "11": {
+            "function": "getPixelRow_Absolute",
+            "image": ["run", ["frame"]],
+            "row": ["run", ["sequence", "scan", "10", "result", 1, 1, "startPixel"]],
+        },
+    }
+    return run
+
+def test_plan_order_and_results():
+    run = makeRun()
+    seq = run["sequence"]["scan"]
+    seq["plan"] = compileSequence(seq, run)
+
+    assert [step["function"] for step, _, _ in seq["plan"]] == ["getPixelRow_Absolute", "pixelSequenceScan", "getPixelRow_Absolute"]
+
+    assert executeTOMLsequence(seq, run)
+    result, colors = seq["10"]["result"]
+    assert result
+    assert [(c.startPixel, c.endPixel) for c in colors] == [(3, 5), (6, 7)]
+    assert (seq["11"]["result"] == run["frame"][6]).all()
+
+    # The color spec is shared between frames and the instances are not scanned
+    assert getArgVal(seq["10"], "colors", run) is getArgVal(seq["10"], "colors", run)
+    assert run["colorInstances"]["red"].startPixel == 0
+
+    # A false continue stops the sequence
+    run["frame"][2] = 0
+    assert not executeTOMLsequence(seq, run)
+
+def test_compiled_args_match_uncompiled():
+    run = makeRun()
+    seq = run["sequence"]["scan"]
+    seq["10"]["result"] = (True, [Color(red, 0, ColorRequirement.required), Color(green, 0, ColorRequirement.required)])
+    seq["10"]["result"][1][1].startPixel = 4
+
+    uncompiled = {arg: getArgVal(seq["11"], arg, run) for arg in ["image", "row", "missing"]}
+    compileSequence(seq, run)
+    compiled = {arg: getArgVal(seq["11"], arg, run) for arg in ["image", "row", "missing"]}
+
+    assert compiled["image"] is uncompiled["image"]
+    assert compiled["row"] == uncompiled["row"] == 4
+    assert compiled["missing"] is None
+
+def test_set_arg_const_updates_accessor():
+    run = makeRun()
+    seq = run["sequence"]["scan"]
+    compileSequence(seq, run)
+
+    setArgConst(seq["2"], "row", 1)
+    assert seq["2"]["row"] == ["const", 1]
+    assert getArgVal(seq["2"], "row", run) == 1
+
+# Serves a list of frames in order
+class ListCaptureBackend(CaptureBackend):
+
+    def __init__(self, frames : list) -> None:
+        super().__init__()
+        self.frames = frames
+
+    def grab(self) -> numpy.ndarray:
+        return self.store_frame(self.frames[self.frameCount])
+
+def test_unchanged_frames_skip_sequences():
+    run = makeRun()
+    frame = run["frame"]
+    run["sequence"]["scan"]["2"]["image"] = ["core", "screenShot_Whole_npArray"]
+    run["sequence"]["scan"]["11"]["image"] = ["core", "screenShot_Whole_npArray"]
+    run["coreFeatures"] = CoreFeatures(FrameChangeDetector(tileSize=4))
+
+    changed = frame.copy()
+    changed[9, 9] = 1
+    backend = ListCaptureBackend([frame, frame, frame, changed])
+
+    results = []
+    for _ in range(4):
+        run["coreFeatures"].capture(backend)
+        results.append(executeTOMLsequences(run)["scan"])
+
+    seq = run["sequence"]["scan"]
+    assert results == [True] * 4
+    assert (seq["runCount"], seq["skipCount"]) == (2, 2)
+    assert run["frameStats"] == {"processed": 2, "skipped": 2}
+
+    # A watch region ignores changes elsewhere
+    seq["watchRegion"] = [0, 0, 8, 4]
+    backend.frames.append(frame)
+    run["coreFeatures"].capture(backend)
+    executeTOMLsequences(run)
+    assert seq["skipCount"] == 3
+
+def test_time_dependent_stop_always_runs():
+    run = makeRun()
+    run["coreFeatures"] = CoreFeatures(FrameChangeDetector())
+    seq = run["sequence"]["scan"]
+
+    run["coreFeatures"].capture(ListCaptureBackend([run["frame"]] * 3))
+    executeTOMLsequences(run)
+    seq["stoppedBy"] = "computeHashFlatness"
+
+    run["coreFeatures"].capture(ListCaptureBackend([run["frame"]] * 3))
+    executeTOMLsequences(run)
+    assert seq["runCount"] == 2
+
+def test_tracked_scan_step():
+    run = makeRun()
+    seq = run["sequence"]["scan"]
+    seq["10"]["function"] = "pixelSequenceScan_Tracked"
+
+    for _ in range(3):
+        assert executeTOMLsequence(seq, run)
+
+    result, matches = seq["10"]["result"]
+    assert [(m.startPixel, m.endPixel) for m in matches] == [(3, 5), (6, 7)]
+    assert scanTrackerStats(run) == {("scan", "10"): (2, 1, 2 / 3)}
+
+# A sequence with a step on constants, unread steps and a step that never runs
+def makeOptimizableRun(optimize : bool) -> dict:
+    run = makeRun()
+    run["optimizeSequences"] = optimize
+    run["enum"] = {"Rows": {"scan": 1, "half": 0.5}}
+    path = lambda *keys: ["run", ["sequence", "opt", *keys]]
+    run["sequence"] = {"opt": {
+        "1": {"function": "flexMultiply", "input1": ["run", ["enum", "Rows", "scan"]], "input2": ["const", 2]},
+        "2": {"function": "getPixelRow_Absolute", "image": ["run", ["frame"]], "row": path("1", "result")},
+        "3": {"function": "pixelSequenceScan", "pixels": path("2", "result"), "colors": ["colors", ["red", "green"]],
+              "continue": path("3", "result", 0)},
+        "4": {"function": "getValue_PercentBetweenValues", "start": path("3", "result", 1, 0, "startPixel"),
+              "end": path("3", "result", 1, 1, "endPixel"), "percent": ["run", ["enum", "Rows", "half"]]},
+        "5": {"function": "getPixelColumn_Absolute", "image": ["run", ["frame"]], "column": ["const", 1]},
+        "6": {"function": "flexMultiply", "input1": path("4", "result"), "input2": ["const", 2]},
+        "7": {"function": "getPixelRow_Absolute", "image": ["run", ["frame"]], "row": path("3", "result", 1, 1, "startPixel")},
+        "saveImage": {"function": "saveImage", "image": ["run", ["frame"]], "fileName": ["const", "x.png"]},
+    }}
+    seq = run["sequence"]["opt"]
+    seq["plan"] = compileSequence(seq, run)
+    return run
+
+def test_optimizer_folds_hoists_and_drops():
+    run = makeOptimizableRun(True)
+    seq = run["sequence"]["opt"]
+
+    assert [step["function"] for step, _, _ in seq["plan"]] == ["getPixelRow_Absolute", "pixelSequenceScan", "getPixelRow_Absolute"]
+    assert seq["1"]["result"] == 2
+    assert str(seq["optimization"]) == "folded 1.input1 = 1, 2.row = 2, 4.percent = 0.5; hoisted 1; dropped 5, 6, 4; never run saveImage"
+    assert not makeOptimizableRun(False)["sequence"]["opt"].get("optimization")
+
+def test_optimized_sequence_gives_identical_frames():
+    frames = [makeRun()["frame"] for _ in range(4)]
+    frames[1][2] = 0
+    frames[2][2, 1:4] = red
+    frames[3][5, 3:6] = green
+
+    runs = [makeOptimizableRun(False), makeOptimizableRun(True)]
+    outputs = [[], []]
+    for frame in frames:
+        for run, out in zip(runs, outputs):
+            run["frame"] = frame
+            seq = run["sequence"]["opt"]
+            found = executeTOMLsequence(seq, run)
+            matches = [(m.startPixel, m.endPixel) for m in seq["3"]["result"][1]]
+            out.append((found, seq["3"]["result"][0], matches, seq["7"]["result"].tolist()))
+
+    assert outputs[0] == outputs[1]
+    assert [found for found, *_ in outputs[0]] == [True, False, True, True]
+
+def test_profile_optimization_report(tmp_path):
+    shutil.copy(os.path.join(os.path.dirname(os.path.dirname(__file__)), "Profiles", "PokeFR", "run.toml"), tmp_path / "run.toml")
+    run = initRun(str(tmp_path / "run.toml"))
+
+    assert str(run["sequence"]["BlueTB"]["optimization"]) == "never run saveImage"
+    assert str(run["sequence"]["tbBlue"]["optimization"]) == (
+        "folded 5.percent = 0.1696428571, 6.percent = 0.4151785714, 8.percent = 0.5848214286, 9.percent = 0.8303571429"
+    )
+    assert len(run["sequence"]["BlueTB"]["plan"]) == 10
+    # A known line is played before new ones are recorded
+    assert [step["function"] for step, _, _ in run["sequence"]["BlueTB"]["plan"][-4:]] == ["findKnownHash", "playAudio", "saveHash_IfNew", "updateRun"]
+
+def test_profile_text_settles_after_twelve_seconds(tmp_path):
+    shutil.copy(os.path.join(os.path.dirname(os.path.dirname(__file__)), "Profiles", "PokeFR", "run.toml"), tmp_path / "run.toml")
+    run = initRun(str(tmp_path / "run.toml"))
+    seq = run["sequence"]["BlueTB"]
+    seq["9"]["result"] = ImageHash(numpy.eye(36, dtype=bool))
+
+    # flatDuration is in seconds, as the old flat_duration was: a still
+    # box is not flat after 12 frames, only after 12 s
+    flat = []
+    for frameTime in (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 11.9, 12.0):
+        run["coreFeatures"].set_frame(numpy.zeros((4, 4, 3), dtype=numpy.uint8), frameTime)
+        seqEx_computHashFlatness(seq["10"], run)
+        flat.append(seq["10"]["result"])
+    assert flat == [False] * 14 + [True]
+    run["hashStore"].close()
@@ -0,0 +1,57 @@
+import numpy
+import pytest
+from imagehash import ImageHash
+from common.ss_HashIndex import HashIndex, pack_hash, popcount
+
+def randomHashes(rng, count : int, size : int = 36) -> list[ImageHash]:
+    return [ImageHash(rng.random((size, size)) < 0.5) for _ in range(count)]
+
+# Copy of hash with exactly flips bits changed
+def flipBits(rng, hash : ImageHash, flips : int) -> ImageHash:
+    bits = hash.hash.copy().reshape(-1)
+    idx = rng.choice(len(bits), size=flips, replace=False)
+    bits[idx] = ~bits[idx]
+    return ImageHash(bits.reshape(hash.hash.shape))
+
+def test_distances_match_imagehash():
+    rng = numpy.random.default_rng(0)
+    hashes = randomHashes(rng, 200, 8)
+    index = HashIndex(capacity=4)
+    for i, h in enumerate(hashes):
+        index.add(h, str(i))
+
+    query = hashes[17]
+    assert list(index.distances(query)) == [query - h for h in hashes]
+
+@pytest.mark.parametrize("mihTolerance", [None, 30])
+def test_query_within_tolerance(mihTolerance):
+    rng = numpy.random.default_rng(1)
+    hashes = randomHashes(rng, 500)
+    index = HashIndex(mihTolerance=mihTolerance)
+    for i, h in enumerate(hashes):
+        index.add(h, i)
+
+    for flips in (0, 5, 30, 31):
+        target = rng.integers(len(hashes))
+        query = flipBits(rng, hashes[target], flips)
+        found, id, distance = index.nearest(query, 30)
+
+        expected = sorted((query - h, i) for i, h in enumerate(hashes) if query - h <= 30)
+        assert found == bool(expected)
+        if expected:
+            assert (distance, id) == expected[0]
+
+    # Tolerances above the multi-index bound fall back to the full scan
+    rows, d = index.query(hashes[0], 700)
+    assert len(rows) == sum(1 for h in hashes if hashes[0] - h <= 700)
+
+def test_hash_size_mismatch():
+    index = HashIndex()
+    index.add(numpy.zeros((8, 8), dtype=bool))
+    with pytest.raises(ValueError):
+        index.add(numpy.zeros((16, 16), dtype=bool))
+
+def test_popcount():
+    words = numpy.array([0, 1, 0xFF, 2**64 - 1], dtype=numpy.uint64)
+    assert list(popcount(words)) == [0, 1, 8, 64]
+    assert pack_hash(numpy.ones(65, dtype=bool)).shape == (2,)
@@ -0,0 +1,79 @@
+import os
+import shutil
+import numpy
+from imagehash import ImageHash, hex_to_hash
+from common.ss_HashStore import HashStore
+from common.ss_HashIndex import pack_hash
+from common.ss_ExecuteTOMLscript import initRun, seqEx_saveHash_IfNew
+
+profileRun = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Profiles", "PokeFR", "run.toml")
+
+def randomHash(rng, size : int = 8) -> ImageHash:
+    return ImageHash(rng.random((size, size)) < 0.5)
+
+def test_batched_flush_and_reload(tmp_path):
+    rng = numpy.random.default_rng(0)
+    path = str(tmp_path / "hashes.sqlite")
+    hashes = [randomHash(rng) for _ in range(5)]
+
+    store = HashStore(path, batchSize=3, flushSeconds=3600)
+    ids = [store.add("BlueTB", h) for h in hashes]
+    assert ids == [0, 1, 2, 3, 4]
+    assert len(store.pending) == 2
+
+    # Only the committed batch survives without a flush
+    other = HashStore(path)
+    assert other.load_sequence("BlueTB")[0] == [0, 1, 2]
+    other.db.close()
+
+    store.close()
+    store = HashStore(path)
+    loaded, words, bitCount = store.load_sequence("BlueTB")
+    assert loaded == ids
+    assert bitCount == 64
+    assert (words == numpy.stack([pack_hash(h) for h in hashes])).all()
+    assert store.nextID == 5
+    store.close()
+
+def test_compact_removes_duplicates(tmp_path):
+    rng = numpy.random.default_rng(1)
+    store = HashStore(str(tmp_path / "hashes.sqlite"))
+    h = randomHash(rng)
+    store.add("BlueTB", h)
+    store.add("BlueTB", randomHash(rng))
+    store.add("BlueTB", h)
+
+    assert store.compact() == 1
+    assert store.load_sequence("BlueTB")[0] == [0, 1]
+    store.close()
+
+def test_init_run_imports_legacy_table(tmp_path):
+    shutil.copy(profileRun, tmp_path / "run.toml")
+
+    run = initRun(str(tmp_path / "run.toml"))
+    seq = run["sequence"]["BlueTB"]
+    assert len(seq["hashIndex"]) == len(run["hash"]) == 13
+    assert seq["hashIDList"] == list(range(13))
+
+    known = hex_to_hash(run["hash"]["4"][1])
+    assert seq["hashIndex"].nearest(known, 0) == (True, 4, 0)
+
+    # A new hash is stored and indexed, a known one is not
+    step = {
+        "hash": ["const", ImageHash(~known.hash)],
+        "seq": ["run", ["sequence", "BlueTB"]],
+        "seqStr": ["const", "BlueTB"],
+        "differenceTolerance": ["const", 30],
+    }
+    seqEx_saveHash_IfNew(step, run)
+    assert step["result"]
+    step["hash"] = ["const", known]
+    seqEx_saveHash_IfNew(step, run)
+    assert not step["result"]
+    run["hashStore"].close()
+
+    # The second start loads from the store, not the TOML table
+    run = initRun(str(tmp_path / "run.toml"))
+    assert run["sequence"]["BlueTB"]["hashIDList"] == list(range(14))
+    assert run["hashCount"] == ["const", 14]
+    run["hashStore"].close()
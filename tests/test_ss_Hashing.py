@@ -0,0 +1,189 @@
+import os
+import imagehash
+import numpy
+import pytest
+from PIL import Image
+from common.ss_Hashing import compute_hash_dhash, grayscale_array, resample_rows, resample_columns, CropGridHasher
+from common.ss_Hashing import HashFlatnessDetector, MultiHashFlatnessDetector
+from common.ss_Image import flexCropImage, flexCropEdges, mergeImages_Vertical
+from common.ss_ExecuteTOMLscript import executeTOMLsequence
+
+testDir = os.path.dirname(__file__)
+
+def randomImage(rng, height, width, channels = 3) -> numpy.ndarray:
+    arr = rng.integers(0, 256, size=(height, width, channels), dtype=numpy.uint8)
+    # Blocky content has the flat areas and hard edges of game text
+    return numpy.repeat(numpy.repeat(arr[::4, ::4], 4, axis=0), 4, axis=1)[:height, :width]
+
+def test_grayscale_matches_pil():
+    rng = numpy.random.default_rng(0)
+    arr = rng.integers(0, 256, size=(64, 64, 4), dtype=numpy.uint8)
+
+    assert (grayscale_array(arr[..., :3]) == numpy.asarray(Image.fromarray(arr[..., :3]).convert("L"))).all()
+    assert (grayscale_array(arr) == numpy.asarray(Image.fromarray(arr, "RGBA").convert("L"))).all()
+
+@pytest.mark.parametrize("inSize, outSize", [(37, 37), (100, 37), (37, 9), (5, 37), (1, 9), (480, 37)])
+def test_resample_matches_pil(inSize, outSize):
+    rng = numpy.random.default_rng(inSize * outSize)
+    gray = rng.integers(0, 256, size=(inSize, inSize), dtype=numpy.uint8)
+
+    expected = numpy.asarray(Image.fromarray(gray).resize((outSize, outSize), Image.Resampling.LANCZOS))
+    assert (resample_columns(resample_rows(gray, outSize), outSize) == expected).all()
+
+def test_dhash_matches_imagehash_random():
+    rng = numpy.random.default_rng(1234)
+
+    for _ in range(200):
+        height, width = rng.integers(1, 160, size=2)
+        size = int(rng.integers(2, 40))
+        arr = randomImage(rng, height, width)
+
+        expected = imagehash.dhash(Image.fromarray(arr), size)
+        assert (compute_hash_dhash(arr, size).hash == expected.hash).all()
+        assert (compute_hash_dhash(Image.fromarray(arr), size).hash == expected.hash).all()
+
+@pytest.mark.parametrize("imageNumber", range(1, 8))
+def test_dhash_matches_imagehash_fixtures(imageNumber):
+    with Image.open(os.path.join(testDir, f"testColors_{imageNumber}.png")) as im:
+        im = im.convert("RGB")
+
+    for size in (8, 36):
+        assert compute_hash_dhash(numpy.asarray(im), size) == imagehash.dhash(im, size)
+
+def test_stitched_crops_match_merged_image():
+    rng = numpy.random.default_rng(7)
+    frame = randomImage(rng, 160, 240)
+
+    crops = flexCropImage(frame, 10, 20, 219, 60, 3)
+    assert all(numpy.shares_memory(crop, frame) for crop in crops)
+
+    merged = mergeImages_Vertical(flexCropImage(Image.fromarray(frame), 10, 20, 219, 60, 3))
+    assert compute_hash_dhash(crops, 36) == imagehash.dhash(merged, 36)
+
+def test_stitched_crops_of_mixed_width():
+    rng = numpy.random.default_rng(8)
+    crops = [randomImage(rng, 12, 50), randomImage(rng, 9, 30), randomImage(rng, 15, 70)]
+
+    merged = mergeImages_Vertical([Image.fromarray(crop) for crop in crops])
+    assert compute_hash_dhash(crops, 16) == imagehash.dhash(merged, 16)
+
+def test_dhash_size_check():
+    with pytest.raises(ValueError):
+        compute_hash_dhash(numpy.zeros((8, 8, 3), dtype=numpy.uint8), 1)
+
+@pytest.mark.parametrize("low, high, count", [(10, 219, 3), (0, 9, 3), (5, 5, 1), (3, 100, 7)])
+def test_crop_edges_cover_every_pixel(low, high, count):
+    edges = flexCropEdges(low, high, count)
+    widths = numpy.diff(edges)
+
+    assert edges[0] == low and edges[-1] == high + 1
+    assert widths.max() - widths.min() <= 1
+
+@pytest.mark.parametrize("box, counts", [((10, 20, 219, 60), (3, 1)), ((0, 0, 159, 99), (2, 3)), ((31, 5, 31, 40), (1, 1))])
+def test_crop_grid_hash_matches_merged_crops(box, counts):
+    rng = numpy.random.default_rng(sum(box))
+    frame = randomImage(rng, 160, 240)
+    hasher = CropGridHasher(36)
+
+    merged = mergeImages_Vertical(flexCropImage(Image.fromarray(frame), *box, *counts))
+    assert hasher.hash(frame, *box, *counts) == imagehash.dhash(merged, 36)
+    assert hasher.hash(frame, *box, *counts) == compute_hash_dhash(flexCropImage(frame, *box, *counts), 36)
+
+def test_crop_grid_hash_reuses_buffers():
+    rng = numpy.random.default_rng(3)
+    hasher = CropGridHasher(16)
+
+    hasher.hash(randomImage(rng, 120, 200), 0, 0, 179, 59, 3)
+    grayBuffer, rowBuffer = hasher.grayBuffer, hasher.rowBuffer
+
+    frame = randomImage(rng, 120, 200)
+    hash = hasher.hash(frame, 4, 8, 170, 50, 3)
+    assert hasher.grayBuffer is grayBuffer and hasher.rowBuffer is rowBuffer
+    assert hash == compute_hash_dhash(flexCropImage(frame, 4, 8, 170, 50, 3), 16)
+
+def test_crop_grid_hash_step_keeps_hasher():
+    frame = randomImage(numpy.random.default_rng(4), 80, 120)
+    run = {"frame": frame, "sequence": {"seq": {
+        "1": {
+            "function": "cropGridHash_DHash",
+            "image": ["run", ["frame"]],
+            "left": ["const", 5], "top": ["const", 10], "right": ["const", 100], "bottom": ["const", 30],
+            "horizontalCount": ["const", 3],
+            "size": ["const", 8],
+        },
+    }}}
+    seq = run["sequence"]["seq"]
+
+    executeTOMLsequence(seq, run)
+    hasher = seq["1"]["hasher"]
+    executeTOMLsequence(seq, run)
+
+    assert seq["1"]["hasher"] is hasher
+    assert seq["1"]["result"] == compute_hash_dhash(flexCropImage(frame, 5, 10, 100, 30, 3), 8)
+
+def bitHash(*setBits, size = 8) -> imagehash.ImageHash:
+    bits = numpy.zeros(size * size, dtype=bool)
+    bits[list(setBits)] = True
+    return imagehash.ImageHash(bits.reshape(size, size))
+
+def test_flatness_frame_threshold():
+    detector = HashFlatnessDetector(diffTolerance=1, flatFrames=2)
+
+    # A big change on the very first comparison used to hit an unset flat_time
+    assert [detector.update(h, t) for t, h in enumerate([bitHash(), bitHash(1, 2, 3), bitHash(1, 2), bitHash(1, 2), bitHash(9, 10)])] \
+        == [False, False, False, True, False]
+
+def test_flatness_duration_threshold():
+    detector = HashFlatnessDetector(diffTolerance=0, flatSeconds=0.5)
+    hash = bitHash(4)
+
+    assert not detector.update(hash, 10.0)
+    assert not detector.update(hash, 10.25)
+    assert detector.update(hash, 10.5)
+    assert not detector.update(bitHash(5), 10.75)
+    assert detector.update(bitHash(5), 11.25)
+
+    with pytest.raises(ValueError):
+        HashFlatnessDetector(diffTolerance=0)
+
+def test_multi_region_flatness_matches_single():
+    rng = numpy.random.default_rng(5)
+    regionCount = 4
+    singles = [HashFlatnessDetector(3, flatFrames=3, flatSeconds=0.1) for _ in range(regionCount)]
+    multi = MultiHashFlatnessDetector(regionCount, 3, flatFrames=3, flatSeconds=0.1)
+    current = [bitHash(*rng.choice(64, 10, replace=False)) for _ in range(regionCount)]
+
+    for frame in range(60):
+        frameTime = frame / 30
+        for region in range(regionCount):
+            # Mostly still regions with small jitter and occasional big changes
+            flips = rng.choice(64, rng.choice([0, 1, 2, 12]), replace=False)
+            bits = current[region].hash.copy().reshape(-1)
+            bits[flips] ^= True
+            current[region] = imagehash.ImageHash(bits.reshape(8, 8))
+
+        expected = [d.update(h, frameTime) for d, h in zip(singles, current)]
+        assert list(multi.update(current, frameTime)) == expected
+
+def test_flatness_step_uses_frame_time():
+    run = {"sequence": {"seq": {
+        "1": {
+            "function": "computeHashFlatness",
+            "hash": ["run", ["hash"]],
+            "differenceTolerance": ["const", 0],
+            "flatCountThreshold": ["const", 1],
+            "flatDuration": ["const", 1.0],
+            "frameTime": ["run", ["frameTime"]],
+        },
+    }}}
+    step = run["sequence"]["seq"]["1"]
+    run["hash"] = bitHash(3)
+
+    results = []
+    for frameTime in (0.0, 0.5, 1.0):
+        run["frameTime"] = frameTime
+        executeTOMLsequence(run["sequence"]["seq"], run)
+        results.append(step["result"])
+
+    assert results == [False, False, True]
+    assert "prevHash" not in step and isinstance(step["detector"], HashFlatnessDetector)
@@ -0,0 +1,114 @@
+import os
+import numpy
+import pytest
+from common.ss_namespace_methods import NamespaceMethods
+from common.ss_Capture import CaptureBackend, set_capture_backend
+from common.ss_LOSLexer import LOS_SyntaxError
+from common.ss_LOSCompiler import LOS_Opcodes, LOS_VM, compile_string, compile_file, make_color
+import core
+
+mainLOS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Profiles", "PokeFR", "main.los")
+
+# Blue FireRed text box: rows 100-149, columns 10-229
+def blueBoxFrame() -> numpy.ndarray:
+    frame = numpy.zeros((160, 240, 3), dtype=numpy.uint8)
+    outerV, innerV, outerH, innerH, body = (72, 112, 160), (160, 208, 224), (160, 208, 224), (208, 224, 240), (248, 248, 248)
+    for columns, color in (((10, 230), outerH), ((13, 227), innerH), ((15, 225), body)):
+        frame[100:150, columns[0]:columns[1]] = color
+    for rows, color in (((100, 150), outerV), ((103, 147), innerV), ((105, 145), body)):
+        frame[rows[0]:rows[1], 15:225] = color
+    return frame
+
+class FrameBackend(CaptureBackend):
+
+    def __init__(self, frame : numpy.ndarray) -> None:
+        super().__init__()
+        self.frame = frame
+
+    def grab(self) -> numpy.ndarray:
+        return self.store_frame(self.frame)
+
+@pytest.fixture
+def backend():
+    backend = FrameBackend(blueBoxFrame())
+    set_capture_backend(backend)
+    yield backend
+    set_capture_backend(None)
+
+def test_main_los_runs_per_frame(backend):
+    program = compile_file(mainLOS)
+    ops = [ins[0] for ins in program.code]
+    assert ops.count(LOS_Opcodes.QUIT_UNLESS) == 2 and LOS_Opcodes.NOT not in ops
+    assert ops.count(LOS_Opcodes.INDEXK) == 7
+
+    vm = LOS_VM(program)
+    assert vm["blue_background"].color == (248, 248, 248)
+
+    assert vm.run()
+    assert (vm["box_top"], vm["box_bottom"], vm["box_left"], vm["box_right"]) == (105, 144, 15, 224)
+
+    # No text box: the first quit_if ends the run
+    backend.frame = numpy.zeros_like(backend.frame)
+    assert not vm.run()
+    assert (vm.runCount, vm.quitCount) == (2, 1)
+
+def test_calls_and_variables_are_bound_when_compiling():
+    program = compile_string("setup(c = Color(r = 1, g = 2, b = 3))\nx = get_pixel_column_percent(image = f, percent = 0.5)\ny = x[c]", inputs=("f",))
+
+    x, f, c = (program.variables[n] for n in ("x", "f", "c"))
+    assert program.inputs == {"f": f}
+    assert program.setupCode == ((LOS_Opcodes.CALL3, c, make_color, program.setupCode[0][3]),)
+    op, dst, function, args = program.code[0]
+    assert (op, dst, function) == (LOS_Opcodes.CALL2, x, NamespaceMethods.methods["get_pixel_column_percent"])
+    assert args[0] == f and dict(program.constants)[args[1]] == 0.5
+    assert program.code[1][:3] == (LOS_Opcodes.INDEX, program.variables["y"], x)
+
+def test_quit_if_ends_the_run_early():
+    calls = []
+    def record(value):
+        calls.append(value)
+        return value
+
+    program = compile_string("a = record(1)\nquit_if(!flag)\nb = record(2)", inputs=("flag",), methods={"record": record})
+    vm = LOS_VM(program)
+    assert not vm.run(flag=False)
+    assert calls == [1] and vm["b"] is None
+    assert vm.run(flag=True)
+    assert calls == [1, 1, 2] and vm["b"] == 2
+
+def test_setup_runs_once():
+    made = []
+    program = compile_string("setup(c = make(1))\nx = c", methods={"make": lambda v: made.append(v) or v})
+    vm = LOS_VM(program)
+    vm.run()
+    vm.run()
+    assert made == [1] and vm["x"] == 1
+
+def test_keyword_parameters():
+    def scale(value, factor = 2, *, offset = 0):
+        return value * factor + offset
+
+    program = compile_string("a = scale(factor = 3, value = 2)\nb = scale(1, offset = 5)", methods={"scale": scale})
+    assert program.code[0][0] == LOS_Opcodes.CALL2
+    assert program.code[1][0] == LOS_Opcodes.CALLKW
+    vm = LOS_VM(program)
+    vm.run()
+    assert (vm["a"], vm["b"]) == (6, 7)
+
+@pytest.mark.parametrize("source, line, column, message", [
+    ("a = b", 1, 5, "Undefined variable b"),
+    ("a = b\nb = 1", 1, 5, "b is used before it is assigned"),
+    ("a = get_pixel_column_percent(image = 1, size = 2)", 1, 5, "Bad call to get_pixel_column_percent"),
+    ("quit_if(1, 2)", 1, 1, "quit_if takes one condition"),
+])
+def test_compile_errors_report_position(source, line, column, message):
+    with pytest.raises(LOS_SyntaxError) as error:
+        compile_string(source)
+    assert (error.value.line, error.value.column) == (line, column)
+    assert message in str(error.value)
+
+def test_runtime_errors_name_the_script_position():
+    vm = LOS_VM(compile_string("a = [1]\n\nb = a[3]"))
+    with pytest.raises(IndexError) as error:
+        vm.run()
+    assert error.value.__notes__ == ["in LOS script at <los>:3:6"]
@@ -0,0 +1,71 @@
+import os
+import pytest
+from common.ss_LOSLexer import LOS_TokenTypes, LOS_SyntaxError, lex_lines, lex_string, lex_file
+from core import SpokenScreenApplication
+from common.ss_PathClasses import PathElement, PathType
+
+mainLOS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Profiles", "PokeFR", "main.los")
+
+T = LOS_TokenTypes
+
+def kinds(source : str) -> list[tuple]:
+    return [(t.type, t.value if t.value is not None else t.string) for t in lex_string(source)]
+
+def test_tokens_and_values():
+    assert kinds('x = get_pixel_column_percent(image = s, percent = 0.5) # middle\nquit_if( !r[0] )') == [
+        (T.VARIABLE, "x"), (T.ASSIGN, "="), (T.METHOD, "get_pixel_column_percent"), (T.OPEN_PARENTHESES, "("),
+        (T.VARIABLE, "image"), (T.ASSIGN, "="), (T.VARIABLE, "s"), (T.COMMA, ","),
+        (T.VARIABLE, "percent"), (T.ASSIGN, "="), (T.IMMEDIATE_FLOAT, 0.5), (T.CLOSE_PARENTHESES, ")"),
+        (T.METHOD, "quit_if"), (T.OPEN_PARENTHESES, "("), (T.NOT_OPERATOR, "!"), (T.VARIABLE, "r"),
+        (T.OPEN_BRACKET_SQUARE, "["), (T.IMMEDIATE_INTEGER, 0), (T.CLOSE_BRACKET_SQUARE, "]"), (T.CLOSE_PARENTHESES, ")"),
+    ]
+    assert kinds("setup( a = -3, b = .25, c = true, d = false )")[3:] == [
+        (T.ASSIGN, "="), (T.IMMEDIATE_INTEGER, -3), (T.COMMA, ","), (T.VARIABLE, "b"), (T.ASSIGN, "="), (T.IMMEDIATE_FLOAT, 0.25),
+        (T.COMMA, ","), (T.VARIABLE, "c"), (T.ASSIGN, "="), (T.IMMEDIATE_BOOLEAN, True),
+        (T.COMMA, ","), (T.VARIABLE, "d"), (T.ASSIGN, "="), (T.IMMEDIATE_BOOLEAN, False), (T.CLOSE_PARENTHESES, ")"),
+    ]
+    assert kinds("setup()")[0] == (T.SETUP, "setup")
+
+def test_strings_are_preserved():
+    tokens = lex_string('name = "Box # 1, (blue)"   # comment\nq = \'it\\\'s\\n\'')
+    strings = [t for t in tokens if t.type == T.STRING]
+    assert [t.value for t in strings] == ["Box # 1, (blue)", "it's\n"]
+    assert [(t.line, t.column) for t in strings] == [(1, 8), (2, 5)]
+    assert len(tokens) == 6
+
+def test_positions():
+    tokens = lex_string("\n  a =   b\n\n\tc[ d ]")
+    assert [(t.string, t.line, t.column) for t in tokens] == [
+        ("a", 2, 3), ("=", 2, 5), ("b", 2, 9), ("c", 4, 2), ("[", 4, 3), ("d", 4, 5), ("]", 4, 7),
+    ]
+
+@pytest.mark.parametrize("source, line, column", [
+    ('a = "open\nb = 1', 1, 5),
+    ("a = 1\nb = $", 2, 5),
+    ("import os", 1, 1),
+])
+def test_errors_report_position(source, line, column):
+    with pytest.raises(LOS_SyntaxError) as error:
+        lex_string(source)
+    assert (error.value.line, error.value.column) == (line, column)
+    assert f":{line}:{column}" in str(error.value)
+
+def test_lexer_streams_lines():
+    consumed = []
+    def lines():
+        for i in range(3):
+            consumed.append(i)
+            yield f"v{i} = {i}\n"
+
+    tokens = lex_lines(lines())
+    assert next(tokens).string == "v0" and consumed == [0]
+    assert len(list(tokens)) == 8
+
+def test_application_tokenizes_main_los():
+    app = SpokenScreenApplication(PathElement(type= PathType.FILE, path_str= mainLOS))
+    assert app.tokenize_program()
+
+    assert len(app.tokens) == len(lex_file(mainLOS))
+    assert app.tokens[0].type == T.SETUP and (app.tokens[0].line, app.tokens[0].column) == (6, 1)
+    assert "scan_v_result" in app.namespace_variables
+    assert all(t.string != "#" for t in app.tokens)
@@ -0,0 +1,82 @@
+import os
+import pytest
+from common.ss_LOSLexer import LOS_SyntaxError, lex_file
+from common.ss_LOSParser import (
+    LOS_ExpressionTypes, LOS_Expression_Assignment, LOS_Expression_Method, LOS_Expression_Setup,
+    LOS_Expression_GetAttr, LOS_Expression_Not, LOS_Expression_List, LOS_Expression_Variable, LOS_Expression_Constant,
+    parse_string, parse_file,
+)
+from core import SpokenScreenApplication
+from common.ss_PathClasses import PathElement, PathType
+
+mainLOS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Profiles", "PokeFR", "main.los")
+
+E = LOS_ExpressionTypes
+
+def test_main_los_corpus():
+    program = parse_file(mainLOS)
+
+    assert [(e.type, e.line) for e in program[:7]] == [
+        (E.SETUP, 6), (E.ASSIGNMENT, 56), (E.ASSIGNMENT, 58), (E.ASSIGNMENT, 62),
+        (E.ASSIGNMENT, 69), (E.METHOD_CALL, 76), (E.ASSIGNMENT, 78),
+    ]
+    assert len(program) == 19
+
+    setup = program[0]
+    assert [a.destination for a in setup.assignments] == ["blue_outer_v", "blue_inner_v", "blue_outer_h", "blue_inner_h", "blue_background"]
+    color = setup.assignments[0].source
+    assert isinstance(color, LOS_Expression_Method) and color.name == "Color" and color.args == []
+    assert {k: v.value for k, v in color.params.items()} == {"tolerance": 0, "required": True, "r": 72, "g": 112, "b": 160}
+
+    scan = program[4].source
+    assert scan.params["colors"].type == E.LIST
+    assert [str(i) for i in scan.params["colors"].items] == ["blue_outer_v", "blue_inner_v", "blue_background", "blue_inner_v", "blue_outer_v"]
+
+    quit = program[5]
+    assert quit.name == "quit_if" and isinstance(quit.args[0], LOS_Expression_Not)
+    getattr = quit.args[0].operand
+    assert isinstance(getattr, LOS_Expression_GetAttr) and (getattr.line, getattr.column) == (76, 24)
+    assert str(getattr.var) == "scan_v_result" and getattr.attr.value == 0
+
+    assert str(program[8]) == "row_dialogue_top = _[start_pixel]"
+    assert isinstance(program[8].source.attr, LOS_Expression_Variable)
+    assert str(program[9]) == "pixel_row_dialogue_top = get_pixel_row_absolute(image = s_np, row = row_dialogue_top)"
+
+def test_expression_forms():
+    program = parse_string("a = flexAdd(1, b[x][2], c = !true, d = 'q')\nquit_if(a)\nsetup(e = 1, f = [])")
+    call = program[0].source
+    assert [type(a) for a in call.args] == [LOS_Expression_Constant, LOS_Expression_GetAttr]
+    assert str(call.args[1]) == "b[x][2]" and call.args[1].var.attr.name == "x"
+    assert str(call) == "flexAdd(1, b[x][2], c = !true, d = 'q')"
+    assert isinstance(program[1], LOS_Expression_Method)
+    assert isinstance(program[2], LOS_Expression_Setup) and str(program[2]) == "setup(e = 1, f = [])"
+    assert all(isinstance(a, LOS_Expression_Assignment) for a in program[2].assignments)
+    nested = parse_string("x = [1, [2]]")[0].source
+    assert isinstance(nested, LOS_Expression_List) and isinstance(nested.items[1], LOS_Expression_List)
+
+@pytest.mark.parametrize("source, line, column, message", [
+    ("a = ", 1, 4, "Expected an expression"),
+    ("a\nb = 1", 2, 1, "Expected '=' after a"),
+    ("a = flexAdd(1\nb = 2", 2, 1, "Expected ',' or ')'"),
+    ("a = flexAdd(x = 1, 2)", 1, 20, "Expected a named parameter"),
+    ("a = flexAdd(x = 1, x = 2)", 1, 20, "Repeated parameter x"),
+    ("a = b[1", 1, 8, "Expected ']'"),
+    ("1 = a", 1, 1, "Expected an assignment"),
+    ("setup(flexAdd(1))", 1, 7, "Expected an assignment or ')' in setup"),
+    ("a = = 1", 1, 5, "Expected an expression"),
+])
+def test_errors_report_position(source, line, column, message):
+    with pytest.raises(LOS_SyntaxError) as error:
+        parse_string(source)
+    assert (error.value.line, error.value.column) == (line, column)
+    assert message in str(error.value) and f":{line}:{column}" in str(error.value)
+
+def test_application_parses_quietly(capsys):
+    app = SpokenScreenApplication(PathElement(type= PathType.FILE, path_str= mainLOS))
+    capsys.readouterr()
+    assert app.tokenize_program()
+    expressions = app.parse_token_expressions(app.tokens)
+
+    assert capsys.readouterr().out == ""
+    assert expressions == parse_file(mainLOS) and app.expressions is expressions
+    assert len(app.tokens) == len(lex_file(mainLOS))
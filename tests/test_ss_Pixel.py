@@ -0,0 +1,193 @@
+import os
+import random
+import numpy
+import pytest
+from PIL import Image
+from common.ss_ColorClasses import Color, ColorRequirement, ColorSequence
+from common.ss_Pixel import get_pixel_row_absolute, get_pixel_column_absolute, get_pixel_row_percent, get_pixel_column_percent
+from common.ss_Pixel import pixel_sequence_scan, pixel_sequence_scan_lines, pixel_sequence_scan_lines_percent, ScanEngine
+from common.ss_Pixel import SequenceScanTracker, pixel_sequence_scan_tracked
+
+testDir = os.path.dirname(__file__)
+
+red = (237, 28, 36)
+green = (34, 177, 76)
+blue = (0, 162, 232)
+
+# Same tolerance / requirement combinations as ss_TestingMethods.testColors
+fixtureCases = [
+    ((0, 0, 0), (True, True, True)),
+    ((3, 120, 3), (True, True, True)),
+    ((0, 0, 0), (False, False, False)),
+    ((0, 150, 0), (True, False, True)),
+]
+
+def makeColors(rgbs, tolerances, requirements) -> list[Color]:
+    return [
+        Color(rgb, tol, ColorRequirement.required if req else ColorRequirement.notRequired)
+        for rgb, tol, req in zip(rgbs, tolerances, requirements)
+    ]
+
+# Run both engines on fresh color lists and compare everything they report
+def assertParity(pixels, rgbs, tolerances, requirements) -> None:
+    resultPy, colorsPy = pixel_sequence_scan(pixels, makeColors(rgbs, tolerances, requirements), ScanEngine.PYTHON)
+    resultNp, colorsNp = pixel_sequence_scan(pixels, makeColors(rgbs, tolerances, requirements), ScanEngine.NUMPY)
+
+    assert resultPy == resultNp
+    assert [(c.startPixel, c.endPixel) for c in colorsPy] == [(c.startPixel, c.endPixel) for c in colorsNp]
+
+@pytest.mark.parametrize("imageNumber", range(1, 8))
+@pytest.mark.parametrize("tolerances, requirements", fixtureCases)
+def test_parity_fixtures(imageNumber, tolerances, requirements):
+    with Image.open(os.path.join(testDir, f"testColors_{imageNumber}.png")) as im:
+        arr = numpy.array(im.convert("RGB"))
+
+    for row in (0, len(arr) // 2, len(arr) - 1):
+        assertParity(arr[row], (red, green, blue), tolerances, requirements)
+
+    # Columns exercise the strided view path
+    assertParity(arr[:, len(arr[0]) // 2], (red, green, blue), tolerances, requirements)
+
+def test_parity_random_strips():
+    rng = random.Random(1234)
+    palette = [red, green, blue, (255, 255, 255), (250, 30, 30)]
+
+    for _ in range(2000):
+        # Build strips out of short runs so sequences actually form and break
+        strip = []
+        for _ in range(rng.randint(0, 12)):
+            strip += [rng.choice(palette)] * rng.randint(1, 4)
+        pixels = numpy.array(strip, dtype=numpy.uint8).reshape(-1, 3)
+
+        colorCount = rng.randint(1, 4)
+        rgbs = [rng.choice(palette) for _ in range(colorCount)]
+        tolerances = [rng.choice((0, 0, 20)) for _ in range(colorCount)]
+        requirements = [rng.random() < 0.6 for _ in range(colorCount)]
+
+        assertParity(pixels, rgbs, tolerances, requirements)
+
+def test_single_color_returns_instance():
+    pixels = [(0, 0, 0), red, red, (0, 0, 0)]
+    for engine in ScanEngine:
+        result, color = pixel_sequence_scan(pixels, Color(red, 0, ColorRequirement.required), engine)
+        assert result
+        assert (color.startPixel, color.endPixel) == (1, 2)
+
+@pytest.mark.parametrize("vertical", [False, True])
+def test_scan_lines_matches_single_scans(vertical):
+    rng = numpy.random.default_rng(42)
+    palette = numpy.array([red, green, blue, (255, 255, 255)], dtype=numpy.uint8)
+    im = palette[rng.integers(0, len(palette), size=(40, 60))]
+    im[10:30, 5:50] = palette[numpy.repeat([0, 1, 2], 15)][None, :, :]
+    im[5:35, 20:25] = numpy.array([red] * 10 + [green] * 10 + [blue] * 10, dtype=numpy.uint8)[:, None, :]
+
+    requirements = (True, False, True)
+    lineCount = im.shape[1] if vertical else im.shape[0]
+    lines = list(range(0, lineCount, 3))
+
+    results = pixel_sequence_scan_lines(im, makeColors((red, green, blue), (0, 0, 0), requirements), lines, vertical, 2, -2)
+
+    assert list(results["line"]) == lines
+    for record, line in zip(results, lines):
+        pixels = im[2:-2, line] if vertical else im[line, 2:-2]
+        result, colors = pixel_sequence_scan(pixels, makeColors((red, green, blue), (0, 0, 0), requirements))
+
+        assert record["result"] == result
+        assert list(record["startPixel"]) == [-1 if c.startPixel is None else c.startPixel for c in colors]
+        assert list(record["endPixel"]) == [-1 if c.endPixel is None else c.endPixel for c in colors]
+
+    assert results["result"].any()
+
+def test_scan_lines_percent_fixture():
+    with Image.open(os.path.join(testDir, "testColors_1.png")) as im:
+        arr = numpy.array(im.convert("RGB"))
+
+    results = pixel_sequence_scan_lines_percent(arr, makeColors((red, green, blue), (3, 120, 3), (True, True, True)), [0.5, 1.0])
+    result, _ = pixel_sequence_scan(arr[len(arr) // 2], makeColors((red, green, blue), (3, 120, 3), (True, True, True)))
+
+    assert list(results["line"]) == [len(arr) // 2, len(arr) - 1]
+    assert results["result"][0] == result
+
+def test_column_extraction_is_view():
+    im = numpy.arange(6 * 5 * 4, dtype=numpy.uint8).reshape(6, 5, 4)
+
+    column = get_pixel_column_absolute(im, 2, 1, 4)
+    assert numpy.shares_memory(column, im)
+    assert column.shape == (3, 3)
+    assert (column == im[1:4, 2, :3]).all()
+
+    column = get_pixel_column_percent(im, 0.5)
+    assert numpy.shares_memory(column, im)
+    assert (column == im[:, 2, :3]).all()
+
+def test_percent_bounds():
+    im = numpy.zeros((6, 5, 3), dtype=numpy.uint8)
+
+    assert len(get_pixel_column_absolute(im, 0)) == 6
+    assert len(get_pixel_row_absolute(im, 0)) == 5
+
+    # 1.0 is the last line, not one past it
+    im[:, -1] = red
+    im[-1, :] = blue
+    assert (get_pixel_column_percent(im, 1.0)[:-1] == red).all()
+    assert (get_pixel_row_percent(im, 1.0) == blue).all()
+
+def test_color_sequence_scan_leaves_colors_untouched():
+    colors = makeColors((red, green, blue), (0, 0, 0), (True, False, True))
+    sequence = ColorSequence(colors)
+    pixels = [(0, 0, 0), red, red, green, blue, (0, 0, 0)]
+
+    for engine in ScanEngine:
+        result, matches = pixel_sequence_scan(pixels, sequence, engine)
+        assert result
+        assert [(m.startPixel, m.endPixel) for m in matches] == [(1, 2), (3, 3), (4, 4)]
+
+    assert all((c.startPixel, c.endPixel) == (0, 0) for c in colors)
+
+    with pytest.raises(AttributeError):
+        sequence.targets = None
+    with pytest.raises(ValueError):
+        sequence.targets[0, 0] = 1
+
+def boxLine(offset : int, length : int = 40) -> numpy.ndarray:
+    line = numpy.zeros((length, 3), dtype=numpy.uint8)
+    line[offset:offset + 3] = red
+    line[offset + 3:offset + 10] = green
+    line[offset + 10:offset + 12] = blue
+    return line
+
+def test_tracked_scan_hits_and_misses():
+    sequence = ColorSequence(makeColors((red, green, blue), (0, 0, 0), (True, True, True)))
+    tracker = SequenceScanTracker()
+
+    for offset in (5, 5, 5, 8, 8):
+        line = boxLine(offset)
+        assert pixel_sequence_scan_tracked(line, sequence, tracker) == pixel_sequence_scan(line, sequence)
+
+    assert (tracker.hits, tracker.misses) == (3, 2)
+    assert tracker.hitRate == 0.6
+
+    # Changes away from the box edges keep hitting
+    line = boxLine(8)
+    line[0] = blue
+    result, matches = pixel_sequence_scan_tracked(line, sequence, tracker)
+    assert result and matches[1] == (11, 17)
+    assert tracker.hits == 4
+
+def test_tracked_scan_edge_change_rescans():
+    sequence = ColorSequence(makeColors((red, green, blue), (0, 0, 0), (True, True, True)))
+    tracker = SequenceScanTracker()
+    pixel_sequence_scan_tracked(boxLine(5), sequence, tracker)
+
+    # The green run grows by one pixel into the blue run
+    line = boxLine(5)
+    line[15] = green
+    assert pixel_sequence_scan_tracked(line, sequence, tracker) == pixel_sequence_scan(line, sequence)
+    assert tracker.misses == 2
+
+    # A failed scan is not cached
+    empty = numpy.zeros((40, 3), dtype=numpy.uint8)
+    assert not pixel_sequence_scan_tracked(empty, sequence, tracker)[0]
+    assert tracker.result is None
+    assert pixel_sequence_scan_tracked(boxLine(5), makeColors((red, green, blue), (0, 0, 0), (True, True, True)), tracker)[0]
+    assert tracker.misses == 4
@@ -0,0 +1,98 @@
+import os
+import tomllib
+import pytest
+from common import ss_ProfileClasses
+from common.ss_ProfileClasses import findAllProfiles, manifestName
+
+runTOML = """
+name = "{name}"
+version = "1.0.{index}"
+initSequence = "BlueTB"
+
+[hash]
+
+[colors.red]
+tolerance = 0
+
+[sequence.BlueTB]
+"""
+
+def makeProfile(root, index : int, packCount : int, wavCount : int, descName : str = "desc.toml") -> str:
+    profilePath = os.path.join(root, f"profile_{index:03d}")
+    os.makedirs(profilePath)
+    with open(os.path.join(profilePath, "run.toml"), "w") as f:
+        f.write(runTOML.format(name=f"Profile {index}", index=index))
+
+    for pack in range(packCount):
+        packPath = os.path.join(profilePath, "Audio Packs", f"pack_{pack:02d}")
+        os.makedirs(packPath)
+        with open(os.path.join(packPath, descName), "w") as f:
+            f.write(f'title = "Pack {pack}"\nauthors = ["Nate"]\n')
+        for hashID in range(wavCount):
+            open(os.path.join(packPath, f"{hashID}.wav"), "wb").close()
+        open(os.path.join(packPath, "notes.wav.txt"), "wb").close()
+    return profilePath
+
+@pytest.fixture
+def loadCounter(monkeypatch):
+    loads = []
+    load = tomllib.load
+    def countingLoad(f, *args, **kwargs):
+        loads.append(os.path.basename(f.name))
+        return load(f, *args, **kwargs)
+    monkeypatch.setattr(ss_ProfileClasses.tomllib, "load", countingLoad)
+    return loads
+
+def summary(profiles) -> list:
+    return [
+        (p.name, p.version, [(a.title, os.path.basename(os.path.dirname(a.path)), sorted(a.audioFileDict.items())) for a in p.audioPacksList])
+        for p in profiles
+    ]
+
+def test_discovery_lists_each_pack_directory(tmp_path):
+    makeProfile(tmp_path, 0, 2, 3)
+    makeProfile(tmp_path, 1, 1, 2, descName="desc.tomli")
+
+    profiles = findAllProfiles(True, True, True, profilesPath=str(tmp_path))
+
+    files3 = [(i, f"{i}.wav") for i in range(3)]
+    assert summary(profiles) == [
+        ("Profile 0", "1.0.0", [("Pack 0", "pack_00", files3), ("Pack 1", "pack_01", files3)]),
+        ("Profile 1", "1.0.1", [("Pack 0", "pack_00", files3[:2])]),
+    ]
+
+def test_invalid_profiles_and_packs(tmp_path):
+    makeProfile(tmp_path, 0, 2, 1)
+    os.remove(os.path.join(tmp_path, "profile_000", "Audio Packs", "pack_01", "desc.toml"))
+    makeProfile(tmp_path, 1, 1, 0)
+    os.makedirs(os.path.join(tmp_path, "profile_002"))
+    with open(os.path.join(makeProfile(tmp_path, 3, 1, 1), "run.toml"), "w") as f:
+        f.write('name = "broken"\n[sequence\n')
+
+    assert [p.name for p in findAllProfiles(True, True, True, profilesPath=str(tmp_path))] == ["Profile 0"]
+    # Without reqAud a profile with only empty packs is still listed
+    assert [p.name for p in findAllProfiles(True, True, False, profilesPath=str(tmp_path))] == ["Profile 0", "Profile 1"]
+
+def test_warm_start_reparses_only_changes(tmp_path, loadCounter):
+    for index in range(3):
+        makeProfile(tmp_path, index, 2, 2)
+
+    cold = summary(findAllProfiles(True, True, True, profilesPath=str(tmp_path)))
+    assert len(loadCounter) == 3 + 3 * 2
+    assert all(os.path.exists(os.path.join(tmp_path, f"profile_{i:03d}", manifestName)) for i in range(3))
+
+    loadCounter.clear()
+    assert summary(findAllProfiles(True, True, True, profilesPath=str(tmp_path))) == cold
+    assert loadCounter == []
+
+    # A new clip in one pack rescans that pack; an edited run.toml is parsed again
+    packPath = os.path.join(tmp_path, "profile_001", "Audio Packs", "pack_00")
+    open(os.path.join(packPath, "7.wav"), "wb").close()
+    os.utime(packPath, ns=(0, os.stat(packPath).st_mtime_ns + 1))
+    runPath = os.path.join(tmp_path, "profile_002", "run.toml")
+    with open(runPath, "a") as f:
+        f.write('\n[colors.green]\ntolerance = 0\n')
+
+    warm = findAllProfiles(True, True, True, profilesPath=str(tmp_path))
+    assert sorted(loadCounter) == ["desc.toml", "run.toml"]
+    assert 7 in warm[1].audioPacksList[0].audioFileDict
@@ -0,0 +1,136 @@
+import threading
+import time
+import numpy
+from PIL import Image
+from imagehash import ImageHash
+from common.ss_Capture import CaptureBackend, CoreFeatures
+from common.ss_HashStore import HashStore
+from common.ss_Runtime import FrameRing, IOWorker, Runtime
+from common.ss_ExecuteTOMLscript import seqEx_saveImage
+
+# Endless numbered frames, optionally throttled
+class CountingCaptureBackend(CaptureBackend):
+
+    def __init__(self, frameLimit : int, delay : float = 0.0) -> None:
+        super().__init__()
+        self.frameLimit = frameLimit
+        self.delay = delay
+
+    def grab(self) -> numpy.ndarray:
+        if self.frameCount >= self.frameLimit:
+            raise EOFError
+        time.sleep(self.delay)
+        buffer = self.get_buffer(4, 4)
+        buffer[:] = self.frameCount % 256
+        self.stamp_frame()
+        return buffer
+
+def test_ring_latest_frame_wins():
+    ring = FrameRing(3)
+    frames = [numpy.full((2, 2, 3), i, dtype=numpy.uint8) for i in range(3)]
+
+    for i in range(2):
+        ring.publish(ring.write_slot(), frames[i], float(i))
+    frame, frameTime, frameID, captureTime = ring.take()
+    assert frame is frames[1] and frameTime == 1.0 and frameID == 2 and captureTime is None
+    assert ring.dropped == 1
+
+    # The writer skips both the newest and the frame being read
+    reading = ring.reading
+    for _ in range(6):
+        slot = ring.write_slot()
+        assert slot != reading
+        ring.publish(slot, frames[2], 2.0)
+        assert ring.write_slot() not in (reading, ring.latest)
+
+    ring.release()
+    assert ring.take(timeout=0) is not None
+    assert ring.take(timeout=0) is None
+
+    ring.close()
+    assert ring.take() is None
+
+def test_runtime_drops_stale_frames():
+    run = {"coreFeatures": CoreFeatures()}
+    runtime = Runtime(run, CountingCaptureBackend(200, delay=0.0005)).start()
+
+    seen = []
+    def slowHandler(run):
+        seen.append(int(run["coreFeatures"]["screenShot_Whole_npArray"][0, 0, 0]))
+        time.sleep(0.005)
+        return True
+
+    while runtime.running:
+        runtime.process(slowHandler, timeout=1.0)
+    runtime.stop()
+
+    stats = runtime.stats()
+    assert stats["capture"].count == 200
+    assert stats["process"].count == len(seen)
+    assert stats["process"].dropped == runtime.ring.dropped > 0
+    assert len(seen) + runtime.ring.dropped == runtime.ring.published
+    assert seen == sorted(seen)
+    assert "ioWorker" not in run
+
+def test_hash_store_writes_on_io_worker(tmp_path):
+    path = str(tmp_path / "hashes.sqlite")
+    worker = IOWorker()
+    store = HashStore(path, batchSize=2, flushSeconds=3600, ioWorker=worker)
+
+    writers = set()
+    write = store._write
+    store._write = lambda records: (writers.add(threading.current_thread().name), write(records))
+
+    rng = numpy.random.default_rng(0)
+    for _ in range(5):
+        store.add("BlueTB", ImageHash(rng.random((8, 8)) < 0.5))
+
+    assert len(store) == 5
+    assert store.load_sequence("BlueTB")[0] == [0, 1, 2, 3, 4]
+    assert writers == {"ss_io"}
+
+    store.close()
+    worker.close()
+    assert worker.stats.count == 3
+
+def test_failed_write_is_retried(tmp_path):
+    store = HashStore(str(tmp_path / "hashes.sqlite"), batchSize=2, flushSeconds=3600)
+    runtime = Runtime({"hashStore": store}, CountingCaptureBackend(1)).start()
+
+    insert = store._insert
+    def failOnce(records):
+        store._insert = insert
+        raise OSError("disk full")
+    store._insert = failOnce
+
+    rng = numpy.random.default_rng(0)
+    hashes = [ImageHash(bits) for bits in rng.random((3, 8, 8)) < 0.5]
+    store.add("BlueTB", hashes[0])
+    store.add("BlueTB", hashes[1])
+    runtime.io.wait()
+    # The failed batch is pending again and goes out with the next one
+    assert [r.id for r in store.pending] == [0, 1]
+    assert runtime.stats()["io"].failed == runtime.io.failures == 1
+
+    store.add("BlueTB", hashes[2])
+    store.sync()
+    assert store.load_sequence("BlueTB")[0] == [0, 1, 2]
+    assert "1 failed" in str(runtime.stats()["io"])
+    runtime.stop()
+    store.close()
+
+def test_save_image_on_io_worker(tmp_path):
+    worker = IOWorker()
+    frame = numpy.zeros((4, 6, 3), dtype=numpy.uint8)
+    fileName = str(tmp_path / "frame.png")
+    run = {"frame": frame, "ioWorker": worker}
+    step = {"image": ["run", ["frame"]], "fileName": ["const", fileName]}
+
+    seqEx_saveImage(step, run)
+    # The queued save holds a copy, not the live buffer
+    frame[:] = 255
+    worker.close()
+
+    assert step["result"]
+    with Image.open(fileName) as im:
+        assert (numpy.asarray(im) == 0).all()
@@ -0,0 +1,145 @@
+import os
+import numpy
+from common.ss_Capture import get_capture_backend
+from common.ss_CompileCache import cachePath
+from common.ss_ExecuteTOMLscript import initRun, initWorkerRun, executeTOMLsequences, sequenceLevels
+from common.ss_SequencePool import SequencePool
+import pytest
+
+red = (237, 28, 36)
+green = (34, 177, 76)
+
+runTOML = """
+[colors.red]
+tolerance = 0
+pureReq = true
+
+[colors.red.color]
+r = 237
+g = 28
+b = 36
+
+[colors.green]
+tolerance = 0
+pureReq = true
+
+[colors.green.color]
+r = 34
+g = 177
+b = 76
+
+[sequence.rowScan]
+parallel = true
+
+[sequence.rowScan.1]
+function = "getPixelRow_Absolute"
+image = [ "core", "screenShot_Whole_npArray", ]
+row = [ "const", 2, ]
+
+[sequence.rowScan.2]
+function = "pixelSequenceScan_Tracked"
+pixels = [ "run", [ "sequence", "rowScan", "1", "result", ], ]
+colors = [ "colors", [ "red", "green", ], ]
+continue = [ "run", [ "sequence", "rowScan", "2", "result", 0, ], ]
+
+[sequence.columnScan]
+parallel = true
+after = [ "rowScan", ]
+
+[sequence.columnScan.1]
+function = "getPixelColumn_Absolute"
+image = [ "core", "screenShot_Whole_npArray", ]
+column = [ "run", [ "sequence", "rowScan", "2", "result", 1, 1, "startPixel", ], ]
+
+[sequence.columnScan.2]
+function = "pixelSequenceScan"
+pixels = [ "run", [ "sequence", "columnScan", "1", "result", ], ]
+colors = [ "colors", [ "green", ], ]
+
+[sequence.mainScan]
+
+[sequence.mainScan.1]
+function = "getPixelRow_Absolute"
+image = [ "core", "screenShot_Whole_npArray", ]
+row = [ "const", 2, ]
+"""
+
+def makeFrame(greenStart : int) -> numpy.ndarray:
+    frame = numpy.zeros((12, 16, 3), dtype=numpy.uint8)
+    frame[2, greenStart - 2:greenStart] = red
+    frame[2, greenStart:greenStart + 3] = green
+    frame[5:9, greenStart] = green
+    return frame
+
+def runFrames(run : dict, execute, frames : list) -> list:
+    out = []
+    for frame in frames:
+        run["coreFeatures"].set_frame(frame, 0.0)
+        results = execute(run)
+        out.append((
+            results,
+            run["sequence"]["rowScan"]["2"]["result"],
+            run["sequence"]["columnScan"]["2"]["result"],
+            run["sequence"]["columnScan"].get("runCount"),
+        ))
+    return out
+
+@pytest.fixture
+def runPath(tmp_path):
+    path = tmp_path / "run.toml"
+    path.write_text(runTOML)
+    return str(path)
+
+def test_levels_follow_dependencies(runPath):
+    run = initRun(runPath)
+    assert sequenceLevels(run) == [["rowScan", "mainScan"], ["columnScan"]]
+
+    run["sequence"]["rowScan"]["after"] = ["columnScan"]
+    run.pop("sequenceLevels")
+    with pytest.raises(ValueError):
+        sequenceLevels(run)
+
+def test_pool_matches_serial(runPath):
+    frames = [makeFrame(6), makeFrame(6), makeFrame(9)]
+
+    serial = runFrames(initRun(runPath), executeTOMLsequences, frames)
+
+    run = initRun(runPath)
+    pool = SequencePool(run)
+    try:
+        assert sorted(pool.assignment) == ["columnScan", "rowScan"]
+        parallel = runFrames(run, lambda run: pool.execute(), frames)
+    finally:
+        pool.close()
+
+    assert parallel == serial
+    # The unchanged second frame was skipped in the worker too
+    assert [runCount for *_, runCount in parallel] == [1, 1, 2]
+    assert run["frameStats"] == {"processed": 2, "skipped": 1}
+
+def test_worker_run_holds_only_sequences(runPath):
+    backend = get_capture_backend()
+    with open(runPath, "a") as f:
+        f.write('\n[capture]\nbackend = "pil"\nchangeTileSize = 4\n')
+
+    run = initWorkerRun(runPath)
+    assert "hashStore" not in run and run["compileCache"] is None
+    assert get_capture_backend() is backend
+    assert not os.path.exists(os.path.join(os.path.dirname(runPath), "hashes.sqlite"))
+    assert not os.path.exists(cachePath(os.path.dirname(runPath)))
+    assert [step["function"] for step, _, _ in run["sequence"]["rowScan"]["plan"]] == ["getPixelRow_Absolute", "pixelSequenceScan_Tracked"]
+
+def test_no_workers_runs_everything_in_the_parent(runPath):
+    frames = [makeFrame(6), makeFrame(9)]
+    serial = runFrames(initRun(runPath), executeTOMLsequences, frames)
+
+    run = initRun(runPath)
+    pool = SequencePool(run, workerCount=0)
+    try:
+        assert pool.assignment == {} and pool.workers == []
+        assert runFrames(run, lambda run: pool.execute(), frames) == serial
+    finally:
+        pool.close()
+
+    with pytest.raises(ValueError):
+        SequencePool(run, workerCount=-1)